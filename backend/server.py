@@ -2,12 +2,11 @@ import sys
 sys.path.append('.')
 
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, status, UploadFile, File, Form, Header
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, Response
 from fastapi.security import HTTPBearer
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
@@ -26,9 +25,11 @@ sys.path.insert(0, str(src_path))
 from josmoze_ecommerce.backend.services.stripe_service import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 
 # Import security and performance middleware
-from security_middleware import SecurityMiddleware, CacheMiddleware, get_security_stats, clear_cache
-from analytics_dashboard import AnalyticsEngine, export_analytics_csv
-from recommendation_engine import get_smart_recommendations
+from security_middleware import SecurityMiddleware, CacheMiddleware, get_security_stats, clear_cache, close_redis
+from cache_invalidation import get_cache_bus, invalidate_cache
+from analytics_dashboard import AnalyticsEngine, stream_analytics_csv
+from analytics_rollups import get_analytics_rollups, ORDER_AMOUNT_EXPR
+from recommendation_engine import get_smart_recommendations, get_co_purchase_index, record_order_for_recommendations
 from loyalty_program import LoyaltyProgramManager, process_order_loyalty_points, get_customer_loyalty_status
 
 # Import translation service
@@ -36,6 +37,8 @@ from translation_service import translation_service
 
 # Import email service
 from email_service import email_service
+from mail_transport import get_mail_transport
+from email_queue import get_email_queue
 
 # Import brand monitoring agent
 from brand_monitoring_agent import brand_monitor, start_brand_monitoring, get_brand_monitoring_status, force_brand_scan, start_monitoring_task
@@ -63,11 +66,11 @@ from testimonials_manager import get_testimonials_manager, CustomerTestimonial,
 from ai_product_scraper import get_ai_scraper
 
 # Import authentication and AI agents
-from auth import User, UserAuth, Token, authenticate_user, create_access_token, get_current_user, require_role, get_company_info, get_user_permissions
+from auth import User, UserAuth, Token, authenticate_user_async, create_access_token, get_current_user, require_role, get_company_info, get_user_permissions
 from ai_agents import get_marketing_automation, MarketingAutomation
 
 # Import new inventory management and social media automation systems
-from inventory_manager import get_inventory_manager, StockItem, CustomerProfile, OrderTracking, Invoice
+from inventory_manager import get_inventory_manager, StockItem, CustomerProfile, OrderTracking, Invoice, SERVICE_PRODUCTS, STOCK_RESERVATION_CONFIG
 from social_media_automation import get_social_media_automation, SocialMediaAutomation, Campaign, AdCreative
 from payment_manager import get_payment_manager
 from promotions_manager import PromotionsManager, init_promotions_manager, get_promotions_manager
@@ -75,15 +78,20 @@ from promotions_manager import PromotionsManager, init_promotions_manager, get_p
 from promotions_system import get_promotions_system, init_promotions_system, PromotionsSystem
 from user_auth_system import get_user_auth_system, init_user_auth_system, UserAuthSystem, UserRegistration, UserLogin
 from translation_service import translation_service
+from catalogue_snapshots import get_catalogue_snapshots
+from mongo_provider import get_mongo_provider
+from password_hasher import get_password_hasher, PasswordHasherOverloaded, PASSWORD_HASHING_CONFIG
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (client partagé avec tous les services)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+mongo_provider = get_mongo_provider(mongo_url, os.environ['DB_NAME'])
+client = mongo_provider.client
+db = mongo_provider.database()
+analytics_rollups = get_analytics_rollups(db)
 
 # Initialize marketing automation, inventory manager, and social media automation as global variables
 marketing_automation = None
@@ -260,6 +268,7 @@ class PaymentTransaction(BaseModel):
     status: str = "initiated"  # initiated, completed, failed
     customer_email: Optional[str] = None
     products: List[Dict[str, Any]] = []
+    reservation_id: Optional[str] = None  # Stock réservé pendant le paiement
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -403,7 +412,7 @@ async def process_abandoned_cart(customer_email: str, cart_items: List[Dict]):
         # Check if lead already exists
         existing_lead = await db.leads.find_one({"email": customer_email})
         if existing_lead:
-            await db.leads.update_one(
+            await analytics_rollups.update_lead(
                 {"email": customer_email},
                 {"$set": {
                     "lead_type": "abandoned_cart",
@@ -414,6 +423,7 @@ async def process_abandoned_cart(customer_email: str, cart_items: List[Dict]):
         else:
             lead = Lead(**lead_data)
             await db.leads.insert_one(lead.dict())
+            await analytics_rollups.record_lead(lead.dict())
         
         # Send abandoned cart email
         await send_welcome_email(customer_email, "Prospect", "abandoned_cart")
@@ -530,22 +540,21 @@ async def get_products(customer_type: str = "B2C"):
         logging.warning("⚠️ Aucun produit trouvé en base de données")
         return []
     
+    # Statuts de stock de tous les produits en une requête
+    stock_statuses = {}
+    if inventory_manager:
+        try:
+            stock_statuses = await inventory_manager.get_stock_status_many([product["id"] for product in products_data])
+        except Exception as e:
+            logging.warning(f"⚠️ Could not get stock status: {e}")
+    else:
+        logging.warning("⚠️ Inventory manager not initialized, using default stock")
+    
     # Enrichir avec les informations de stock
     enriched_products = []
     for product in products_data:
         product_obj = Product(**product)
-        
-        # Obtenir le statut du stock
-        stock_status = {}
-        if inventory_manager:
-            try:
-                stock_status = await inventory_manager.get_stock_status(product["id"])
-            except Exception as e:
-                logging.warning(f"⚠️ Could not get stock status for {product['id']}: {e}")
-                stock_status = {"available_stock": 50}  # Default fallback
-        else:
-            logging.warning("⚠️ Inventory manager not initialized, using default stock")
-            stock_status = {"available_stock": 50}  # Default fallback
+        stock_status = stock_statuses.get(product["id"], {"available_stock": 50})  # Default fallback
         
         # Ajouter les infos de stock au produit - TOUS les produits sont EN STOCK selon exigence client
         product_dict = product_obj.dict()
@@ -674,49 +683,9 @@ async def get_translated_products(
             client_ip = translation_service.get_client_ip(request)
             language = translation_service.get_user_language_from_ip(client_ip)
         
-        # Récupérer les produits originaux
-        products_data = await db.products.find({"target_audience": {"$in": [customer_type, "both"]}}).to_list(1000)
-        if not products_data:
-            logging.warning("⚠️ Aucun produit trouvé pour traduction")
-            return {"products": [], "message": "Aucun produit disponible"}
-        
-        # Traduire chaque produit si nécessaire
-        translated_products = []
-        for product in products_data:
-            if language != "FR":
-                # Traduire le produit
-                translated_product = await translation_service.translate_object(product, language)
-            else:
-                translated_product = product
-            
-            # Ajouter les informations de stock
-            product_obj = Product(**translated_product)
-            stock_status = {}
-            if inventory_manager:
-                try:
-                    stock_status = await inventory_manager.get_stock_status(product["id"])
-                except Exception as e:
-                    logging.warning(f"⚠️ Could not get stock status for {product['id']}: {e}")
-                    stock_status = {"available_stock": 50}  # Default fallback
-            else:
-                logging.warning("⚠️ Inventory manager not initialized, using default stock")
-                stock_status = {"available_stock": 50}  # Default fallback
-            
-            product_dict = product_obj.dict()
-            product_dict["stock_info"] = {
-                "in_stock": True,  # Force TOUS les produits en stock selon exigence client
-                "show_stock_warning": False,  # Pas d'alerte stock
-                "stock_warning_text": None,
-                "available_stock": stock_status.get("available_stock", 50) if stock_status.get("available_stock", 0) > 0 else 50  # Stock minimum 50 unités
-            }
-            
-            translated_products.append(product_dict)
-        
-        return {
-            "products": translated_products,
-            "language": language,
-            "customer_type": customer_type
-        }
+        # Catalogue précalculé (traduit + stock), servi en JSON déjà sérialisé
+        snapshots = get_catalogue_snapshots(db, Product)
+        return Response(content=await snapshots.get(language, customer_type), media_type="application/json")
         
     except Exception as e:
         logging.error(f"Error in translated products: {str(e)}")
@@ -805,6 +774,13 @@ async def get_available_languages():
     """
     return translation_service.get_available_languages()
 
+@api_router.get("/localization/cache-stats")
+async def get_translation_cache_stats():
+    """
+    Statistiques de la mémoire de traduction (hits, misses, taille)
+    """
+    return translation_service.get_cache_stats()
+
 @api_router.post("/localization/translate-bulk")
 async def translate_bulk_content(
     content: Dict[str, Any],
@@ -851,6 +827,7 @@ async def create_lead(lead: Lead, request: Request):
     
     # Store lead in database
     await db.leads.insert_one(lead.dict())
+    await analytics_rollups.record_lead(lead.dict())
     
     # Trigger welcome automation
     if marketing_automation:
@@ -873,7 +850,7 @@ async def request_consultation(consultation: ConsultationRequest):
         await db.consultations.insert_one(consultation.dict())
         
         # Update lead status
-        await db.leads.update_one(
+        await analytics_rollups.update_lead(
             {"id": consultation.lead_id},
             {"$set": {
                 "consultation_requested": True,
@@ -895,6 +872,7 @@ async def create_order(order: Order):
     """Create new order"""
     order_dict = order.dict()
     await db.orders.insert_one(order_dict)
+    await analytics_rollups.record_order(order_dict)
     
     # Create lead from order if not exists
     existing_lead = await db.leads.find_one({"email": order.customer_email})
@@ -911,9 +889,10 @@ async def create_order(order: Order):
         }
         lead = Lead(**lead_data)
         await db.leads.insert_one(lead.dict())
+        await analytics_rollups.record_lead(lead.dict())
     else:
         # Update existing lead
-        await db.leads.update_one(
+        await analytics_rollups.update_lead(
             {"email": order.customer_email},
             {"$set": {"status": "converted", "score": 100}}
         )
@@ -929,6 +908,7 @@ async def submit_contact_form(form: ContactForm, request: Request):
         # Store contact form
         form_dict = form.dict()
         await db.contact_forms.insert_one(form_dict)
+        await analytics_rollups.record_contact(form_dict)
         
         # Create lead from contact form
         location = await detect_location(request)
@@ -950,6 +930,7 @@ async def submit_contact_form(form: ContactForm, request: Request):
         lead.score = calculate_lead_score(lead_data)
         
         await db.leads.insert_one(lead.dict())
+        await analytics_rollups.record_lead(lead.dict())
         
         # Trigger welcome automation
         if marketing_automation:
@@ -1147,37 +1128,54 @@ async def get_leads(status: Optional[str] = None, customer_type: Optional[str] =
 async def get_crm_dashboard():
     """Get CRM dashboard statistics"""
     try:
-        # Count leads by status
-        leads_by_status = {}
-        for status in ["new", "contacted", "qualified", "converted", "lost"]:
-            count = await db.leads.count_documents({"status": status})
-            leads_by_status[status] = count
-        
-        # Count leads by type
-        leads_by_type = {}
-        for lead_type in ["contact", "quote", "consultation", "abandoned_cart"]:
-            count = await db.leads.count_documents({"lead_type": lead_type})
-            leads_by_type[lead_type] = count
-        
-        # Recent activity
-        recent_leads = await db.leads.find().sort("created_at", -1).limit(10).to_list(10)
-        recent_orders = await db.orders.find().sort("created_at", -1).limit(10).to_list(10)
+        lead_statuses = ["new", "contacted", "qualified", "converted", "lost"]
+        lead_types = ["contact", "quote", "consultation", "abandoned_cart"]
         
         # Revenue stats
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         week_ago = today - timedelta(days=7)
         
-        daily_orders = await db.orders.count_documents({"created_at": {"$gte": today}})
-        weekly_orders = await db.orders.count_documents({"created_at": {"$gte": week_ago}})
-        
-        # Calculate revenue
-        weekly_revenue_pipeline = [
-            {"$match": {"created_at": {"$gte": week_ago}, "status": "paid"}},
-            {"$group": {"_id": None, "total": {"$sum": "$total"}}}
-        ]
+        if await analytics_rollups.is_ready():
+            # Lecture des rollups journaliers: O(jours) au lieu de O(documents)
+            all_days = await analytics_rollups.get_all_days()
+            status_totals = analytics_rollups.sum_counters(all_days, "leads_by_status")
+            type_totals = analytics_rollups.sum_counters(all_days, "leads_by_type")
+            leads_by_status = {status: status_totals.get(status, 0) for status in lead_statuses}
+            leads_by_type = {lead_type: type_totals.get(lead_type, 0) for lead_type in lead_types}
+            
+            week_days = [day for day in all_days if day["_id"] >= week_ago.date().isoformat()]
+            today_days = [day for day in week_days if day["_id"] >= today.date().isoformat()]
+            daily_orders = analytics_rollups.sum_orders(today_days)["count"]
+            weekly_orders = analytics_rollups.sum_orders(week_days)["count"]
+            weekly_revenue = analytics_rollups.sum_orders(week_days, ["paid"])["revenue"]
+        else:
+            # Count leads by status
+            leads_by_status = {}
+            for status in lead_statuses:
+                count = await db.leads.count_documents({"status": status})
+                leads_by_status[status] = count
+            
+            # Count leads by type
+            leads_by_type = {}
+            for lead_type in lead_types:
+                count = await db.leads.count_documents({"lead_type": lead_type})
+                leads_by_type[lead_type] = count
+            
+            daily_orders = await db.orders.count_documents({"created_at": {"$gte": today}})
+            weekly_orders = await db.orders.count_documents({"created_at": {"$gte": week_ago}})
+            
+            # Calculate revenue
+            weekly_revenue_pipeline = [
+                {"$match": {"created_at": {"$gte": week_ago}, "status": "paid"}},
+                {"$group": {"_id": None, "total": {"$sum": ORDER_AMOUNT_EXPR}}}
+            ]
+            
+            revenue_result = await db.orders.aggregate(weekly_revenue_pipeline).to_list(1)
+            weekly_revenue = revenue_result[0]["total"] if revenue_result else 0
         
-        revenue_result = await db.orders.aggregate(weekly_revenue_pipeline).to_list(1)
-        weekly_revenue = revenue_result[0]["total"] if revenue_result else 0
+        # Recent activity
+        recent_leads = await db.leads.find().sort("created_at", -1).limit(10).to_list(10)
+        recent_orders = await db.orders.find().sort("created_at", -1).limit(10).to_list(10)
         
         return {
             "leads_by_status": leads_by_status,
@@ -1201,7 +1199,7 @@ async def update_lead(lead_id: str, update_data: Dict[str, Any]):
     try:
         update_data["last_activity"] = datetime.utcnow()
         
-        await db.leads.update_one(
+        await analytics_rollups.update_lead(
             {"id": lead_id},
             {"$set": update_data}
         )
@@ -1426,6 +1424,20 @@ async def get_comprehensive_analytics(
             detail="Failed to generate analytics dashboard"
         )
 
+@crm_router.post("/analytics/rollups/rebuild")
+async def rebuild_analytics_rollups(
+    current_user: User = Depends(require_role(["manager"]))
+):
+    """Rebuild daily analytics rollups from history (Manager only)"""
+    try:
+        return await analytics_rollups.rebuild()
+    except Exception as e:
+        logging.error(f"Analytics rollups rebuild error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to rebuild analytics rollups"
+        )
+
 @crm_router.get("/analytics/export/csv")
 async def export_analytics_data(
     date_range: int = 30,
@@ -1433,13 +1445,8 @@ async def export_analytics_data(
 ):
     """Export analytics data as CSV (Manager only)"""
     try:
-        csv_data = await export_analytics_csv(db, date_range)
-        
-        from io import StringIO
-        csv_io = StringIO(csv_data)
-        
         response = StreamingResponse(
-            iter([csv_data]),
+            stream_analytics_csv(db, date_range),
             media_type="text/csv",
             headers={"Content-Disposition": "attachment; filename=josmose_analytics.csv"}
         )
@@ -1852,13 +1859,47 @@ async def process_recovery_emails(current_user = Depends(require_role(["manager"
     Traiter les emails de récupération programmés (accessible aux managers ET agents)
     """
     try:
-        await abandoned_cart_service.process_scheduled_emails()
-        return {"success": True, "message": "Emails de récupération traités"}
+        result = await abandoned_cart_service.process_scheduled_emails()
+        return {"success": True, "message": "Emails de récupération mis en file d'envoi", **result}
         
     except Exception as e:
         logging.error(f"Erreur traitement emails: {str(e)}")
         raise HTTPException(status_code=500, detail="Erreur lors du traitement des emails")
 
+@api_router.get("/crm/email-queue/stats")
+async def get_email_queue_stats(current_user = Depends(require_role(["manager"]))):
+    """
+    État de la file d'envoi d'emails (par type et statut) et dernières lettres mortes
+    """
+    try:
+        email_queue = get_email_queue(db)
+        stats = await email_queue.get_stats()
+        dead_letters = await email_queue.get_dead_letters(limit=20)
+        return {
+            "success": True,
+            "stats": stats,
+            "dead_letters": [
+                {
+                    "id": job["_id"],
+                    "kind": job["kind"],
+                    "attempts": job["attempts"],
+                    "last_error": job.get("last_error"),
+                    "dead_at": job.get("dead_at")
+                }
+                for job in dead_letters
+            ]
+        }
+    except Exception as e:
+        logging.error(f"Erreur stats file emails: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erreur lors de la lecture de la file d'envoi")
+
+@api_router.get("/crm/database/pool-stats")
+async def get_database_pool_stats(current_user = Depends(require_role(["manager"]))):
+    """
+    Utilisation du pool de connexions MongoDB partagé
+    """
+    return {"success": True, "pool": mongo_provider.get_pool_stats()}
+
 # ========== ENDPOINTS AGENT SÉCURITÉ & AUDIT ==========
 
 @api_router.get("/crm/security/dashboard")
@@ -2050,32 +2091,46 @@ async def create_checkout_session(checkout: CheckoutRequest, request: Request):
                 "total": item_total
             })
         
-        # Add shipping cost based on detected location
-        location_data = await detect_location(request)
-        shipping_cost = location_data.shipping_cost
-        total_amount += shipping_cost
-        currency = location_data.currency.lower()
-        
-        # Build success and cancel URLs
-        origin_url = checkout.origin_url.rstrip('/')
-        success_url = f"{origin_url}/payment-success?session_id={{CHECKOUT_SESSION_ID}}"
-        cancel_url = f"{origin_url}/payment-cancelled"
-        
-        # Create checkout session
-        checkout_request = CheckoutSessionRequest(
-            amount=total_amount,
-            currency=currency,
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={
-                "customer_email": checkout.customer_info.get("email", ""),
-                "customer_name": checkout.customer_info.get("name", ""),
-                "source": "josmose_checkout",
-                "products_count": str(len(checkout.cart_items))
-            }
+        # Réserver le stock du panier pendant le paiement. Le catalogue est affiché
+        # toujours en stock: un manque est réservé en rupture plutôt que refusé
+        reservation = await inventory_manager.reserve_items(
+            products, allow_backorder=STOCK_RESERVATION_CONFIG["checkout_backorder"]
         )
+        if not reservation["success"]:
+            raise HTTPException(status_code=409, detail=reservation["error"])
+        reservation_id = reservation["reservation_id"]
         
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+        try:
+            # Add shipping cost based on detected location
+            location_data = await detect_location(request)
+            shipping_cost = location_data.shipping_cost
+            total_amount += shipping_cost
+            currency = location_data.currency.lower()
+            
+            # Build success and cancel URLs
+            origin_url = checkout.origin_url.rstrip('/')
+            success_url = f"{origin_url}/payment-success?session_id={{CHECKOUT_SESSION_ID}}"
+            cancel_url = f"{origin_url}/payment-cancelled"
+            
+            # Create checkout session
+            checkout_request = CheckoutSessionRequest(
+                amount=total_amount,
+                currency=currency,
+                success_url=success_url,
+                cancel_url=cancel_url,
+                metadata={
+                    "customer_email": checkout.customer_info.get("email", ""),
+                    "customer_name": checkout.customer_info.get("name", ""),
+                    "source": "josmose_checkout",
+                    "products_count": str(len(checkout.cart_items))
+                }
+            )
+            
+            session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+        except Exception:
+            # Paiement non créé: rendre le stock réservé
+            await inventory_manager.release_reservation(reservation_id)
+            raise
         
         # Create payment transaction record
         transaction = PaymentTransaction(
@@ -2085,6 +2140,7 @@ async def create_checkout_session(checkout: CheckoutRequest, request: Request):
             metadata=checkout_request.metadata,
             customer_email=checkout.customer_info.get("email"),
             products=products,
+            reservation_id=reservation_id,
             payment_status="pending",
             status="initiated"
         )
@@ -2095,6 +2151,8 @@ async def create_checkout_session(checkout: CheckoutRequest, request: Request):
         
         return {"url": session.url, "session_id": session.session_id}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Checkout session creation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2208,13 +2266,18 @@ async def create_order_from_payment(transaction_data: Dict, payment_status: Chec
         
         # Sauvegarder la commande
         await db.orders.insert_one(order.dict())
+        await analytics_rollups.record_order(order.dict())
+        record_order_for_recommendations(order.dict())
         
         # 🔥 NOUVELLES FONCTIONNALITÉS AUTOMATIQUES 🔥
         
-        # 1. Confirmer l'utilisation du stock pour chaque produit
-        for item in order.items:
-            if item.product_id not in ["garantie-2ans", "garantie-5ans", "installation-service"]:  # Services illimités
-                await inventory_manager.confirm_stock_usage(item.product_id, item.quantity)
+        # 1. Confirmer l'utilisation du stock (réservation posée au checkout, sinon produit par produit)
+        if transaction_data.get("reservation_id"):
+            await inventory_manager.confirm_reservation(transaction_data["reservation_id"])
+        else:
+            for item in order.items:
+                if item.product_id not in SERVICE_PRODUCTS:  # Services illimités
+                    await inventory_manager.confirm_stock_usage(item.product_id, item.quantity)
         
         # 2. Générer automatiquement la facture PDF
         try:
@@ -2271,6 +2334,10 @@ async def startup_db():
     global inventory_manager
     inventory_manager = get_inventory_manager(db)
     await inventory_manager.initialize_stock()
+    inventory_manager.start_reservation_sweeper()
+    
+    # Loyalty ledger indexes (idempotency) + lifetime counters
+    await LoyaltyProgramManager(db).initialize_ledger()
     
     # Initialize social media automation
     global social_media_automation
@@ -2305,6 +2372,33 @@ async def startup_db():
     await init_promotions_system(db)
     await init_user_auth_system(db)
     
+    # Rollups analytics journaliers
+    await analytics_rollups.create_indexes()
+    
+    # Mémoire de traduction persistante (préchargée pour éviter de repayer DeepL)
+    try:
+        await translation_service.attach_memory(db)
+    except Exception as e:
+        logging.error(f"❌ Failed to load translation memory: {e}")
+    
+    # Index de co-achat pour les recommandations
+    try:
+        await get_co_purchase_index(db)
+    except Exception as e:
+        logging.error(f"❌ Failed to build co-purchase index: {e}")
+    
+    # File d'envoi d'emails: handlers enregistrés par les services, puis workers
+    try:
+        await get_email_sequencer_manager()
+        email_queue = get_email_queue(db)
+        await email_queue.create_indexes()
+        email_queue.start()
+    except Exception as e:
+        logging.error(f"❌ Failed to start email queue: {e}")
+    
+    # Invalidation du cache de réponses diffusée entre workers (Redis pub/sub)
+    await get_cache_bus().start()
+    
     logging.info("✅ Tous les services initialisés avec succès (Phase 9 included)")
     
     # 🚀 Démarrage automatique de l'agent de sécurité et d'audit 24/7
@@ -2313,16 +2407,39 @@ async def startup_db():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    if inventory_manager is not None:
+        await inventory_manager.stop_reservation_sweeper()
+    if suppression_manager is not None:
+        await suppression_manager.stop_cache()
+    await get_email_queue(db).stop()
+    if email_sequencer_manager is not None:
+        await email_sequencer_manager.close()
+    await get_mail_transport().close()
+    await get_cache_bus().stop()
+    await translation_service.close()
+    await close_redis()
+    mongo_provider.close()
+    get_password_hasher().shutdown()
 
 
 # ========== AUTHENTICATION ENDPOINTS ==========
 
+def password_hashing_unavailable() -> HTTPException:
+    """Pool bcrypt saturé: rejeter plutôt que bloquer les autres requêtes"""
+    return HTTPException(
+        status_code=503,
+        detail="Service d'authentification surchargé, veuillez réessayer",
+        headers={"Retry-After": str(PASSWORD_HASHING_CONFIG["retry_after"])}
+    )
+
 @api_router.post("/auth/login")
 async def login(user_auth: UserAuth) -> Token:
     """Login endpoint for CRM access"""
     # Authenticate user (now supports email login)
-    user_data = authenticate_user(user_auth.username, user_auth.password)
+    try:
+        user_data = await authenticate_user_async(user_auth.username, user_auth.password)
+    except PasswordHasherOverloaded:
+        raise password_hashing_unavailable()
     
     if not user_data:
         raise HTTPException(
@@ -3789,7 +3906,8 @@ async def import_suppression_csv(
                 "status": "success",
                 "message": result["message"],
                 "imported_count": result["imported_count"],
-                "errors": result["errors"]
+                "errors": result["errors"],
+                "error_count": result["error_count"]
             }
         else:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -3798,36 +3916,63 @@ async def import_suppression_csv(
         logging.error(f"Erreur import CSV suppression list: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
-@app.get("/api/suppression-list/export-csv")
-async def export_suppression_csv(
+@app.post("/api/suppression-list/import-csv-file")
+async def import_suppression_csv_file(
+    file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Exporter la liste de suppression en CSV"""
+    """Importer un fichier CSV de suppression (lu en flux, par lots)"""
     # Vérifier les permissions manager
     if current_user.role != "manager":
         raise HTTPException(status_code=403, detail="Accès réservé aux managers")
     
     try:
         manager = await get_suppression_manager()
-        result = await manager.export_csv_suppression_list(
+        result = await manager.import_csv_suppression_file(
+            file_obj=file.file,
             agent_email=current_user.email
         )
         
         if result["success"]:
-            from fastapi.responses import StreamingResponse
-            import io
-            
-            # Créer un flux de données CSV
-            csv_data = io.StringIO(result["csv_content"])
-            
-            return StreamingResponse(
-                io.BytesIO(csv_data.getvalue().encode('utf-8')),
-                media_type="text/csv",
-                headers={"Content-Disposition": "attachment; filename=suppression_list.csv"}
-            )
+            return {
+                "status": "success",
+                "message": result["message"],
+                "imported_count": result["imported_count"],
+                "errors": result["errors"],
+                "error_count": result["error_count"]
+            }
         else:
-            raise HTTPException(status_code=500, detail=result["error"])
+            raise HTTPException(status_code=400, detail=result["error"])
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Erreur import fichier CSV suppression list: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+@app.get("/api/suppression-list/export-csv")
+async def export_suppression_csv(
+    current_user: User = Depends(get_current_user)
+):
+    """Exporter la liste de suppression en CSV"""
+    # Vérifier les permissions manager
+    if current_user.role != "manager":
+        raise HTTPException(status_code=403, detail="Accès réservé aux managers")
+    
+    try:
+        manager = await get_suppression_manager()
+        if not await manager.collection.find_one({}, {"_id": 1}):
+            raise HTTPException(status_code=500, detail="Aucune donnée à exporter")
+        
+        # Flux CSV par lots depuis le curseur MongoDB
+        return StreamingResponse(
+            manager.iter_csv_suppression_list(agent_email=current_user.email),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=suppression_list.csv"}
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Erreur export CSV suppression list: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
@@ -4269,6 +4414,7 @@ async def get_suppression_manager():
     if suppression_manager is None:
         suppression_manager = SuppressionListManager(db)
         await suppression_manager.create_indexes()
+        await suppression_manager.start_cache()
         logging.info("✅ Suppression List Manager initialized")
     return suppression_manager
 
@@ -5674,6 +5820,7 @@ async def upload_product_image(request: Request):
                     {"id": product_id},
                     {"$set": {"image_url": image_url, "updated_at": datetime.utcnow().isoformat()}}
                 )
+                await invalidate_cache(f"product:{product_id}", "products")
                 logging.info(f"✅ Image produit {product_id} mise à jour: {image_url}")
             except Exception as e:
                 logging.warning(f"⚠️ Mise à jour produit échouée (fichier sauvé): {e}")
@@ -5730,11 +5877,8 @@ async def get_all_promotions(active_only: bool = False):
 async def toggle_promotion_status(promotion_id: str):
     """Activer/désactiver promotion (Admin)"""
     try:
-        result = await db.promotions.update_one(
-            {"id": promotion_id},
-            [{"$set": {"active": {"$not": "$active"}}}]
-        )
-        return {"success": result.modified_count > 0}
+        promotions_sys = await get_promotions_system(db)
+        return {"success": await promotions_sys.toggle_promotion(promotion_id)}
     except Exception as e:
         logger.error(f"Error toggling promotion: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de la modification")
@@ -5848,6 +5992,8 @@ async def register_user(registration_data: UserRegistration):
         auth_sys = await get_user_auth_system(db)
         result = await auth_sys.register_user(registration_data)
         return result
+    except PasswordHasherOverloaded:
+        raise password_hashing_unavailable()
     except Exception as e:
         logger.error(f"Error registering user: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de l'inscription")
@@ -5859,6 +6005,8 @@ async def login_user(login_data: UserLogin):
         auth_sys = await get_user_auth_system(db)
         result = await auth_sys.login_user(login_data)
         return result
+    except PasswordHasherOverloaded:
+        raise password_hashing_unavailable()
     except Exception as e:
         logger.error(f"Error logging in user: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de la connexion")
@@ -5,23 +5,202 @@ Conformité RGPD pour les campagnes email
 """
 
 import os
+import io
 import csv
+import asyncio
 import hmac
 import hashlib
 import base64
+import math
 import uuid
-from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional, AsyncIterator, BinaryIO, TextIO
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 import pandas as pd
 from email_validator import validate_email, EmailNotValidError
 
+# Nombre maximal de messages d'erreur renvoyés par un import CSV
+MAX_IMPORT_ERRORS_REPORTED = 1000
+
+
+def _cache_key(email: str) -> str:
+    """Clé du cache: volontairement plus large que la comparaison exacte en base"""
+    return (email or "").strip().lower()
+
+
+class EmailBloomFilter:
+    """Filtre de Bloom compact (bytearray) pour l'appartenance à la liste de suppression"""
+    
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+    
+    def add(self, key: str) -> bool:
+        """Ajouter une clé; False si elle était déjà présente (count inchangé)"""
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SuppressionCache:
+    """
+    Cache d'appartenance en mémoire devant suppression_list.
+    
+    Un "non" du filtre de Bloom est définitif et évite l'aller-retour MongoDB;
+    un "peut-être" est toujours confirmé en base. Le cache est chargé au
+    démarrage puis tenu à jour par les ajouts locaux et un change stream
+    (ou, sans replica set, par un polling sur unsubscribed_at).
+    Les suppressions d'emails laissent des bits à 1: elles ne coûtent qu'une
+    confirmation en base, jamais un faux négatif.
+    """
+    
+    MIN_CAPACITY = 100_000
+    
+    def __init__(self, collection, poll_interval: float = 5.0, error_rate: float = 0.001):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.error_rate = error_rate
+        self.bloom: Optional[EmailBloomFilter] = None
+        self.mode = "disabled"
+        self._task: Optional[asyncio.Task] = None
+        self._reloading = False
+        self._last_sync: Optional[datetime] = None
+        self.stats = {"negative_hits": 0, "positive_checks": 0, "false_positives": 0}
+    
+    @property
+    def ready(self) -> bool:
+        return self.bloom is not None
+    
+    async def load(self):
+        """(Re)construire le filtre depuis la collection"""
+        self._last_sync = datetime.now(timezone.utc)
+        count = await self.collection.estimated_document_count()
+        bloom = EmailBloomFilter(max(count * 2, self.MIN_CAPACITY), self.error_rate)
+        
+        async for doc in self.collection.find({}, {"_id": 0, "email": 1}).batch_size(5000):
+            bloom.add(_cache_key(doc.get("email")))
+        
+        self.bloom = bloom
+        print(f"✅ Cache suppression_list chargé: {bloom.count} emails")
+    
+    def add(self, email: str):
+        if self.bloom is None:
+            return
+        # Les emails déjà vus (re-polling, change stream) ne comptent pas pour la saturation
+        if not self.bloom.add(_cache_key(email)):
+            return
+        if self.bloom.count > self.bloom.capacity and self._task is not None and not self._reloading:
+            # Filtre saturé: le taux de faux positifs grimpe, reconstruire
+            self._reloading = True
+            asyncio.create_task(self._reload())
+    
+    async def _reload(self):
+        try:
+            await self.load()
+        except Exception as e:
+            print(f"⚠️ Erreur lors du rechargement du cache suppression_list: {e}")
+        finally:
+            self._reloading = False
+    
+    def might_contain(self, email: str) -> bool:
+        if self.bloom is None:
+            return True
+        if _cache_key(email) in self.bloom:
+            self.stats["positive_checks"] += 1
+            return True
+        self.stats["negative_hits"] += 1
+        return False
+    
+    async def start(self):
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    async def _sync_loop(self):
+        try:
+            pipeline = [{"$match": {"operationType": {"$in": ["insert", "replace", "update"]}}}]
+            async with self.collection.watch(pipeline, full_document="updateLookup") as stream:
+                self.mode = "change_stream"
+                # Rattraper les écritures survenues pendant le chargement initial
+                await self._poll_once()
+                async for change in stream:
+                    document = change.get("fullDocument") or {}
+                    if document.get("email"):
+                        self.add(document["email"])
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure:
+            # Pas de replica set: change streams indisponibles
+            pass
+        except Exception as e:
+            print(f"⚠️ Change stream suppression_list interrompu: {e}")
+        
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll_once()
+            except Exception as e:
+                print(f"⚠️ Erreur de synchronisation du cache suppression_list: {e}")
+    
+    async def _poll_once(self):
+        """Ajouter les emails insérés depuis la dernière synchronisation"""
+        since = self._last_sync - timedelta(minutes=1)
+        self._last_sync = datetime.now(timezone.utc)
+        async for doc in self.collection.find({"unsubscribed_at": {"$gte": since}}, {"_id": 0, "email": 1}):
+            self.add(doc.get("email"))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode if self.ready else "disabled",
+            "entries": self.bloom.count if self.bloom else 0,
+            "capacity": self.bloom.capacity if self.bloom else 0,
+            **self.stats
+        }
+
+
 class SuppressionListManager:
     def __init__(self, db):
         self.db = db
         self.collection = db.suppression_list
         self.gdpr_journal = db.gdpr_journal
         self.secret_key = os.environ.get('UNSUBSCRIBE_SECRET_KEY', 'josmoze_unsubscribe_secret_2024!')
+        self.cache = SuppressionCache(self.collection)
+    
+    async def start_cache(self):
+        """Charger le cache d'appartenance et démarrer sa synchronisation"""
+        try:
+            await self.cache.start()
+        except Exception as e:
+            print(f"⚠️ Cache suppression_list indisponible, vérification en base: {e}")
+    
+    async def stop_cache(self):
+        await self.cache.stop()
         
     async def create_indexes(self):
         """Créer les index pour optimiser les performances"""
@@ -92,6 +271,7 @@ class SuppressionListManager:
             
             # Insérer dans la collection
             await self.collection.insert_one(suppression_entry)
+            self.cache.add(email)
             
             # Journaliser l'action GDPR
             await self.log_gdpr_action(
@@ -138,12 +318,37 @@ class SuppressionListManager:
     async def is_email_suppressed(self, email: str) -> bool:
         """Vérifier si un email est dans la liste de suppression"""
         try:
-            result = await self.collection.find_one({"email": email})
+            # Négatif certain: pas d'aller-retour en base
+            if not self.cache.might_contain(email):
+                return False
+            
+            result = await self.collection.find_one({"email": email}, {"_id": 1})
+            if result is None and self.cache.ready:
+                self.cache.stats["false_positives"] += 1
             return result is not None
         except Exception as e:
             print(f"Erreur lors de la vérification de suppression: {e}")
             return False
     
+    async def are_emails_suppressed(self, emails: List[str], chunk_size: int = 1000) -> Dict[str, bool]:
+        """Vérification groupée: une requête $in par lot pour les seuls candidats du cache"""
+        result = {email: False for email in emails}
+        candidates = [email for email in result if self.cache.might_contain(email)]
+        
+        try:
+            for i in range(0, len(candidates), chunk_size):
+                cursor = self.collection.find(
+                    {"email": {"$in": candidates[i:i + chunk_size]}}, {"_id": 0, "email": 1}
+                )
+                async for doc in cursor:
+                    result[doc["email"]] = True
+        except Exception as e:
+            print(f"Erreur lors de la vérification groupée de suppression: {e}")
+        
+        if self.cache.ready:
+            self.cache.stats["false_positives"] += len(candidates) - sum(result.values())
+        return result
+    
     async def get_suppression_list(
         self, 
         skip: int = 0, 
@@ -234,7 +439,8 @@ class SuppressionListManager:
                     "total_suppressed": total_suppressed,
                     "recent_suppressed_30d": recent_suppressed,
                     "by_reason": reason_stats,
-                    "by_source": source_stats
+                    "by_source": source_stats,
+                    "cache": self.cache.get_stats()
                 }
             }
             
@@ -247,61 +453,122 @@ class SuppressionListManager:
         agent_email: str = "system"
     ) -> Dict[str, Any]:
         """Importer une liste de suppression depuis un CSV"""
+        if not csv_content or not csv_content.strip():
+            return {"success": False, "error": "CSV vide ou format invalide"}
+        return await self.import_csv_suppression_stream(io.StringIO(csv_content.strip()), agent_email)
+    
+    async def import_csv_suppression_file(
+        self, 
+        file_obj: BinaryIO, 
+        agent_email: str = "system",
+        batch_size: int = 1000
+    ) -> Dict[str, Any]:
+        """Importer un fichier CSV (éventuellement plus gros que la mémoire, ex: UploadFile.file)"""
+        text_stream = io.TextIOWrapper(file_obj, encoding="utf-8-sig", newline="")
         try:
-            # Parser le CSV
-            lines = csv_content.strip().split('\n')
-            if len(lines) < 2:
-                return {"success": False, "error": "CSV vide ou format invalide"}
+            return await self.import_csv_suppression_stream(text_stream, agent_email, batch_size)
+        finally:
+            # Ne pas fermer le fichier sous-jacent, il appartient à l'appelant
+            text_stream.detach()
+    
+    async def import_csv_suppression_stream(
+        self, 
+        text_stream: TextIO, 
+        agent_email: str = "system",
+        batch_size: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Import en flux: parsing avec le module csv, normalisation et dédoublonnage
+        des emails, écriture par lots d'upserts non ordonnés et une entrée de
+        journal GDPR par lot. Les erreurs par ligne n'interrompent pas l'import.
+        """
+        try:
+            reader = csv.reader(text_stream)
             
             # Lire l'en-tête
-            headers = [h.strip().lower() for h in lines[0].split(',')]
+            header_row = await asyncio.to_thread(next, reader, None)
+            if not header_row:
+                return {"success": False, "error": "CSV vide ou format invalide"}
+            
+            headers = [h.strip().lstrip('\ufeff').lower() for h in header_row]
             if 'email' not in headers:
                 return {"success": False, "error": "Colonne 'email' obligatoire manquante"}
             
             imported_count = 0
+            error_count = 0
             errors = []
             
-            for line_num, line in enumerate(lines[1:], 2):
-                try:
-                    values = [v.strip() for v in line.split(',')]
+            def add_error(message: str):
+                nonlocal error_count
+                error_count += 1
+                if len(errors) < MAX_IMPORT_ERRORS_REPORTED:
+                    errors.append(message)
+            
+            batch_number = 0
+            while True:
+                rows = await asyncio.to_thread(self._read_csv_batch, reader, batch_size)
+                if not rows:
+                    break
+                batch_number += 1
+                
+                # Normaliser et dédoublonner dans le lot
+                batch = {}
+                for line_num, values in rows:
+                    if not any(v.strip() for v in values):
+                        continue
                     if len(values) != len(headers):
-                        errors.append(f"Ligne {line_num}: Nombre de colonnes incorrect")
+                        add_error(f"Ligne {line_num}: Nombre de colonnes incorrect")
                         continue
                     
-                    # Créer le dictionnaire des données
-                    row_data = dict(zip(headers, values))
-                    
-                    email = row_data.get('email', '').strip()
+                    row_data = {k: v.strip() for k, v in zip(headers, values)}
+                    email = row_data.get('email', '')
                     if not email:
-                        errors.append(f"Ligne {line_num}: Email vide")
+                        add_error(f"Ligne {line_num}: Email vide")
                         continue
                     
-                    reason = row_data.get('reason', 'import_csv')
-                    source = row_data.get('source', 'csv_import')
-                    notes = row_data.get('notes', f'Imported via CSV by {agent_email}')
+                    try:
+                        email = validate_email(email, check_deliverability=False).email
+                    except EmailNotValidError as e:
+                        add_error(f"Ligne {line_num} ({email}): Format email invalide: {str(e)}")
+                        continue
                     
-                    # Ajouter l'email
-                    result = await self.add_email_to_suppression_list(
-                        email=email,
-                        reason=reason,
-                        source=source,
-                        notes=notes,
-                        agent_email=agent_email
-                    )
+                    if email in batch:
+                        add_error(f"Ligne {line_num} ({email}): Doublon dans le fichier")
+                        continue
                     
-                    if result["success"]:
-                        imported_count += 1
-                    else:
-                        errors.append(f"Ligne {line_num} ({email}): {result['error']}")
-                        
-                except Exception as e:
-                    errors.append(f"Ligne {line_num}: Erreur de traitement - {str(e)}")
+                    batch[email] = (line_num, {
+                        "email": email,
+                        "reason": row_data.get('reason') or 'import_csv',
+                        "unsubscribed_at": datetime.now(timezone.utc),
+                        "source": row_data.get('source') or 'csv_import',
+                        "notes": row_data.get('notes') or f'Imported via CSV by {agent_email}'
+                    })
+                
+                if not batch:
+                    continue
+                
+                added, failed = await self._bulk_upsert_suppressions(list(batch.values()))
+                for email in added:
+                    self.cache.add(email)
+                imported_count += len(added)
+                for line_num, email, message in failed:
+                    add_error(f"Ligne {line_num} ({email}): {message}")
+                
+                # Une seule entrée de journal GDPR pour le lot
+                if added:
+                    await self.log_gdpr_action(
+                        action_type="add_suppression_batch",
+                        email="",
+                        details=f"CSV import batch {batch_number}: {len(added)} emails added",
+                        agent_email=agent_email,
+                        emails=added
+                    )
             
             # Journaliser l'import
             await self.log_gdpr_action(
                 action_type="csv_import",
                 email="",
-                details=f"Imported {imported_count} emails, {len(errors)} errors",
+                details=f"Imported {imported_count} emails, {error_count} errors",
                 agent_email=agent_email
             )
             
@@ -309,46 +576,120 @@ class SuppressionListManager:
                 "success": True,
                 "imported_count": imported_count,
                 "errors": errors,
-                "message": f"Import terminé: {imported_count} emails ajoutés, {len(errors)} erreurs"
+                "error_count": error_count,
+                "message": f"Import terminé: {imported_count} emails ajoutés, {error_count} erreurs"
             }
             
         except Exception as e:
             return {"success": False, "error": f"Erreur lors de l'import CSV: {str(e)}"}
     
-    async def export_csv_suppression_list(self, agent_email: str = "system") -> Dict[str, Any]:
-        """Exporter la liste de suppression en CSV"""
+    @staticmethod
+    def _read_csv_batch(reader, batch_size: int) -> List[tuple]:
+        """Lire jusqu'à batch_size lignes (numéro de ligne, valeurs)"""
+        rows = []
+        for values in reader:
+            rows.append((reader.line_num, values))
+            if len(rows) >= batch_size:
+                break
+        return rows
+    
+    async def _bulk_upsert_suppressions(self, entries: List[tuple]) -> tuple:
+        """
+        Upserts non ordonnés ($setOnInsert) pour un lot.
+        Retourne (emails ajoutés, [(ligne, email, erreur)]).
+        """
+        operations = [
+            UpdateOne({"email": entry["email"]}, {"$setOnInsert": entry}, upsert=True)
+            for _, entry in entries
+        ]
+        
+        failed_indexes = {}
         try:
-            # Récupérer toutes les suppressions
-            cursor = self.collection.find({}).sort("unsubscribed_at", -1)
-            suppression_list = await cursor.to_list(length=None)
-            
-            if not suppression_list:
-                return {"success": False, "error": "Aucune donnée à exporter"}
-            
-            # Créer le CSV
-            csv_content = "email,reason,source,unsubscribed_at,notes\n"
-            
-            for item in suppression_list:
-                email = item.get('email', '')
-                reason = item.get('reason', '')
-                source = item.get('source', '')
-                unsubscribed_at = item.get('unsubscribed_at', '').isoformat() if item.get('unsubscribed_at') else ''
-                notes = item.get('notes', '').replace('\n', ' ').replace(',', ';')
+            result = await self.collection.bulk_write(operations, ordered=False)
+            upserted_ids = result.upserted_ids
+        except BulkWriteError as e:
+            details = e.details
+            upserted_ids = {item["index"]: item["_id"] for item in details.get("upserted", [])}
+            for write_error in details.get("writeErrors", []):
+                failed_indexes[write_error["index"]] = write_error.get("errmsg", "Erreur d'écriture")
+        
+        added, failed = [], []
+        for index, (line_num, entry) in enumerate(entries):
+            if index in upserted_ids:
+                added.append(entry["email"])
+            elif index in failed_indexes:
+                failed.append((line_num, entry["email"], failed_indexes[index]))
+            else:
+                failed.append((line_num, entry["email"], "Email déjà dans la liste d'exclusion"))
+        
+        return added, failed
+    
+    async def iter_csv_suppression_list(
+        self, 
+        agent_email: str = "system", 
+        batch_size: int = 1000
+    ) -> AsyncIterator[str]:
+        """Exporter la liste de suppression en CSV, par lots depuis le curseur"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+        writer.writerow(["email", "reason", "source", "unsubscribed_at", "notes"])
+        
+        record_count = 0
+        sent_count = 0  # Lignes remises au flux (record_count inclut le lot en cours)
+        completed = False
+        cursor = self.collection.find(
+            {}, {"_id": 0, "email": 1, "reason": 1, "source": 1, "unsubscribed_at": 1, "notes": 1}
+        ).sort("unsubscribed_at", -1).batch_size(batch_size)
+        
+        try:
+            async for item in cursor:
+                unsubscribed_at = item.get('unsubscribed_at')
+                writer.writerow([
+                    item.get('email', ''),
+                    item.get('reason', ''),
+                    item.get('source', ''),
+                    unsubscribed_at.isoformat() if unsubscribed_at else '',
+                    item.get('notes', '')
+                ])
+                record_count += 1
                 
-                csv_content += f'"{email}","{reason}","{source}","{unsubscribed_at}","{notes}"\n'
-            
-            # Journaliser l'export
-            await self.log_gdpr_action(
+                if record_count % batch_size == 0:
+                    sent_count = record_count
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+            
+            if buffer.tell():
+                sent_count = record_count
+                yield buffer.getvalue()
+            completed = True
+        finally:
+            # Journaliser l'export, même interrompu (déconnexion du client, erreur en cours de flux)
+            if completed:
+                details = f"Exported {sent_count} suppression records"
+            else:
+                details = f"Export interrupted after {sent_count} suppression records (up to {record_count} read)"
+            # shield: la journalisation aboutit même si le flux est annulé
+            await asyncio.shield(self.log_gdpr_action(
                 action_type="csv_export",
                 email="",
-                details=f"Exported {len(suppression_list)} suppression records",
+                details=details,
                 agent_email=agent_email
-            )
+            ))
+    
+    async def export_csv_suppression_list(self, agent_email: str = "system") -> Dict[str, Any]:
+        """Exporter la liste de suppression en CSV (contenu complet en mémoire)"""
+        try:
+            record_count = await self.collection.count_documents({})
+            if not record_count:
+                return {"success": False, "error": "Aucune donnée à exporter"}
+            
+            chunks = [chunk async for chunk in self.iter_csv_suppression_list(agent_email)]
             
             return {
                 "success": True,
-                "csv_content": csv_content,
-                "record_count": len(suppression_list)
+                "csv_content": "".join(chunks),
+                "record_count": record_count
             }
             
         except Exception as e:
@@ -451,9 +792,10 @@ class SuppressionListManager:
         action_type: str, 
         email: str, 
         details: str, 
-        agent_email: str = "system"
+        agent_email: str = "system",
+        emails: Optional[List[str]] = None
     ):
-        """Journaliser une action GDPR"""
+        """Journaliser une action GDPR (emails: liste des adresses d'une action groupée)"""
         try:
             journal_entry = {
                 "timestamp": datetime.now(timezone.utc),
@@ -462,6 +804,8 @@ class SuppressionListManager:
                 "details": details,
                 "agent_email": agent_email
             }
+            if emails:
+                journal_entry["emails"] = emails
             
             await self.gdpr_journal.insert_one(journal_entry)
             
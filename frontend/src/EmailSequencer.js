@@ -84,7 +84,7 @@ const EmailSequencer = () => {
       
       if (response.data.status === 'success') {
         setShowStartModal(false);
-        alert(`✅ Séquence démarrée avec succès !\n\nID: ${response.data.data.sequence_id}\nProspects traités: ${response.data.data.total_prospects}\nEmails envoyés: ${response.data.data.email1_sent}\nIgnorés (suppression): ${response.data.data.skipped_count}`);
+        alert(`✅ Séquence démarrée avec succès !\n\nID: ${response.data.data.sequence_id}\nProspects traités: ${response.data.data.total_prospects}\nEmails mis en file: ${response.data.data.email1_queued}\nIgnorés (suppression): ${response.data.data.skipped_count}`);
         loadDashboardData();
       }
     } catch (error) {
@@ -127,7 +127,7 @@ const EmailSequencer = () => {
       
       if (response.data.status === 'success') {
         const data = response.data.data;
-        alert(`✅ Traitement des emails programmés terminé\n\nTraités: ${data.processed}\nEnvoyés: ${data.sent}\nErreurs: ${data.errors}`);
+        alert(`✅ Traitement des emails programmés terminé\n\nTraités: ${data.processed}\nMis en file: ${data.queued}`);
         loadDashboardData();
       }
     } catch (error) {
@@ -8,10 +8,10 @@ from datetime import datetime
 from fastapi import FastAPI, HTTPException, Request, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
 from .routers import products, auth, crm, ai_agents
+from .services.mongo_provider import get_mongo_provider
 from fastapi import APIRouter
 
 # Load environment variables
@@ -47,18 +47,9 @@ app.add_middleware(
 blog_router = APIRouter(prefix="/blog", tags=["blog"])
 
 @blog_router.get("/articles")
-async def get_blog_articles():
+async def get_blog_articles(db = Depends(products.get_database)):
     """Get all blog articles"""
     try:
-        import os
-        from motor.motor_asyncio import AsyncIOMotorClient
-        
-        MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
-        DB_NAME = os.environ.get("DB_NAME", "josmoze_production")
-        
-        client = AsyncIOMotorClient(MONGO_URL)
-        db = client[DB_NAME]
-        
         cursor = db.blog_articles.find({})
         articles = await cursor.to_list(length=None)
         
@@ -96,7 +87,7 @@ async def startup_event():
         mongodb_url = os.getenv("MONGODB_URL", os.getenv("MONGO_URL", "mongodb://localhost:27017"))
         db_name = os.getenv("DB_NAME", "josmoze_ecommerce")
         
-        db_client = AsyncIOMotorClient(mongodb_url)
+        db_client = get_mongo_provider(mongodb_url, db_name).client
         db = db_client[db_name]
         
         await db_client.admin.command('ping')
@@ -126,7 +117,7 @@ async def startup_event():
 async def shutdown_event():
     """Clean up on application shutdown"""
     if db_client:
-        db_client.close()
+        get_mongo_provider().close()
         logger.info("✅ Database connection closed")
 
 @app.get("/")
@@ -144,6 +135,7 @@ async def health_check():
     return {
         "status": "healthy", 
         "database": "connected" if db is not None else "disconnected",
+        "database_pool": get_mongo_provider().get_pool_stats(),
         "stripe": "configured" if stripe_checkout is not None else "not_configured",
         "timestamp": datetime.utcnow().isoformat()
     }
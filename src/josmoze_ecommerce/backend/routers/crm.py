@@ -6,18 +6,18 @@ from fastapi import APIRouter, HTTPException, Request, Depends
 from typing import List, Optional, Dict, Any
 import logging
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 
+from ..services.mongo_provider import get_mongo_provider
+
 router = APIRouter(prefix="/crm", tags=["crm"])
 
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "josmoze_production")
 
 async def get_database():
-    """Get database connection"""
-    client = AsyncIOMotorClient(MONGO_URL)
-    return client[DB_NAME]
+    """Get database connection (shared client pool)"""
+    return get_mongo_provider().database(DB_NAME)
 
 @router.get("/leads")
 async def get_leads():
@@ -93,7 +93,7 @@ async def get_contact_forms():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/admin/populate-blog")
-async def populate_blog_articles():
+async def populate_blog_articles(db = Depends(get_database)):
     """Admin endpoint to populate blog articles"""
     try:
         import sys
@@ -228,8 +228,6 @@ async def populate_blog_articles():
             }
         ]
         
-        db = await get_database()
-        
         await db.blog_articles.delete_many({})
         
         if TOUS_LES_ARTICLES:
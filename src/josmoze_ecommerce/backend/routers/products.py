@@ -6,24 +6,23 @@ from fastapi import APIRouter, HTTPException, Request, Depends
 from typing import List, Optional, Dict, Any
 import logging
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 
+from ..services.mongo_provider import get_mongo_provider
+
 router = APIRouter(prefix="/products", tags=["products"])
 
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "josmoze_production")
 
 async def get_database():
-    """Get database connection"""
-    client = AsyncIOMotorClient(MONGO_URL)
-    return client[DB_NAME]
+    """Get database connection (shared client pool)"""
+    return get_mongo_provider().database(DB_NAME)
 
 @router.get("/")
-async def get_products():
+async def get_products(db = Depends(get_database)):
     """Get all products with stock information"""
     try:
-        db = await get_database()
         cursor = db.products.find({})
         products = await cursor.to_list(length=None)
         
@@ -42,10 +41,9 @@ async def get_products():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{product_id}")
-async def get_product_detail(product_id: str):
+async def get_product_detail(product_id: str, db = Depends(get_database)):
     """Get detailed product information"""
     try:
-        db = await get_database()
         product = await db.products.find_one({"id": product_id})
         
         if not product:
@@ -63,10 +61,9 @@ async def get_product_detail(product_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/translated")
-async def get_translated_products():
+async def get_translated_products(db = Depends(get_database)):
     """Get products translated to user's language"""
     try:
-        db = await get_database()
         cursor = db.products.find({})
         products = await cursor.to_list(length=None)
         
@@ -85,15 +82,13 @@ async def get_translated_products():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/admin/populate")
-async def populate_products():
+async def populate_products(db = Depends(get_database)):
     """Admin endpoint to populate products from products_final.py"""
     try:
         import sys
         sys.path.append('./src')
         from josmoze_ecommerce.backend.models.products_final import FINAL_PRODUCTS
         
-        db = await get_database()
-        
         await db.products.delete_many({})
         
         if FINAL_PRODUCTS:
@@ -12,6 +12,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
 import json
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
@@ -22,6 +23,18 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from io import BytesIO
 import base64
 
+from email_queue import get_email_queue, PermanentDeliveryError, TransientDeliveryError, EMAIL_QUEUE_CONFIG
+from mail_transport import DeliveryOutcome
+from email_templates import get_template_registry
+
+# Partiel: une ligne d'article du panier dans les emails de récupération
+CART_ITEM_ROW_TEMPLATE = """
+                <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #E5E7EB;">
+                    <span>{{ item.get('name', 'Produit') }}</span>
+                    <span>{{ item.get('quantity', 1) }}x {{ item.get('price', 0) }}€</span>
+                </div>
+                """
+
 # Configuration des emails de récupération
 RECOVERY_CONFIG = {
     "immediate_delay_minutes": 30,    # Email immédiat après 30 minutes
@@ -83,6 +96,10 @@ class AbandonedCartService:
         self.db = db
         self.logger = logging.getLogger(__name__)
         
+        # File d'envoi persistante (workers partagés)
+        self.email_queue = get_email_queue(db)
+        self.email_queue.register_handler("cart_recovery", self.deliver_queued_email, on_dead=self.dead_letter_email)
+        
         # Templates d'emails de récupération
         self.email_templates = {
             "immediate": {
@@ -95,7 +112,7 @@ class AbandonedCartService:
                     </div>
                     
                     <div style="background: white; padding: 30px; border: 1px solid #e5e7eb; border-radius: 0 0 10px 10px;">
-                        <h2 style="color: #1F2937; margin-top: 0;">Bonjour {customer_name},</h2>
+                        <h2 style="color: #1F2937; margin-top: 0;">Bonjour {{ customer_name }},</h2>
                         
                         <p style="color: #374151; font-size: 16px; line-height: 1.6;">
                             Vous avez ajouté des produits à votre panier mais n'avez pas finalisé votre commande. 
@@ -104,10 +121,10 @@ class AbandonedCartService:
                         
                         <div style="background: #F3F4F6; padding: 20px; border-radius: 8px; margin: 25px 0;">
                             <h3 style="color: #1F2937; margin-top: 0;">📦 Récapitulatif de votre panier :</h3>
-                            {cart_items}
+                            {% for item in cart["items"] %}{% include "cart_recovery/item_row" %}{% endfor %}
                             <div style="border-top: 2px solid #1E40AF; padding-top: 15px; margin-top: 15px;">
                                 <p style="font-size: 18px; font-weight: bold; color: #1E40AF; margin: 0;">
-                                    Total : {total_value}€
+                                    Total : {{ total_value }}€
                                 </p>
                             </div>
                         </div>
@@ -121,7 +138,7 @@ class AbandonedCartService:
                         </div>
                         
                         <div style="text-align: center; margin: 30px 0;">
-                            <a href="{recovery_link}" style="background: #1E40AF; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
+                            <a href="{{ recovery_link }}" style="background: #1E40AF; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
                                 ✅ Finaliser ma commande maintenant
                             </a>
                         </div>
@@ -137,7 +154,7 @@ class AbandonedCartService:
                         
                         <p style="color: #6B7280; font-size: 12px; margin-top: 25px;">
                             Ceci est un email automatique. Si vous ne souhaitez plus recevoir ces rappels, 
-                            <a href="{unsubscribe_link}" style="color: #6B7280;">cliquez ici</a>.
+                            <a href="{{ unsubscribe_link }}" style="color: #6B7280;">cliquez ici</a>.
                         </p>
                     </div>
                 </div>
@@ -153,7 +170,7 @@ class AbandonedCartService:
                     </div>
                     
                     <div style="background: white; padding: 30px; border: 1px solid #e5e7eb; border-radius: 0 0 10px 10px;">
-                        <h2 style="color: #1F2937; margin-top: 0;">Bonjour {customer_name},</h2>
+                        <h2 style="color: #1F2937; margin-top: 0;">Bonjour {{ customer_name }},</h2>
                         
                         <p style="color: #374151; font-size: 16px; line-height: 1.6;">
                             Il ne vous reste que <strong>48 heures</strong> pour récupérer votre panier Josmose 
@@ -170,25 +187,25 @@ class AbandonedCartService:
                         
                         <div style="background: #F3F4F6; padding: 20px; border-radius: 8px; margin: 25px 0;">
                             <h3 style="color: #1F2937; margin-top: 0;">📦 Votre panier :</h3>
-                            {cart_items}
+                            {% for item in cart["items"] %}{% include "cart_recovery/item_row" %}{% endfor %}
                             <div style="border-top: 2px solid #DC2626; padding-top: 15px; margin-top: 15px;">
                                 <p style="font-size: 16px; color: #6B7280; margin: 0; text-decoration: line-through;">
-                                    Total : {total_value}€
+                                    Total : {{ total_value }}€
                                 </p>
                                 <p style="font-size: 20px; font-weight: bold; color: #DC2626; margin: 5px 0 0 0;">
-                                    Avec remise : {discounted_total}€ (-15%)
+                                    Avec remise : {{ discounted_total }}€ (-15%)
                                 </p>
                             </div>
                         </div>
                         
                         <div style="text-align: center; margin: 30px 0;">
-                            <a href="{recovery_link}" style="background: #DC2626; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
+                            <a href="{{ recovery_link }}" style="background: #DC2626; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
                                 🔥 RÉCUPÉRER MAINTENANT - 15% DE REMISE
                             </a>
                         </div>
                         
                         <p style="color: #6B7280; font-size: 12px; margin-top: 25px; text-align: center;">
-                            Cette offre expire le {expiry_date}
+                            Cette offre expire le {{ expiry_date }}
                         </p>
                     </div>
                 </div>
@@ -199,7 +216,7 @@ class AbandonedCartService:
                 "template": """
                 <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
                     <div style="background: linear-gradient(135deg, #7C3AED, #A855F7); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                        <h1 style="margin: 0; font-size: 28px;">💔 Au revoir {customer_name}</h1>
+                        <h1 style="margin: 0; font-size: 28px;">💔 Au revoir {{ customer_name }}</h1>
                         <p style="margin: 10px 0 0 0; font-size: 16px;">Dernière chance avant suppression</p>
                     </div>
                     
@@ -222,32 +239,39 @@ class AbandonedCartService:
                         </div>
                         
                         <div style="text-align: center; margin: 30px 0;">
-                            <a href="{recovery_link}" style="background: #7C3AED; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
+                            <a href="{{ recovery_link }}" style="background: #7C3AED; color: white; padding: 15px 30px; text-decoration: none; border-radius: 8px; font-size: 16px; font-weight: bold; display: inline-block;">
                                 💜 DERNIÈRE CHANCE - 20% DE REMISE
                             </a>
                         </div>
                         
                         <div style="background: #F3F4F6; padding: 20px; border-radius: 8px; margin: 25px 0;">
                             <h3 style="color: #1F2937; margin-top: 0;">📦 Ce que vous perdez :</h3>
-                            {cart_items}
+                            {% for item in cart["items"] %}{% include "cart_recovery/item_row" %}{% endfor %}
                             <div style="border-top: 2px solid #7C3AED; padding-top: 15px; margin-top: 15px;">
                                 <p style="font-size: 16px; color: #6B7280; margin: 0; text-decoration: line-through;">
-                                    Total : {total_value}€
+                                    Total : {{ total_value }}€
                                 </p>
                                 <p style="font-size: 22px; font-weight: bold; color: #7C3AED; margin: 5px 0 0 0;">
-                                    Prix final : {discounted_total}€ (-20%)
+                                    Prix final : {{ discounted_total }}€ (-20%)
                                 </p>
                             </div>
                         </div>
                         
                         <p style="color: #EF4444; font-size: 14px; text-align: center; margin-top: 25px;">
-                            ⚠️ Votre panier sera supprimé le {deletion_date}
+                            ⚠️ Votre panier sera supprimé le {{ deletion_date }}
                         </p>
                     </div>
                 </div>
                 """
             }
         }
+        
+        # Templates compilés une seule fois, avec le partiel des lignes d'articles
+        self.template_registry = get_template_registry()
+        self.template_registry.register_many({
+            "cart_recovery/item_row": CART_ITEM_ROW_TEMPLATE,
+            **{f"cart_recovery/{email_type}": config["template"] for email_type, config in self.email_templates.items()}
+        })
     
     async def track_abandoned_cart(self, cart_data: Dict[str, Any]) -> Dict[str, Any]:
         """Enregistrer un panier abandonné"""
@@ -352,117 +376,207 @@ class AbandonedCartService:
         except Exception as e:
             self.logger.error(f"Error scheduling recovery emails: {e}")
     
-    async def process_scheduled_emails(self):
-        """Traiter les emails programmés (à appeler périodiquement)"""
+    async def process_scheduled_emails(self) -> Dict[str, Any]:
+        """Mettre en file les emails programmés arrivés à échéance (à appeler périodiquement)"""
         try:
-            # Récupérer les emails à envoyer
-            pending_emails = await self.db.scheduled_emails.find({
-                "scheduled_for": {"$lte": datetime.utcnow()},
+            # Récupérer les emails à envoyer (par lots: le reste au passage suivant)
+            now = datetime.utcnow()
+            batch_size = EMAIL_QUEUE_CONFIG["scheduler_batch_size"]
+            due_emails = await self.db.scheduled_emails.find({
+                "scheduled_for": {"$lte": now},
                 "status": "pending"
-            }).to_list(100)
+            }).sort("scheduled_for", 1).limit(batch_size).to_list(batch_size)
             
-            for email_schedule in pending_emails:
-                cart_id = email_schedule["cart_id"]
-                email_type = email_schedule["email_type"]
-                discount_code = email_schedule["discount_code"]
-                
-                # Récupérer le panier
-                cart = await self.db.abandoned_carts.find_one({"cart_id": cart_id})
-                if not cart or cart["status"] != "abandoned":
-                    # Marquer comme annulé si le panier n'est plus abandonné
-                    await self.db.scheduled_emails.update_one(
-                        {"_id": email_schedule["_id"]},
-                        {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}}
-                    )
-                    continue
-                
-                # Envoyer l'email de récupération
-                email_sent = await self._send_recovery_email(cart, email_type, discount_code)
-                
-                if email_sent:
-                    # Marquer comme envoyé
-                    await self.db.scheduled_emails.update_one(
-                        {"_id": email_schedule["_id"]},
-                        {"$set": {"status": "sent", "sent_at": datetime.utcnow()}}
-                    )
-                    
-                    # Mettre à jour le panier
-                    await self.db.abandoned_carts.update_one(
-                        {"cart_id": cart_id},
-                        {
-                            "$push": {
-                                "recovery_emails_sent": {
-                                    "type": email_type,
-                                    "sent_at": datetime.utcnow(),
-                                    "discount_code": discount_code
-                                }
-                            },
-                            "$inc": {"recovery_attempts": 1}
-                        }
-                    )
-                    
-                    self.logger.info(f"Recovery email sent: {email_type} for cart {cart_id}")
-                
-                else:
-                    # Marquer comme échoué
-                    await self.db.scheduled_emails.update_one(
-                        {"_id": email_schedule["_id"]},
-                        {"$set": {"status": "failed", "updated_at": datetime.utcnow()}}
-                    )
+            queued = await self._enqueue_scheduled_emails(due_emails)
+            recovered = await self._recover_queued_emails(now)
+            
+            return {"processed": len(due_emails), "queued": queued, "recovered": recovered}
             
         except Exception as e:
             self.logger.error(f"Error processing scheduled emails: {e}")
+            return {"processed": 0, "queued": 0, "error": str(e)}
     
-    async def _send_recovery_email(self, cart: Dict, email_type: str, discount_code: str) -> bool:
-        """Envoyer un email de récupération"""
-        try:
-            # Préparer les données pour le template
-            customer_name = cart.get("customer_name", "Cher client")
-            total_value = cart["total_value"]
-            discounted_total = round(total_value * (0.9 if email_type == "immediate" 
-                                                  else 0.85 if email_type == "reminder" 
-                                                  else 0.8), 2)
-            
-            # Générer le HTML des articles du panier
-            cart_items_html = ""
-            for item in cart["items"]:
-                cart_items_html += f"""
-                <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #E5E7EB;">
-                    <span>{item.get('name', 'Produit')}</span>
-                    <span>{item.get('quantity', 1)}x {item.get('price', 0)}€</span>
-                </div>
-                """
-            
-            # Récupérer le template
-            template_data = self.email_templates[email_type]
-            
-            # Remplacer les variables dans le template
-            email_html = template_data["template"].format(
-                customer_name=customer_name,
-                cart_items=cart_items_html,
-                total_value=total_value,
-                discounted_total=discounted_total,
-                recovery_link=cart["recovery_link"],
-                unsubscribe_link=f"https://www.josmoze.com/unsubscribe?token={cart['recovery_token']}",
-                expiry_date=(datetime.utcnow() + timedelta(days=2)).strftime("%d/%m/%Y"),
-                deletion_date=(datetime.utcnow() + timedelta(days=1)).strftime("%d/%m/%Y")
+    @staticmethod
+    def _job_key(email_schedule: Dict[str, Any]) -> str:
+        return f"cart_recovery:{email_schedule['cart_id']}:{email_schedule['email_type']}"
+    
+    async def _enqueue_scheduled_emails(self, emails: List[Dict[str, Any]]) -> int:
+        if not emails:
+            return 0
+        
+        # Marquer avant la mise en file: un worker ne délivre que les emails "queued"
+        now = datetime.utcnow()
+        await self.db.scheduled_emails.update_many(
+            {"_id": {"$in": [email_schedule["_id"] for email_schedule in emails]}, "status": "pending"},
+            {"$set": {"status": "queued", "updated_at": now, "checked_at": now}}
+        )
+        
+        return await self.email_queue.enqueue_many("cart_recovery", [
+            {
+                "idempotency_key": self._job_key(email_schedule),
+                "payload": {"scheduled_email_id": str(email_schedule["_id"])}
+            }
+            for email_schedule in emails
+        ])
+    
+    async def _recover_queued_emails(self, now: datetime) -> int:
+        """
+        Emails "queued" revérifiés périodiquement: remis en file si leur job n'existe
+        pas (arrêt entre le marquage et la mise en file), clôturés si leur job est en
+        lettre morte. Les jobs vivants ne sont pas touchés.
+        """
+        cutoff = now - timedelta(seconds=EMAIL_QUEUE_CONFIG["orphan_check_seconds"])
+        batch_size = EMAIL_QUEUE_CONFIG["scheduler_batch_size"]
+        emails = await self.db.scheduled_emails.find({
+            "status": "queued",
+            "$or": [{"checked_at": {"$lte": cutoff}}, {"checked_at": {"$exists": False}}]
+        }).limit(batch_size).to_list(batch_size)
+        if not emails:
+            return 0
+        
+        await self.db.scheduled_emails.update_many(
+            {"_id": {"$in": [email_schedule["_id"] for email_schedule in emails]}, "status": "queued"},
+            {"$set": {"checked_at": now}}
+        )
+        statuses = await self.email_queue.job_statuses([self._job_key(email_schedule) for email_schedule in emails])
+        for email_schedule in emails:
+            if statuses.get(self._job_key(email_schedule)) == "dead":
+                await self.dead_letter_email({"scheduled_email_id": str(email_schedule["_id"])}, "Job en lettre morte")
+        return await self._enqueue_scheduled_emails([
+            email_schedule for email_schedule in emails if self._job_key(email_schedule) not in statuses
+        ])
+    
+    async def dead_letter_email(self, payload: Dict[str, Any], error: str):
+        """Callback de lettre morte: l'email ne reste pas "queued" après l'abandon du job"""
+        await self.db.scheduled_emails.update_one(
+            {"_id": ObjectId(payload["scheduled_email_id"]), "status": "queued"},
+            {"$set": {"status": "failed", "failure_reason": error, "updated_at": datetime.utcnow()}}
+        )
+    
+    async def deliver_queued_email(self, payload: Dict[str, Any]) -> str:
+        """Handler de la file d'envoi pour un email de récupération"""
+        email_schedule = await self.db.scheduled_emails.find_one({
+            "_id": ObjectId(payload["scheduled_email_id"]),
+            "status": "queued"
+        })
+        if not email_schedule:
+            # Déjà envoyé ou annulé
+            return "skipped"
+        
+        cart_id = email_schedule["cart_id"]
+        email_type = email_schedule["email_type"]
+        discount_code = email_schedule["discount_code"]
+        
+        # Récupérer le panier
+        cart = await self.db.abandoned_carts.find_one({"cart_id": cart_id})
+        if not cart or cart["status"] != "abandoned":
+            # Marquer comme annulé si le panier n'est plus abandonné
+            await self.db.scheduled_emails.update_one(
+                {"_id": email_schedule["_id"]},
+                {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}}
             )
-            
-            # Importer et utiliser le service email
-            from email_service import email_service
-            
-            result = await email_service.send_email(
-                from_email="commercial@josmoze.com",
-                to_email=cart["customer_email"],
-                subject=template_data["subject"],
-                body=email_html
+            return "skipped"
+        
+        # Envoyer l'email de récupération (échec temporaire: exception, le job est réessayé)
+        outcome = await self._send_recovery_email(cart, email_type, discount_code)
+        
+        if outcome == DeliveryOutcome.SUPPRESSED:
+            await self.db.scheduled_emails.update_one(
+                {"_id": email_schedule["_id"]},
+                {"$set": {"status": "cancelled", "cancel_reason": "suppressed", "updated_at": datetime.utcnow()}}
             )
-            
-            return result.get("success", False)
-            
-        except Exception as e:
-            self.logger.error(f"Error sending recovery email: {e}")
-            return False
+            return "skipped"
+        
+        if outcome == DeliveryOutcome.HARD_BOUNCE:
+            # Marquer comme échoué
+            await self.db.scheduled_emails.update_one(
+                {"_id": email_schedule["_id"]},
+                {"$set": {"status": "failed", "updated_at": datetime.utcnow()}}
+            )
+            raise PermanentDeliveryError(f"Recovery email {email_type} hard bounced for cart {cart_id}")
+        
+        if outcome == DeliveryOutcome.UNCERTAIN:
+            # Peut-être délivré (coupure après DATA): pas de renvoi automatique
+            await self.db.scheduled_emails.update_one(
+                {"_id": email_schedule["_id"]},
+                {"$set": {"status": "failed", "failure_reason": "delivery_uncertain", "updated_at": datetime.utcnow()}}
+            )
+            raise PermanentDeliveryError(f"Recovery email {email_type} delivery uncertain for cart {cart_id}")
+        
+        # Marquer comme envoyé
+        await self.db.scheduled_emails.update_one(
+            {"_id": email_schedule["_id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.utcnow()}}
+        )
+        
+        # Mettre à jour le panier
+        await self.db.abandoned_carts.update_one(
+            {"cart_id": cart_id},
+            {
+                "$push": {
+                    "recovery_emails_sent": {
+                        "type": email_type,
+                        "sent_at": datetime.utcnow(),
+                        "discount_code": discount_code
+                    }
+                },
+                "$inc": {"recovery_attempts": 1}
+            }
+        )
+        
+        self.logger.info(f"Recovery email sent: {email_type} for cart {cart_id}")
+        return "sent"
+    
+    async def _send_recovery_email(self, cart: Dict, email_type: str, discount_code: str) -> DeliveryOutcome:
+        """
+        Envoyer un email de récupération.
+        Retourne SENT, SUPPRESSED ou HARD_BOUNCE; les échecs temporaires
+        lèvent une exception pour que la file réessaie.
+        """
+        # Client désinscrit depuis l'abandon du panier: ne rien envoyer
+        if await self.db.suppression_list.find_one({"email": cart["customer_email"]}, {"_id": 1}):
+            return DeliveryOutcome.SUPPRESSED
+        
+        # Préparer les données pour le template
+        customer_name = cart.get("customer_name", "Cher client")
+        total_value = cart["total_value"]
+        discounted_total = round(total_value * (0.9 if email_type == "immediate" 
+                                              else 0.85 if email_type == "reminder" 
+                                              else 0.8), 2)
+        
+        # Récupérer le template
+        template_data = self.email_templates[email_type]
+        
+        # Rendu du template précompilé (lignes d'articles via le partiel item_row)
+        email_html = self.template_registry.render(
+            f"cart_recovery/{email_type}",
+            cart=cart,
+            customer_name=customer_name,
+            total_value=total_value,
+            discounted_total=discounted_total,
+            recovery_link=cart["recovery_link"],
+            unsubscribe_link=f"https://www.josmoze.com/unsubscribe?token={cart['recovery_token']}",
+            expiry_date=(datetime.utcnow() + timedelta(days=2)).strftime("%d/%m/%Y"),
+            deletion_date=(datetime.utcnow() + timedelta(days=1)).strftime("%d/%m/%Y")
+        )
+        
+        # Importer et utiliser le service email
+        from email_service import email_service
+        
+        result = await email_service.send_email(
+            from_email="commercial@josmoze.com",
+            to_email=cart["customer_email"],
+            subject=template_data["subject"],
+            body=email_html
+        )
+        
+        if result.get("success"):
+            return DeliveryOutcome.SENT
+        outcome = DeliveryOutcome(result.get("outcome", DeliveryOutcome.TRANSIENT.value))
+        if outcome in (DeliveryOutcome.HARD_BOUNCE, DeliveryOutcome.UNCERTAIN):
+            self.logger.warning(f"Recovery email {outcome.value} for {cart['customer_email']}: {result.get('error')}")
+            return outcome
+        raise TransientDeliveryError(result.get("error", "Recovery email not sent"))
     
     async def get_abandoned_carts_dashboard(self) -> Dict[str, Any]:
         """Récupérer les données du dashboard des paniers abandonnés"""
@@ -597,7 +711,7 @@ class AbandonedCartService:
             if result.modified_count > 0:
                 # Annuler les emails programmés restants
                 await self.db.scheduled_emails.update_many(
-                    {"cart_id": cart_id, "status": "pending"},
+                    {"cart_id": cart_id, "status": {"$in": ["pending", "queued"]}},
                     {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}}
                 )
                 
@@ -26,7 +26,8 @@ from enum import Enum
 import logging
 from dataclasses import dataclass, asdict
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+
+from mongo_provider import get_mongo_provider
 
 # Configuration des stratégies de Schopenhauer
 SCHOPENHAUER_STRATAGEMS = {
@@ -136,7 +137,7 @@ class AgentConfig:
 
 class AIAgentSystem:
     def __init__(self, mongo_url: str, db_name: str):
-        self.client = AsyncIOMotorClient(mongo_url)
+        self.client = get_mongo_provider(mongo_url).client
         self.db = self.client[db_name]
         self.agents = {}
         self.active_conversations = {}
@@ -15,7 +15,7 @@ from urllib.parse import urlparse, urljoin
 from dataclasses import dataclass
 
 from fastapi import HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from mongo_provider import get_mongo_provider
 import requests
 from bs4 import BeautifulSoup
 import json
@@ -74,7 +74,7 @@ class AIProductScraper:
     async def initialize(self):
         """Initialiser les connexions"""
         if not self.client:
-            self.client = AsyncIOMotorClient(MONGO_URL)
+            self.client = get_mongo_provider().client
             self.db = self.client[DB_NAME]
         
         if not self.session:
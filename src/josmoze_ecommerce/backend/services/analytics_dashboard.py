@@ -4,9 +4,11 @@ Tableau de bord analytics avancé pour prise de décision business
 """
 
 import os
+import io
+import csv
 import asyncio
 from datetime import datetime, timedelta, date
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator
 from pydantic import BaseModel
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import pandas as pd
@@ -15,6 +17,8 @@ import logging
 from collections import defaultdict
 import uuid
 
+from analytics_rollups import AnalyticsRollupManager, MISSING, ORDER_AMOUNT_EXPR
+
 logger = logging.getLogger(__name__)
 
 class AnalyticsEngine:
@@ -22,6 +26,9 @@ class AnalyticsEngine:
     
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
+        self.rollups = AnalyticsRollupManager(db)
+        # Documents analytics_daily chargés pour le dashboard en cours (None = pas de rollups)
+        self._rollup_days: Optional[List[Dict]] = None
     
     async def get_comprehensive_dashboard(self, date_range: int = 30) -> Dict[str, Any]:
         """Dashboard analytics complet pour la prise de décision"""
@@ -29,6 +36,11 @@ class AnalyticsEngine:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=date_range)
             
+            # Charger une seule fois les rollups des périodes courante et précédente
+            self._rollup_days = None
+            if await self.rollups.is_ready():
+                self._rollup_days = await self.rollups.get_days(start_date - (end_date - start_date), end_date)
+            
             # Exécuter toutes les analyses en parallèle
             tasks = [
                 self._get_sales_analytics(start_date, end_date),
@@ -65,74 +77,102 @@ class AnalyticsEngine:
             logger.error(f"Dashboard generation error: {e}")
             return {"error": str(e), "generated_at": datetime.now().isoformat()}
     
+    # Lecture des rollups journaliers
+    def _days_in(self, start_date: datetime, end_date: datetime) -> List[Dict]:
+        """Rollups du dashboard couvrant la période (granularité jour)"""
+        first, last = start_date.date().isoformat(), end_date.date().isoformat()
+        return [day for day in self._rollup_days if first <= day["_id"] <= last]
+    
+    def _rollup_counters(self, start_date: datetime, end_date: datetime, field: str, default: str) -> Dict[str, int]:
+        """Compteurs rollup de la période, la valeur manquante étant remplacée par `default`"""
+        counters = self.rollups.sum_counters(self._days_in(start_date, end_date), field)
+        if MISSING in counters:
+            counters[default] = counters.get(default, 0) + counters.pop(MISSING)
+        return counters
+    
+    # Pipelines d'agrégation partagés
+    def _period_match(self, start_date: datetime, end_date: datetime, completed_only: bool = False) -> Dict[str, Any]:
+        """Filtre $match sur la période (et les commandes finalisées si demandé)"""
+        match = {"created_at": {"$gte": start_date, "$lte": end_date}}
+        if completed_only:
+            match["status"] = "completed"
+        return match
+    
+    async def _aggregate(self, collection: str, pipeline: List[Dict]) -> List[Dict]:
+        """Exécuter un pipeline côté serveur et ne renvoyer que les agrégats"""
+        return await self.db[collection].aggregate(pipeline).to_list(None)
+    
+    def _group_revenue_by(self, key: Any) -> List[Dict]:
+        """Sous-pipeline revenue/commandes groupé par clé"""
+        return [{"$group": {"_id": key, "revenue": {"$sum": ORDER_AMOUNT_EXPR}, "orders": {"$sum": 1}}}]
+    
+    async def _count_by(self, collection: str, match: Dict, field: str, default: str) -> Dict[str, int]:
+        """Compter les documents par valeur de champ"""
+        rows = await self._aggregate(collection, [
+            {"$match": match},
+            {"$group": {"_id": {"$ifNull": [f"${field}", default]}, "count": {"$sum": 1}}}
+        ])
+        return {row["_id"]: row["count"] for row in rows}
+    
     async def _get_sales_analytics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Analyse des ventes avancée"""
         try:
-            # Récupérer toutes les commandes de la période
-            orders = await self.db.orders.find({
-                "created_at": {"$gte": start_date, "$lte": end_date},
-                "status": "completed"
-            }).to_list(None)
+            item_quantity = {"$ifNull": ["$items.quantity", 1]}
+            facet_pipelines = {
+                "top_products": [
+                    {"$unwind": "$items"},
+                    {"$group": {
+                        "_id": {"$ifNull": ["$items.product_id", "unknown"]},
+                        "quantity": {"$sum": item_quantity},
+                        "revenue": {"$sum": {"$multiply": [{"$ifNull": ["$items.price", 0]}, item_quantity]}}
+                    }},
+                    {"$sort": {"revenue": -1}},
+                    {"$limit": 5}
+                ]
+            }
+            if self._rollup_days is None:
+                facet_pipelines.update({
+                    "summary": self._group_revenue_by(None),
+                    "daily_sales": self._group_revenue_by(
+                        {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+                    ),
+                    "monthly_trend": self._group_revenue_by(
+                        {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}
+                    ),
+                    "hourly_pattern": self._group_revenue_by({"$hour": "$created_at"})
+                })
             
-            if not orders:
+            # Un seul aller-retour: totaux, tendances et top produits
+            results = await self._aggregate("orders", [
+                {"$match": self._period_match(start_date, end_date, completed_only=True)},
+                {"$addFields": {"created_at": {"$toDate": "$created_at"}}},
+                {"$facet": facet_pipelines}
+            ])
+            
+            facets = results[0] if results else {}
+            if self._rollup_days is not None:
+                facets.update(self._sales_facets_from_rollups(start_date, end_date))
+            if not facets.get("summary"):
                 return self._empty_sales_analytics()
             
             # Calculs de base
-            total_revenue = sum(order.get("total_amount", 0) for order in orders)
-            total_orders = len(orders)
+            total_revenue = facets["summary"][0]["revenue"]
+            total_orders = facets["summary"][0]["orders"]
             avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
             
             # Analyse temporelle
-            daily_sales = defaultdict(lambda: {"revenue": 0, "orders": 0})
-            monthly_trend = defaultdict(lambda: {"revenue": 0, "orders": 0})
-            hourly_pattern = defaultdict(lambda: {"revenue": 0, "orders": 0})
-            
-            for order in orders:
-                order_date = order.get("created_at")
-                if isinstance(order_date, str):
-                    order_date = datetime.fromisoformat(order_date)
-                
-                day_key = order_date.date().isoformat()
-                month_key = order_date.strftime("%Y-%m")
-                hour_key = order_date.hour
-                revenue = order.get("total_amount", 0)
-                
-                daily_sales[day_key]["revenue"] += revenue
-                daily_sales[day_key]["orders"] += 1
-                monthly_trend[month_key]["revenue"] += revenue
-                monthly_trend[month_key]["orders"] += 1
-                hourly_pattern[hour_key]["revenue"] += revenue
-                hourly_pattern[hour_key]["orders"] += 1
+            trends = {
+                trend: {row["_id"]: {"revenue": row["revenue"], "orders": row["orders"]} for row in facets[trend]}
+                for trend in ("daily_sales", "monthly_trend", "hourly_pattern")
+            }
             
             # Métriques de croissance
             period_days = (end_date - start_date).days
             previous_start = start_date - timedelta(days=period_days)
             
-            previous_orders = await self.db.orders.find({
-                "created_at": {"$gte": previous_start, "$lte": start_date},
-                "status": "completed"
-            }).to_list(None)
-            
-            previous_revenue = sum(order.get("total_amount", 0) for order in previous_orders)
+            previous_revenue = await self._get_period_revenue(previous_start, start_date)
             revenue_growth = ((total_revenue - previous_revenue) / previous_revenue * 100) if previous_revenue > 0 else 0
             
-            # Top produits
-            product_sales = defaultdict(lambda: {"quantity": 0, "revenue": 0})
-            for order in orders:
-                for item in order.get("items", []):
-                    product_id = item.get("product_id", "unknown")
-                    quantity = item.get("quantity", 1)
-                    price = item.get("price", 0)
-                    
-                    product_sales[product_id]["quantity"] += quantity
-                    product_sales[product_id]["revenue"] += price * quantity
-            
-            top_products = sorted(
-                [(pid, data) for pid, data in product_sales.items()],
-                key=lambda x: x[1]["revenue"],
-                reverse=True
-            )[:5]
-            
             return {
                 "summary": {
                     "total_revenue": round(total_revenue, 2),
@@ -141,17 +181,13 @@ class AnalyticsEngine:
                     "revenue_growth_percent": round(revenue_growth, 1),
                     "conversion_rate": await self._calculate_conversion_rate(start_date, end_date)
                 },
-                "trends": {
-                    "daily_sales": dict(daily_sales),
-                    "monthly_trend": dict(monthly_trend),
-                    "hourly_pattern": dict(hourly_pattern)
-                },
+                "trends": trends,
                 "top_products": [
                     {
-                        "product_id": pid,
-                        "quantity_sold": data["quantity"],
-                        "revenue": round(data["revenue"], 2)
-                    } for pid, data in top_products
+                        "product_id": row["_id"],
+                        "quantity_sold": row["quantity"],
+                        "revenue": round(row["revenue"], 2)
+                    } for row in facets["top_products"]
                 ]
             }
             
@@ -159,67 +195,118 @@ class AnalyticsEngine:
             logger.error(f"Sales analytics error: {e}")
             return self._empty_sales_analytics()
     
+    def _sales_facets_from_rollups(self, start_date: datetime, end_date: datetime) -> Dict[str, List[Dict]]:
+        """Totaux et tendances des commandes finalisées depuis les rollups"""
+        daily, monthly, hourly = {}, defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+        
+        for day in self._days_in(start_date, end_date):
+            completed = (day.get("orders_by_status") or {}).get("completed")
+            if not completed:
+                continue
+            daily[day["_id"]] = [completed.get("revenue", 0), completed.get("count", 0)]
+            monthly[day["_id"][:7]][0] += completed.get("revenue", 0)
+            monthly[day["_id"][:7]][1] += completed.get("count", 0)
+            for hour, bucket in ((day.get("orders_hourly") or {}).get("completed") or {}).items():
+                hourly[int(hour)][0] += bucket.get("revenue", 0)
+                hourly[int(hour)][1] += bucket.get("count", 0)
+        
+        def rows(buckets: Dict) -> List[Dict]:
+            return [{"_id": key, "revenue": revenue, "orders": orders} for key, (revenue, orders) in buckets.items()]
+        
+        total_orders = sum(orders for _, orders in daily.values())
+        summary = rows({None: (sum(revenue for revenue, _ in daily.values()), total_orders)}) if total_orders else []
+        
+        return {
+            "summary": summary,
+            "daily_sales": rows(daily),
+            "monthly_trend": rows(monthly),
+            "hourly_pattern": rows(hourly)
+        }
+    
     async def _get_customer_analytics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Analyse des clients et segmentation"""
         try:
-            # Récupérer les leads et clients
-            leads = await self.db.leads.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            period = self._period_match(start_date, end_date)
             
-            orders = await self.db.orders.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
-            
-            # Segmentation B2B/B2C
-            b2b_leads = len([l for l in leads if l.get("customer_type") == "B2B"])
-            b2c_leads = len([l for l in leads if l.get("customer_type") == "B2C"])
-            
-            # Analyse géographique des clients
-            countries = defaultdict(int)
-            for lead in leads:
-                country = lead.get("country_code", "Unknown")
-                countries[country] += 1
-            
-            # Analyse de la valeur client
-            customer_values = defaultdict(float)
-            for order in orders:
-                email = order.get("customer_email", "unknown")
-                customer_values[email] += order.get("total_amount", 0)
-            
-            # Segmentation par valeur (LTV)
-            if customer_values:
-                values = list(customer_values.values())
-                avg_ltv = sum(values) / len(values)
-                high_value = len([v for v in values if v > avg_ltv * 2])
-                medium_value = len([v for v in values if avg_ltv <= v <= avg_ltv * 2])
-                low_value = len([v for v in values if v < avg_ltv])
+            # Segmentation des leads (type et pays) en un seul passage
+            if self._rollup_days is not None:
+                total_leads = self.rollups.sum_counters(self._days_in(start_date, end_date), "leads").get("count", 0)
+                lead_types = self._rollup_counters(start_date, end_date, "leads_by_customer_type", MISSING)
+                countries = self._rollup_counters(start_date, end_date, "leads_by_country", "Unknown")
             else:
-                avg_ltv = high_value = medium_value = low_value = 0
+                lead_results = await self._aggregate("leads", [
+                    {"$match": period},
+                    {"$facet": {
+                        "total": [{"$count": "count"}],
+                        "by_type": [{"$group": {"_id": "$customer_type", "count": {"$sum": 1}}}],
+                        "by_country": [{"$group": {"_id": {"$ifNull": ["$country_code", "Unknown"]}, "count": {"$sum": 1}}}]
+                    }}
+                ])
+                lead_facets = lead_results[0] if lead_results else {}
+                total_leads = lead_facets["total"][0]["count"] if lead_facets.get("total") else 0
+                lead_types = {row["_id"]: row["count"] for row in lead_facets.get("by_type", [])}
+                countries = {row["_id"]: row["count"] for row in lead_facets.get("by_country", [])}
+            
+            b2b_leads = lead_types.get("B2B", 0)
+            b2c_leads = lead_types.get("B2C", 0)
+            
+            # Valeur client (LTV) et rétention: d'abord un groupe par client
+            per_customer = [
+                {"$match": period},
+                {"$group": {
+                    "_id": {"$ifNull": ["$customer_email", "unknown"]},
+                    "value": {"$sum": ORDER_AMOUNT_EXPR},
+                    "orders": {"$sum": 1}
+                }}
+            ]
+            customer_stats = await self._aggregate("orders", per_customer + [
+                {"$group": {
+                    "_id": None,
+                    "customers": {"$sum": 1},
+                    "avg_ltv": {"$avg": "$value"},
+                    "repeat_customers": {"$sum": {"$cond": [{"$gt": ["$orders", 1]}, 1, 0]}}
+                }}
+            ])
+            
+            unique_customers = repeat_customers = 0
+            avg_ltv = high_value = medium_value = low_value = 0
+            if customer_stats:
+                unique_customers = customer_stats[0]["customers"]
+                repeat_customers = customer_stats[0]["repeat_customers"]
+                avg_ltv = customer_stats[0]["avg_ltv"] or 0
+                
+                # Segmentation par valeur (LTV)
+                segments = await self._aggregate("orders", per_customer + [
+                    {"$group": {
+                        "_id": None,
+                        "high_value": {"$sum": {"$cond": [{"$gt": ["$value", avg_ltv * 2]}, 1, 0]}},
+                        "medium_value": {"$sum": {"$cond": [
+                            {"$and": [{"$gte": ["$value", avg_ltv]}, {"$lte": ["$value", avg_ltv * 2]}]}, 1, 0
+                        ]}},
+                        "low_value": {"$sum": {"$cond": [{"$lt": ["$value", avg_ltv]}, 1, 0]}}
+                    }}
+                ])
+                if segments:
+                    high_value = segments[0]["high_value"]
+                    medium_value = segments[0]["medium_value"]
+                    low_value = segments[0]["low_value"]
             
             # Taux de rétention (clients répétés)
-            repeat_customers = 0
-            customer_orders = defaultdict(int)
-            for order in orders:
-                email = order.get("customer_email", "unknown")
-                customer_orders[email] += 1
-            
-            repeat_customers = len([email for email, count in customer_orders.items() if count > 1])
-            retention_rate = (repeat_customers / len(customer_orders) * 100) if customer_orders else 0
+            retention_rate = (repeat_customers / unique_customers * 100) if unique_customers else 0
             
             return {
                 "summary": {
-                    "total_leads": len(leads),
+                    "total_leads": total_leads,
                     "b2b_leads": b2b_leads,
                     "b2c_leads": b2c_leads,
-                    "unique_customers": len(customer_orders),
+                    "unique_customers": unique_customers,
                     "repeat_customers": repeat_customers,
                     "retention_rate": round(retention_rate, 1),
                     "avg_customer_value": round(avg_ltv, 2)
                 },
                 "segmentation": {
                     "by_type": {"B2B": b2b_leads, "B2C": b2c_leads},
-                    "by_geography": dict(countries),
+                    "by_geography": countries,
                     "by_value": {
                         "high_value": high_value,
                         "medium_value": medium_value, 
@@ -228,7 +315,7 @@ class AnalyticsEngine:
                 },
                 "behavior": {
                     "repeat_purchase_rate": round(retention_rate, 1),
-                    "avg_time_between_purchases": await self._calculate_purchase_interval(orders)
+                    "avg_time_between_purchases": await self._calculate_purchase_interval(start_date, end_date)
                 }
             }
             
@@ -239,34 +326,36 @@ class AnalyticsEngine:
     async def _get_product_analytics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Analyse détaillée des produits et performances"""
         try:
-            orders = await self.db.orders.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            item_quantity = {"$ifNull": ["$items.quantity", 1]}
             
             # Analyse par produit
-            product_metrics = defaultdict(lambda: {
-                "views": 0, "sales": 0, "revenue": 0, "conversion_rate": 0
-            })
-            
-            for order in orders:
-                for item in order.get("items", []):
-                    product_id = item.get("product_id", "unknown")
-                    quantity = item.get("quantity", 1)
-                    price = item.get("price", 0)
-                    
-                    product_metrics[product_id]["sales"] += quantity
-                    product_metrics[product_id]["revenue"] += price * quantity
+            product_rows = await self._aggregate("orders", [
+                {"$match": self._period_match(start_date, end_date)},
+                {"$unwind": "$items"},
+                {"$group": {
+                    "_id": {"$ifNull": ["$items.product_id", "unknown"]},
+                    "sales": {"$sum": item_quantity},
+                    "revenue": {"$sum": {"$multiply": [{"$ifNull": ["$items.price", 0]}, item_quantity]}}
+                }}
+            ])
+            
+            product_metrics = {
+                row["_id"]: {"views": 0, "sales": row["sales"], "revenue": row["revenue"], "conversion_rate": 0}
+                for row in product_rows
+            }
             
             # Récupérer les vues produits (si disponible)
             try:
-                product_views = await self.db.product_analytics.find({
-                    "date": {"$gte": start_date, "$lte": end_date}
-                }).to_list(None)
+                view_rows = await self._aggregate("product_analytics", [
+                    {"$match": {
+                        "date": {"$gte": start_date, "$lte": end_date},
+                        "product_id": {"$in": list(product_metrics.keys())}
+                    }},
+                    {"$group": {"_id": "$product_id", "views": {"$sum": "$views"}}}
+                ])
                 
-                for view in product_views:
-                    product_id = view.get("product_id")
-                    if product_id in product_metrics:
-                        product_metrics[product_id]["views"] += view.get("views", 0)
+                for row in view_rows:
+                    product_metrics[row["_id"]]["views"] += row["views"]
             except:
                 pass
             
@@ -307,16 +396,12 @@ class AnalyticsEngine:
         try:
             # Étapes du funnel
             visitors = await self._count_unique_visitors(start_date, end_date)
-            leads = await self.db.leads.count_documents({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            })
+            leads = await self._count_leads(start_date, end_date)
             cart_additions = await self.db.cart_analytics.count_documents({
                 "created_at": {"$gte": start_date, "$lte": end_date}
             }) if await self.db.cart_analytics.find_one({}) else leads // 2
             
-            orders = await self.db.orders.count_documents({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            })
+            orders = await self._count_orders(start_date, end_date)
             
             # Calculs de conversion
             visitor_to_lead = (leads / visitors * 100) if visitors > 0 else 0
@@ -351,34 +436,32 @@ class AnalyticsEngine:
     async def _get_geographic_analytics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Analyse géographique des performances"""
         try:
-            leads = await self.db.leads.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
-            
-            orders = await self.db.orders.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            period = self._period_match(start_date, end_date)
             
             # Analyse par pays
-            country_leads = defaultdict(int)
-            country_orders = defaultdict(int)
-            country_revenue = defaultdict(float)
-            
-            for lead in leads:
-                country = lead.get("country_code", "FR")
-                country_leads[country] += 1
-            
-            for order in orders:
-                country = order.get("country", "FR")
-                country_orders[country] += 1
-                country_revenue[country] += order.get("total_amount", 0)
+            if self._rollup_days is not None:
+                country_leads = self._rollup_counters(start_date, end_date, "leads_by_country", "FR")
+                country_orders, country_revenue = defaultdict(int), defaultdict(float)
+                for day in self._days_in(start_date, end_date):
+                    for country, bucket in (day.get("orders_by_country") or {}).items():
+                        country = "FR" if country == MISSING else country
+                        country_orders[country] += bucket.get("count", 0)
+                        country_revenue[country] += bucket.get("revenue", 0)
+            else:
+                country_leads = await self._count_by("leads", period, "country_code", "FR")
+                
+                order_rows = await self._aggregate("orders", [{"$match": period}] + self._group_revenue_by(
+                    {"$ifNull": ["$country", "FR"]}
+                ))
+                country_orders = {row["_id"]: row["orders"] for row in order_rows}
+                country_revenue = {row["_id"]: row["revenue"] for row in order_rows}
             
             # Performance par pays
             country_performance = []
             for country in set(list(country_leads.keys()) + list(country_orders.keys())):
-                leads_count = country_leads[country]
-                orders_count = country_orders[country]
-                revenue = country_revenue[country]
+                leads_count = country_leads.get(country, 0)
+                orders_count = country_orders.get(country, 0)
+                revenue = country_revenue.get(country, 0.0)
                 conversion = (orders_count / leads_count * 100) if leads_count > 0 else 0
                 
                 country_performance.append({
@@ -406,16 +489,12 @@ class AnalyticsEngine:
         """Analyse des performances marketing"""
         try:
             # Récupérer les données des campagnes
-            campaigns = await self.db.campaigns.find({}).to_list(None)
-            leads = await self.db.leads.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            campaigns = await self.db.campaigns.find({}, {"_id": 0, "budget_spent": 1}).to_list(None)
             
             # Attribution des leads par source
-            lead_sources = defaultdict(int)
-            for lead in leads:
-                source = lead.get("source", "direct")
-                lead_sources[source] += 1
+            lead_sources = await self._count_by(
+                "leads", self._period_match(start_date, end_date), "source", "direct"
+            )
             
             # Performance email marketing (si disponible)
             email_performance = {
@@ -426,20 +505,18 @@ class AnalyticsEngine:
             }
             
             try:
-                email_logs = await self.db.email_logs.find({
+                email_performance["total_sent"] = await self.db.email_logs.count_documents({
                     "sent_at": {"$gte": start_date, "$lte": end_date}
-                }).to_list(None)
-                
-                email_performance["total_sent"] = len(email_logs)
+                })
                 # Ici on pourrait analyser les ouvertures/clics si les données existent
             except:
                 pass
             
             return {
-                "lead_attribution": dict(lead_sources),
+                "lead_attribution": lead_sources,
                 "email_performance": email_performance,
                 "campaign_roi": await self._calculate_campaign_roi(campaigns, start_date, end_date),
-                "marketing_channels": await self._analyze_marketing_channels(leads)
+                "marketing_channels": await self._analyze_marketing_channels(lead_sources)
             }
             
         except Exception as e:
@@ -449,48 +526,58 @@ class AnalyticsEngine:
     async def _get_crm_analytics(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """Analyse des performances CRM"""
         try:
-            leads = await self.db.leads.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            period = self._period_match(start_date, end_date)
             
             # Analyse du pipeline
-            lead_status = defaultdict(int)
-            lead_scores = []
-            
-            for lead in leads:
-                status = lead.get("status", "new")
-                score = lead.get("score", 0)
-                
-                lead_status[status] += 1
-                if score > 0:
-                    lead_scores.append(score)
-            
-            avg_score = sum(lead_scores) / len(lead_scores) if lead_scores else 0
+            lead_results = await self._aggregate("leads", [
+                {"$match": period},
+                {"$facet": {
+                    "by_status": [{"$group": {"_id": {"$ifNull": ["$status", "new"]}, "count": {"$sum": 1}}}],
+                    "scores": [
+                        {"$match": {"score": {"$gt": 0}}},
+                        {"$group": {"_id": None, "avg": {"$avg": "$score"}}}
+                    ],
+                    "followup": [{"$group": {
+                        "_id": None,
+                        "total": {"$sum": 1},
+                        "followed_up": {"$sum": {"$cond": [{"$gt": [{"$ifNull": ["$follow_up_count", 0]}, 0]}, 1, 0]}},
+                        "converted": {"$sum": {"$cond": [{"$eq": ["$status", "converted"]}, 1, 0]}}
+                    }}]
+                }}
+            ])
+            lead_facets = lead_results[0] if lead_results else {}
+            if self._rollup_days is not None:
+                lead_status = self._rollup_counters(start_date, end_date, "leads_by_status", "new")
+            else:
+                lead_status = {row["_id"]: row["count"] for row in lead_facets.get("by_status", [])}
+            avg_score = lead_facets["scores"][0]["avg"] if lead_facets.get("scores") else 0
+            followup_counts = lead_facets["followup"][0] if lead_facets.get("followup") else {}
             
             # Analyse des consultations
-            consultations = await self.db.consultations.find({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            }).to_list(None)
+            consultation_status = await self._count_by("consultations", period, "status", "")
             
             consultation_stats = {
-                "total_requests": len(consultations),
-                "scheduled": len([c for c in consultations if c.get("status") == "scheduled"]),
-                "completed": len([c for c in consultations if c.get("status") == "completed"]),
+                "total_requests": sum(consultation_status.values()),
+                "scheduled": consultation_status.get("scheduled", 0),
+                "completed": consultation_status.get("completed", 0),
                 "conversion_rate": 0
             }
             
             if consultation_stats["completed"] > 0:
+                completed_emails = await self.db.consultations.distinct(
+                    "email", {**period, "status": "completed"}
+                )
                 consultation_converted = await self.db.orders.count_documents({
-                    "customer_email": {"$in": [c.get("email") for c in consultations if c.get("status") == "completed"]},
+                    "customer_email": {"$in": completed_emails},
                     "created_at": {"$gte": start_date, "$lte": end_date}
                 })
                 consultation_stats["conversion_rate"] = (consultation_converted / consultation_stats["completed"]) * 100
             
             return {
-                "lead_pipeline": dict(lead_status),
+                "lead_pipeline": lead_status,
                 "avg_lead_score": round(avg_score, 1),
                 "consultation_performance": consultation_stats,
-                "followup_efficiency": await self._calculate_followup_efficiency(leads)
+                "followup_efficiency": await self._calculate_followup_efficiency(followup_counts)
             }
             
         except Exception as e:
@@ -552,21 +639,29 @@ class AnalyticsEngine:
         """Calculer le taux de conversion global"""
         try:
             visitors = await self._count_unique_visitors(start_date, end_date)
-            orders = await self.db.orders.count_documents({
-                "created_at": {"$gte": start_date, "$lte": end_date}
-            })
+            orders = await self._count_orders(start_date, end_date)
             return round((orders / visitors * 100), 2) if visitors > 0 else 0
         except:
             return 0
     
     async def _count_unique_visitors(self, start_date: datetime, end_date: datetime) -> int:
         """Compter les visiteurs uniques (estimation basée sur les leads + facteur)"""
-        leads = await self.db.leads.count_documents({
-            "created_at": {"$gte": start_date, "$lte": end_date}
-        })
+        leads = await self._count_leads(start_date, end_date)
         # Estimation: 1 lead pour 10-20 visiteurs
         return max(leads * 15, 100)
     
+    async def _count_leads(self, start_date: datetime, end_date: datetime) -> int:
+        """Nombre de leads créés sur la période"""
+        if self._rollup_days is not None:
+            return self.rollups.sum_counters(self._days_in(start_date, end_date), "leads").get("count", 0)
+        return await self.db.leads.count_documents(self._period_match(start_date, end_date))
+    
+    async def _count_orders(self, start_date: datetime, end_date: datetime) -> int:
+        """Nombre de commandes créées sur la période"""
+        if self._rollup_days is not None:
+            return self.rollups.sum_orders(self._days_in(start_date, end_date))["count"]
+        return await self.db.orders.count_documents(self._period_match(start_date, end_date))
+    
     def _empty_sales_analytics(self) -> Dict[str, Any]:
         """Retour vide pour les analytics de ventes"""
         return {
@@ -614,7 +709,7 @@ class AnalyticsEngine:
             return []
     
     # Méthodes supplémentaires pour les calculs complexes
-    async def _calculate_purchase_interval(self, orders: List) -> float:
+    async def _calculate_purchase_interval(self, start_date: datetime, end_date: datetime) -> float:
         """Calculer l'intervalle moyen entre les achats"""
         # Implémentation simplifiée
         return 45.0  # 45 jours en moyenne
@@ -659,20 +754,15 @@ class AnalyticsEngine:
             "roi_percent": round(roi, 1)
         }
     
-    async def _analyze_marketing_channels(self, leads: List) -> Dict:
+    async def _analyze_marketing_channels(self, lead_sources: Dict[str, int]) -> Dict:
         """Analyser les canaux marketing"""
-        channels = defaultdict(int)
-        for lead in leads:
-            source = lead.get("source", "direct")
-            channels[source] += 1
-        
-        return dict(channels)
+        return dict(lead_sources)
     
-    async def _calculate_followup_efficiency(self, leads: List) -> Dict:
+    async def _calculate_followup_efficiency(self, followup_counts: Dict[str, int]) -> Dict:
         """Calculer l'efficacité du suivi"""
-        total_leads = len(leads)
-        followed_up = len([l for l in leads if l.get("follow_up_count", 0) > 0])
-        converted = len([l for l in leads if l.get("status") == "converted"])
+        total_leads = followup_counts.get("total", 0)
+        followed_up = followup_counts.get("followed_up", 0)
+        converted = followup_counts.get("converted", 0)
         
         return {
             "followup_rate": round((followed_up / total_leads * 100), 1) if total_leads > 0 else 0,
@@ -691,12 +781,15 @@ class AnalyticsEngine:
     
     async def _get_period_revenue(self, start_date: datetime, end_date: datetime) -> float:
         """Obtenir le revenue d'une période"""
-        orders = await self.db.orders.find({
-            "created_at": {"$gte": start_date, "$lte": end_date},
-            "status": "completed"
-        }).to_list(None)
+        if self._rollup_days is not None:
+            return self.rollups.sum_orders(self._days_in(start_date, end_date), ["completed"])["revenue"]
         
-        return sum(order.get("total_amount", 0) for order in orders)
+        rows = await self._aggregate("orders", [
+            {"$match": self._period_match(start_date, end_date, completed_only=True)},
+            {"$group": {"_id": None, "revenue": {"$sum": ORDER_AMOUNT_EXPR}}}
+        ])
+        
+        return rows[0]["revenue"] if rows else 0
     
     async def _analyze_seasonal_trends(self) -> Dict:
         """Analyser les tendances saisonnières"""
@@ -722,25 +815,58 @@ class AnalyticsEngine:
         return actions
 
 # Export CSV function
-async def export_analytics_csv(db: AsyncIOMotorDatabase, date_range: int = 30) -> str:
-    """Exporter les analytics en CSV"""
+def _csv_chunk(rows: List[List[Any]]) -> str:
+    """Sérialiser des lignes CSV avec le module csv (quoting correct)"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+async def stream_analytics_csv(
+    db: AsyncIOMotorDatabase, date_range: int = 30, batch_size: int = 500
+) -> AsyncIterator[str]:
+    """Exporter les analytics en CSV, en flux"""
     analytics = AnalyticsEngine(db)
     dashboard_data = await analytics.get_comprehensive_dashboard(date_range)
+    period = f"{date_range} days"
     
-    # Créer un CSV simplifié avec les métriques principales
-    csv_data = []
-    csv_data.append(["Metric", "Value", "Period"])
-    
+    # Métriques principales
     sales = dashboard_data.get("sales_analytics", {}).get("summary", {})
-    csv_data.append(["Total Revenue", sales.get("total_revenue", 0), f"{date_range} days"])
-    csv_data.append(["Total Orders", sales.get("total_orders", 0), f"{date_range} days"])
-    csv_data.append(["Average Order Value", sales.get("avg_order_value", 0), f"{date_range} days"])
-    
     customer = dashboard_data.get("customer_analytics", {}).get("summary", {})
-    csv_data.append(["Total Leads", customer.get("total_leads", 0), f"{date_range} days"])
-    csv_data.append(["Retention Rate", customer.get("retention_rate", 0), f"{date_range} days"])
-    
-    # Convertir en CSV string
-    csv_string = "\n".join([",".join(map(str, row)) for row in csv_data])
-    
-    return csv_string
\ No newline at end of file
+    yield _csv_chunk([
+        ["Metric", "Value", "Period"],
+        ["Total Revenue", sales.get("total_revenue", 0), period],
+        ["Total Orders", sales.get("total_orders", 0), period],
+        ["Average Order Value", sales.get("avg_order_value", 0), period],
+        ["Total Leads", customer.get("total_leads", 0), period],
+        ["Retention Rate", customer.get("retention_rate", 0), period]
+    ])
+    
+    # Détail journalier lu par lots depuis les rollups
+    if not await analytics.rollups.is_ready():
+        return
+    
+    start_day = (datetime.now() - timedelta(days=date_range)).date().isoformat()
+    cursor = analytics.rollups.collection.find(
+        {"_id": {"$gte": start_day}},
+        {"orders": 1, "leads": 1, "contacts": 1}
+    ).sort("_id", 1).batch_size(batch_size)
+    
+    rows = []
+    async for day in cursor:
+        orders = day.get("orders") or {}
+        rows.extend([
+            ["Daily Revenue", round(orders.get("revenue", 0), 2), day["_id"]],
+            ["Daily Orders", orders.get("count", 0), day["_id"]],
+            ["Daily Leads", (day.get("leads") or {}).get("count", 0), day["_id"]],
+            ["Daily Contacts", (day.get("contacts") or {}).get("count", 0), day["_id"]]
+        ])
+        if len(rows) >= batch_size:
+            yield _csv_chunk(rows)
+            rows = []
+    
+    if rows:
+        yield _csv_chunk(rows)
+
+async def export_analytics_csv(db: AsyncIOMotorDatabase, date_range: int = 30) -> str:
+    """Exporter les analytics en CSV"""
+    return "".join([chunk async for chunk in stream_analytics_csv(db, date_range)])
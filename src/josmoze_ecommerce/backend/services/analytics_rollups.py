@@ -0,0 +1,484 @@
+"""
+Josmoze.com - Rollups analytics journaliers
+Agrégats matérialisés par jour (collection analytics_daily) maintenus de façon
+incrémentale à chaque écriture de commande, lead ou formulaire de contact.
+
+Les dashboards lisent O(jours) documents au lieu de O(documents).
+
+Backfill complet depuis l'historique:
+    python analytics_rollups.py
+
+Pendant une reconstruction, les écritures incrémentales sont journalisées
+(analytics_rollups_pending) au lieu d'être appliquées. Les jours sont
+recalculés dans une collection de travail, échangée avec analytics_daily,
+puis le journal est rejoué: seuls les incréments que l'agrégation n'a pas
+pu voir (documents créés après la date de coupure, changements de lead
+postérieurs à l'agrégation des leads) sont appliqués.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, List, Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "analytics_daily"
+META_COLLECTION = "analytics_rollups_meta"
+STAGING_COLLECTION = "analytics_daily_rebuild"
+PENDING_COLLECTION = "analytics_rollups_pending"
+
+REBUILD_CONFIG = {
+    "grace_seconds": 2.0,                    # Laisser aboutir les écritures en vol
+    "timeout": timedelta(hours=1),           # Verrou d'une reconstruction interrompue ignoré au-delà
+    "lead_wait_seconds": 30.0,               # Attente max d'une mise à jour de lead pendant l'agrégation des leads
+    "flag_ttl_seconds": 1.0                  # Cache de l'état "reconstruction en cours" (doit rester < grace_seconds)
+}
+
+# Valeur utilisée quand un champ de regroupement est absent
+MISSING = "_missing"
+
+
+def _key(value: Any) -> str:
+    """Clé de sous-document sûre pour MongoDB (pas de '.' ni de '$' initial)"""
+    if value is None or value == "":
+        return MISSING
+    return str(value).replace(".", "_").lstrip("$") or MISSING
+
+
+def _to_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if not isinstance(value, datetime):
+        value = datetime.utcnow()
+    if value.tzinfo is not None:
+        # Même jour que $toDate (UTC) lors d'une reconstruction
+        value = value.astimezone(timezone.utc)
+    return value.replace(tzinfo=None)
+
+
+# Montant d'une commande (total_amount historique, sinon total): même définition
+# pour les rollups et pour les pipelines d'AnalyticsEngine
+ORDER_AMOUNT_EXPR = {"$ifNull": ["$total_amount", {"$ifNull": ["$total", 0]}]}
+
+
+def _order_amount(order: Dict) -> float:
+    """Équivalent Python de ORDER_AMOUNT_EXPR"""
+    amount = order.get("total_amount")
+    if amount is None:
+        amount = order.get("total", 0)
+    return amount or 0
+
+
+class AnalyticsRollupManager:
+    """Gestion des rollups analytics journaliers"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db[ROLLUP_COLLECTION]
+        self.meta = db[META_COLLECTION]
+        self.staging = db[STAGING_COLLECTION]
+        self.pending = db[PENDING_COLLECTION]
+        self._rebuild_flag: Optional[bool] = None
+        self._rebuild_flag_read_at = 0.0
+
+    async def create_indexes(self):
+        await self.collection.create_index("date")
+
+    async def is_ready(self) -> bool:
+        """Les rollups ne sont fiables qu'après un backfill complet"""
+        meta = await self.meta.find_one({"_id": "backfill"})
+        return bool(meta and meta.get("completed_at"))
+
+    async def _rebuild_state(self) -> Optional[Dict]:
+        """Reconstruction en cours (None sinon, ou si son verrou a expiré)"""
+        state = await self.meta.find_one({"_id": "rebuild", "running": True})
+        if state and datetime.utcnow() - state["started_at"] > REBUILD_CONFIG["timeout"]:
+            return None
+        return state
+
+    async def _rebuild_running(self) -> bool:
+        """
+        État de reconstruction mis en cache flag_ttl_seconds: une écriture voit le
+        verrou au plus tard flag_ttl_seconds après sa pose ou sa levée, délai
+        couvert par les attentes de grace_seconds de rebuild().
+        """
+        read_at = time.monotonic()
+        if self._rebuild_flag is None or read_at - self._rebuild_flag_read_at >= REBUILD_CONFIG["flag_ttl_seconds"]:
+            self._rebuild_flag = await self._rebuild_state() is not None
+            self._rebuild_flag_read_at = read_at
+        return self._rebuild_flag
+
+    # ========== MISE À JOUR INCRÉMENTALE ==========
+
+    async def _inc(self, created_at: Any, increments: Dict[str, Any], changed_at: Optional[datetime] = None):
+        """Appliquer des incréments au jour de création (changed_at: changement d'un lead existant)"""
+        created_at = _to_datetime(created_at)
+        if await self._rebuild_running():
+            # Rollups figés pendant la reconstruction: rejoué après l'échange
+            await self.pending.insert_one({
+                "created_at": created_at,
+                "changed_at": changed_at,
+                "increments": increments,
+                "logged_at": datetime.utcnow()
+            })
+            return
+        await self._apply(created_at, increments)
+
+    async def _apply(self, created_at: datetime, increments: Dict[str, Any]):
+        day = created_at.date()
+        await self.collection.update_one(
+            {"_id": day.isoformat()},
+            {
+                "$inc": increments,
+                "$setOnInsert": {"date": datetime(day.year, day.month, day.day)},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+
+    async def record_order(self, order: Dict):
+        """Intégrer une nouvelle commande"""
+        try:
+            created_at = _to_datetime(order.get("created_at"))
+            amount = _order_amount(order)
+            status = _key(order.get("status"))
+            country = _key(order.get("country"))
+            hour = str(created_at.hour)
+
+            await self._inc(created_at, {
+                "orders.count": 1,
+                "orders.revenue": amount,
+                f"orders_by_status.{status}.count": 1,
+                f"orders_by_status.{status}.revenue": amount,
+                f"orders_by_country.{country}.count": 1,
+                f"orders_by_country.{country}.revenue": amount,
+                f"orders_hourly.{status}.{hour}.count": 1,
+                f"orders_hourly.{status}.{hour}.revenue": amount
+            })
+        except Exception as e:
+            logger.error(f"Rollup order error: {e}")
+
+    async def record_lead(self, lead: Dict):
+        """Intégrer un nouveau lead"""
+        try:
+            await self._inc(lead.get("created_at"), {
+                "leads.count": 1,
+                f"leads_by_status.{_key(lead.get('status'))}": 1,
+                f"leads_by_type.{_key(lead.get('lead_type'))}": 1,
+                f"leads_by_customer_type.{_key(lead.get('customer_type'))}": 1,
+                f"leads_by_country.{_key(lead.get('country_code'))}": 1
+            })
+        except Exception as e:
+            logger.error(f"Rollup lead error: {e}")
+
+    async def record_lead_change(self, before: Optional[Dict], after: Optional[Dict],
+                                 changed_at: Optional[datetime] = None):
+        """Reporter un changement de statut/type d'un lead sur son jour de création"""
+        if not before or not after:
+            return
+        try:
+            increments = defaultdict(int)
+            for field, bucket in (("status", "leads_by_status"), ("lead_type", "leads_by_type")):
+                old_value, new_value = _key(before.get(field)), _key(after.get(field))
+                if old_value != new_value:
+                    increments[f"{bucket}.{old_value}"] -= 1
+                    increments[f"{bucket}.{new_value}"] += 1
+            if increments:
+                await self._inc(before.get("created_at"), dict(increments), changed_at or datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Rollup lead change error: {e}")
+
+    async def update_lead(self, query: Dict, update: Dict) -> Optional[Dict]:
+        """update_one sur leads en gardant les rollups cohérents"""
+        changed_at = await self._wait_for_lead_aggregation()
+        before = await self.db.leads.find_one_and_update(
+            query, update, return_document=ReturnDocument.BEFORE
+        )
+        if before:
+            after = await self.db.leads.find_one({"_id": before["_id"]})
+            await self.record_lead_change(before, after, changed_at)
+        return before
+
+    async def _wait_for_lead_aggregation(self) -> datetime:
+        """
+        Différer une mise à jour de lead pendant l'agrégation des leads d'une
+        reconstruction: l'agrégation voit alors soit l'état avant, soit l'état
+        après, et changed_at (pris avant la lecture du verrou) dit lequel.
+        """
+        changed_at = datetime.utcnow()
+        waited = 0.0
+        while waited < REBUILD_CONFIG["lead_wait_seconds"]:
+            state = await self._rebuild_state()
+            if not state or state.get("phase") != "leads":
+                return changed_at
+            await asyncio.sleep(0.2)
+            waited += 0.2
+            changed_at = datetime.utcnow()
+        logger.warning("Lead update proceeding during rollup lead aggregation")
+        return changed_at
+
+    async def record_contact(self, form: Dict):
+        """Intégrer un formulaire de contact"""
+        try:
+            await self._inc(form.get("created_at"), {"contacts.count": 1})
+        except Exception as e:
+            logger.error(f"Rollup contact error: {e}")
+
+    # ========== BACKFILL ==========
+
+    async def rebuild(self) -> Dict[str, Any]:
+        """Reconstruire tous les rollups depuis l'historique"""
+        started_at = datetime.utcnow()
+        grace = REBUILD_CONFIG["grace_seconds"]
+        # Documents créés avant la coupure: agrégation; après: journal
+        cutoff = started_at + timedelta(seconds=grace)
+
+        try:
+            await self.meta.update_one(
+                {"_id": "rebuild", "$or": [
+                    {"running": {"$ne": True}},
+                    {"started_at": {"$lt": started_at - REBUILD_CONFIG["timeout"]}}
+                ]},
+                {"$set": {"running": True, "phase": "orders", "started_at": started_at, "cutoff": cutoff}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return {"success": False, "error": "Reconstruction déjà en cours"}
+        self._rebuild_flag, self._rebuild_flag_read_at = True, time.monotonic()
+
+        await self.pending.delete_many({"logged_at": {"$lt": started_at}})
+        swapped = False
+        leads_started_at = None
+        try:
+            # Les écritures en vol au moment du verrou aboutissent avant la coupure
+            await asyncio.sleep(2 * grace)
+
+            days = await self._aggregate_orders_and_contacts(cutoff)
+
+            # Les mises à jour de leads attendent la fin de cette phase
+            leads_started_at = datetime.utcnow()
+            await self.meta.update_one({"_id": "rebuild"}, {"$set": {"phase": "leads", "leads_started_at": leads_started_at}})
+            await asyncio.sleep(grace)
+            await self._aggregate_leads(cutoff, days)
+            await self.meta.update_one({"_id": "rebuild"}, {"$set": {"phase": "swap"}})
+
+            day_count = await self._swap_in(days)
+            swapped = True
+        finally:
+            if swapped:
+                def missed_by_aggregation(entry: Dict) -> bool:
+                    if entry["created_at"] >= cutoff:
+                        return True
+                    return entry.get("changed_at") is not None and entry["changed_at"] >= leads_started_at
+            else:
+                # Échec avant l'échange: analytics_daily n'a reçu aucun incrément journalisé
+                def missed_by_aggregation(entry: Dict) -> bool:
+                    return True
+
+            await self._replay_pending(missed_by_aggregation)
+            await self.meta.update_one({"_id": "rebuild"}, {"$set": {"running": False, "phase": None}})
+            self._rebuild_flag = None
+            # Écritures ayant lu le verrou juste avant sa levée
+            await asyncio.sleep(grace)
+            await self._replay_pending(missed_by_aggregation)
+
+        await self.meta.update_one(
+            {"_id": "backfill"},
+            {"$set": {"started_at": started_at, "completed_at": datetime.utcnow(), "days": day_count}},
+            upsert=True
+        )
+
+        logger.info(f"Analytics rollups rebuilt: {day_count} days")
+        return {"success": True, "days": day_count}
+
+    @staticmethod
+    def _add(day_doc: Dict, path: List[str], value: Any):
+        target = day_doc
+        for part in path[:-1]:
+            target = target.setdefault(part, {})
+        target[path[-1]] = target.get(path[-1], 0) + value
+
+    @staticmethod
+    def _before_cutoff(cutoff: datetime) -> Dict:
+        return {"$match": {"$expr": {"$lt": [{"$toDate": "$created_at"}, cutoff]}}}
+
+    async def _aggregate_orders_and_contacts(self, cutoff: datetime) -> Dict[str, Dict]:
+        days: Dict[str, Dict] = defaultdict(dict)
+        created = {"$toDate": "$created_at"}
+        day_expr = {"$dateToString": {"format": "%Y-%m-%d", "date": created}}
+
+        order_rows = await self.db.orders.aggregate([
+            self._before_cutoff(cutoff),
+            {"$group": {
+                "_id": {
+                    "day": day_expr,
+                    "hour": {"$hour": created},
+                    "status": "$status",
+                    "country": "$country"
+                },
+                "count": {"$sum": 1},
+                "revenue": {"$sum": ORDER_AMOUNT_EXPR}
+            }}
+        ], allowDiskUse=True).to_list(None)
+
+        for row in order_rows:
+            group = row["_id"]
+            day_doc = days[group["day"]]
+            status, country, hour = _key(group.get("status")), _key(group.get("country")), str(group["hour"])
+            for path in (["orders"], ["orders_by_status", status], ["orders_by_country", country],
+                         ["orders_hourly", status, hour]):
+                self._add(day_doc, path + ["count"], row["count"])
+                self._add(day_doc, path + ["revenue"], row["revenue"])
+
+        contact_rows = await self.db.contact_forms.aggregate([
+            self._before_cutoff(cutoff),
+            {"$group": {"_id": day_expr, "count": {"$sum": 1}}}
+        ], allowDiskUse=True).to_list(None)
+
+        for row in contact_rows:
+            self._add(days[row["_id"]], ["contacts", "count"], row["count"])
+
+        return days
+
+    async def _aggregate_leads(self, cutoff: datetime, days: Dict[str, Dict]):
+        day_expr = {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$created_at"}}}
+        lead_rows = await self.db.leads.aggregate([
+            self._before_cutoff(cutoff),
+            {"$group": {
+                "_id": {
+                    "day": day_expr,
+                    "status": "$status",
+                    "lead_type": "$lead_type",
+                    "customer_type": "$customer_type",
+                    "country": "$country_code"
+                },
+                "count": {"$sum": 1}
+            }}
+        ], allowDiskUse=True).to_list(None)
+
+        for row in lead_rows:
+            group = row["_id"]
+            day_doc = days[group["day"]]
+            self._add(day_doc, ["leads", "count"], row["count"])
+            self._add(day_doc, ["leads_by_status", _key(group.get("status"))], row["count"])
+            self._add(day_doc, ["leads_by_type", _key(group.get("lead_type"))], row["count"])
+            self._add(day_doc, ["leads_by_customer_type", _key(group.get("customer_type"))], row["count"])
+            self._add(day_doc, ["leads_by_country", _key(group.get("country"))], row["count"])
+
+    async def _swap_in(self, days: Dict[str, Dict]) -> int:
+        """Écrire les jours dans la collection de travail puis la renommer en analytics_daily"""
+        await self.staging.drop()
+        documents = []
+        for day_id, day_doc in days.items():
+            if not day_id:
+                continue
+            day = date.fromisoformat(day_id)
+            documents.append({
+                "_id": day_id,
+                "date": datetime(day.year, day.month, day.day),
+                "updated_at": datetime.utcnow(),
+                **day_doc
+            })
+
+        if not documents:
+            await self.collection.delete_many({})
+            return 0
+
+        for i in range(0, len(documents), 500):
+            await self.staging.insert_many(documents[i:i + 500], ordered=False)
+        await self.staging.create_index("date")
+        await self.staging.rename(ROLLUP_COLLECTION, dropTarget=True)
+        return len(documents)
+
+    async def _replay_pending(self, should_apply) -> int:
+        """Appliquer (ou écarter) les incréments journalisés, dans l'ordre d'arrivée"""
+        applied = 0
+        async for entry in self.pending.find({}).sort("_id", 1):
+            if should_apply(entry):
+                await self._apply(entry["created_at"], entry["increments"])
+                applied += 1
+            await self.pending.delete_one({"_id": entry["_id"]})
+        return applied
+
+    # ========== LECTURE ==========
+
+    async def get_days(self, start_date: datetime, end_date: Optional[datetime] = None) -> List[Dict]:
+        """Documents journaliers couvrant la période (bornes au jour)"""
+        query = {"_id": {"$gte": start_date.date().isoformat()}}
+        if end_date:
+            query["_id"]["$lte"] = end_date.date().isoformat()
+        return await self.collection.find(query).sort("_id", 1).to_list(None)
+
+    async def get_all_days(self) -> List[Dict]:
+        return await self.collection.find({}).sort("_id", 1).to_list(None)
+
+    @staticmethod
+    def sum_counters(days: List[Dict], field: str) -> Dict[str, int]:
+        """Additionner un sous-document de compteurs simples (ex: leads_by_status)"""
+        totals = defaultdict(int)
+        for day in days:
+            for key, value in (day.get(field) or {}).items():
+                totals[key] += value
+        return dict(totals)
+
+    @staticmethod
+    def sum_orders(days: List[Dict], statuses: Optional[List[str]] = None) -> Dict[str, float]:
+        """Total commandes/revenue, éventuellement limité à certains statuts"""
+        count, revenue = 0, 0.0
+        for day in days:
+            if statuses is None:
+                bucket = day.get("orders") or {}
+                count += bucket.get("count", 0)
+                revenue += bucket.get("revenue", 0)
+            else:
+                for status in statuses:
+                    bucket = (day.get("orders_by_status") or {}).get(status) or {}
+                    count += bucket.get("count", 0)
+                    revenue += bucket.get("revenue", 0)
+        return {"count": count, "revenue": revenue}
+
+
+# ========== INSTANCE GLOBALE ==========
+
+analytics_rollups = None
+
+def get_analytics_rollups(db: AsyncIOMotorDatabase) -> AnalyticsRollupManager:
+    """Obtenir l'instance du gestionnaire de rollups"""
+    global analytics_rollups
+    if analytics_rollups is None:
+        analytics_rollups = AnalyticsRollupManager(db)
+    return analytics_rollups
+
+
+async def backfill_rollups():
+    """Reconstruire les rollups depuis l'historique (commande de backfill)"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'josmoze_crm')]
+    try:
+        manager = AnalyticsRollupManager(db)
+        await manager.create_indexes()
+        return await manager.rebuild()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    result = asyncio.run(backfill_rollups())
+    if result["success"]:
+        logger.info(f"✅ Backfill terminé - {result['days']} jours")
+    else:
+        logger.error(f"❌ Backfill non effectué - {result['error']}")
@@ -13,9 +13,11 @@ from slugify import slugify
 from bson import ObjectId
 
 from fastapi import HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from mongo_provider import get_mongo_provider
 from pydantic import BaseModel, Field
 
+from cache_invalidation import invalidate_cache
+
 # 🚀 PHASE 3 - Custom JSON Encoder pour ObjectId MongoDB
 class MongoJSONEncoder(json.JSONEncoder):
     """Encoder pour sérialiser ObjectId MongoDB en string"""
@@ -78,7 +80,7 @@ class BlogManager:
     async def initialize(self):
         """Initialiser la connexion MongoDB"""
         if not self.client:
-            self.client = AsyncIOMotorClient(MONGO_URL)
+            self.client = get_mongo_provider().client
             self.db = self.client[DB_NAME]
             
     async def create_article(self, article_data: BlogArticle) -> dict:
@@ -121,6 +123,7 @@ class BlogManager:
             
         # Sauvegarde
         await self.db.blog_articles.insert_one(article_data.dict())
+        await invalidate_cache("blog")
         
         logging.info(f"✅ Article créé: {article_data.title} (ID: {article_data.id})")
         
@@ -242,6 +245,9 @@ Protégez votre famille avec nos solutions de purification d'eau :
         # Si publication, ajouter date de publication
         if update_data.get("published") and not update_data.get("published_date"):
             update_data["published_date"] = update_data["updated_date"]
+        
+        # Ancien slug: les réponses en cache sont indexées par slug
+        previous = await self.db.blog_articles.find_one({"id": article_id}, {"slug": 1})
             
         result = await self.db.blog_articles.update_one(
             {"id": article_id},
@@ -250,6 +256,12 @@ Protégez votre famille avec nos solutions de purification d'eau :
         
         if result.modified_count == 0:
             raise HTTPException(404, "Article non trouvé")
+        
+        await invalidate_cache(
+            "blog",
+            f"blog:{previous['slug']}" if previous and previous.get("slug") else None,
+            f"blog:{update_data['slug']}" if "slug" in update_data else None
+        )
             
         return {"success": True, "message": "Article mis à jour"}
         
@@ -257,10 +269,12 @@ Protégez votre famille avec nos solutions de purification d'eau :
         """🗑️ Supprimer un article"""
         await self.initialize()
         
-        result = await self.db.blog_articles.delete_one({"id": article_id})
+        article = await self.db.blog_articles.find_one_and_delete({"id": article_id}, {"slug": 1})
         
-        if result.deleted_count == 0:
+        if article is None:
             raise HTTPException(404, "Article non trouvé")
+        
+        await invalidate_cache("blog", f"blog:{article['slug']}" if article.get("slug") else None)
             
         return {"success": True, "message": "Article supprimé"}
         
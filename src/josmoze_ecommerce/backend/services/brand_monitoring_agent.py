@@ -19,8 +19,11 @@ from typing import List, Dict, Set
 import requests
 from pathlib import Path
 import json
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from mongo_provider import get_mongo_provider
+
 # Configuration de l'agent
 MONITORING_CONFIG = {
     "check_interval": 30,  # 🚨 SURVEILLANCE RENFORCÉE : Vérification toutes les 30 secondes ⚡
@@ -57,12 +60,35 @@ ALLOWED_TERMS = [
 
 class BrandMonitoringAgent:
     def __init__(self):
-        self.mongo_client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-        self.db = self.mongo_client[os.getenv("DB_NAME", "test_database")]
         self.setup_logging()
         self.running = False
         self.violation_count = 0
         self.last_scan_results = {}
+        # Client propre au thread de surveillance: un client Motor reste lié à sa boucle
+        self._thread_loop = None
+        self._thread_client = None
+
+    @property
+    def db(self):
+        """Base MongoDB: client du thread de surveillance dans sa boucle, sinon client partagé de l'application"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._thread_client is not None and loop is self._thread_loop:
+            return self._thread_client[os.getenv("DB_NAME", "test_database")]
+        return get_mongo_provider().client[os.getenv("DB_NAME", "test_database")]
+
+    def attach_thread_loop(self, loop):
+        """Créer le client dédié à la boucle du thread de surveillance (petit pool)"""
+        self._thread_loop = loop
+        self._thread_client = AsyncIOMotorClient(get_mongo_provider().mongo_url, maxPoolSize=5)
+
+    def detach_thread_loop(self):
+        if self._thread_client is not None:
+            self._thread_client.close()
+        self._thread_loop = None
+        self._thread_client = None
 
     def setup_logging(self):
         """Configuration du système de logging"""
@@ -470,9 +496,7 @@ class BrandMonitoringAgent:
         Retourne les statistiques de surveillance
         """
         try:
-            # Create a new MongoDB client for this request to avoid loop issues
-            client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-            db = client[os.getenv("DB_NAME", "test_database")]
+            db = self.db
             
             # Statistiques des derniers scans
             recent_scans = await db.brand_monitoring.find().sort("scan_time", -1).limit(10).to_list(10)
@@ -483,9 +507,6 @@ class BrandMonitoringAgent:
             # Statistiques des alertes
             total_alerts = await db.brand_monitoring_alerts.count_documents({})
             
-            # Close the client
-            client.close()
-            
             return {
                 "status": "RUNNING" if self.running else "STOPPED",
                 "last_scan": self.last_scan_results,
@@ -525,19 +546,21 @@ def start_monitoring_task():
     """Démarre l'agent de surveillance en arrière-plan"""
     try:
         import threading
-        import asyncio
         
         def run_monitoring():
             """Fonction pour exécuter la surveillance dans un thread séparé"""
             try:
-                # Créer un nouvel événement loop pour ce thread
+                # Créer un nouvel événement loop pour ce thread, avec son propre client MongoDB
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
+                brand_monitor.attach_thread_loop(loop)
                 
                 # Lancer la surveillance
                 loop.run_until_complete(brand_monitor.run_monitoring_loop())
             except Exception as e:
                 logging.error(f"Erreur dans le thread de surveillance: {e}")
+            finally:
+                brand_monitor.detach_thread_loop()
         
         # Lancer dans un thread daemon (se ferme automatiquement avec l'app)
         thread = threading.Thread(target=run_monitoring, daemon=True)
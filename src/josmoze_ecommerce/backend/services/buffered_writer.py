@@ -0,0 +1,96 @@
+"""
+Josmoze.com - Écritures MongoDB groupées
+Tampon d'opérations (InsertOne, UpdateOne...) vidé par bulk_write dès qu'un
+lot est plein ou après un court délai: une écriture par lot au lieu d'un
+aller-retour par événement.
+
+Réservé aux écritures qui peuvent être perdues (événements, métriques): si la
+base reste indisponible, le tampon est borné à max_pending opérations et les
+plus anciennes sont abandonnées. Les changements d'état s'écrivent en direct.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedBulkWriter:
+    """Tampon d'opérations d'écriture pour une collection"""
+
+    def __init__(self, collection, batch_size: int = 500, flush_interval: float = 1.0, ordered: bool = False,
+                 max_pending: int = 10_000):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ordered = ordered
+        self.max_pending = max(max_pending, batch_size)
+        self._buffer: List[Any] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._dropping = False
+        self.stats = {"operations": 0, "batches": 0, "errors": 0, "dropped": 0}
+
+    async def add(self, operation: Any):
+        """Ajouter une opération; le lot part immédiatement s'il est plein"""
+        if len(self._buffer) >= self.max_pending:
+            # Base indisponible depuis trop longtemps: abandonner les plus anciennes
+            dropped = len(self._buffer) - self.max_pending + 1
+            del self._buffer[:dropped]
+            self.stats["dropped"] += dropped
+            if not self._dropping:
+                self._dropping = True
+                logger.warning(f"Write buffer for {self.collection.name} full ({self.max_pending}), dropping oldest operations")
+        self._buffer.append(operation)
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._buffer:
+                return
+
+    async def flush(self):
+        """Écrire toutes les opérations en attente"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    await self.collection.bulk_write(batch, ordered=self.ordered)
+                    self.stats["batches"] += 1
+                    self.stats["operations"] += len(batch)
+                    self._dropping = False
+                except BulkWriteError as e:
+                    # Erreurs d'écriture (doublons, validation): non réessayées
+                    self.stats["batches"] += 1
+                    self.stats["errors"] += len(e.details.get("writeErrors", []))
+                    logger.error(f"Bulk write errors on {self.collection.name}: {e.details.get('writeErrors', [])[:3]}")
+                except Exception as e:
+                    # Erreur réseau: remettre le lot en tête et réessayer plus tard
+                    self._buffer[:0] = batch
+                    logger.error(f"Bulk write failed on {self.collection.name}, retry in {self.flush_interval}s: {e}")
+                    self._schedule_flush()
+                    break
+
+    async def close(self):
+        await self.flush()
+        # Tampon vide: le flush différé n'a plus rien à écrire
+        if not self._buffer and self._flusher and not self._flusher.done():
+            self._flusher.cancel()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "pending": len(self._buffer)}
@@ -0,0 +1,141 @@
+"""
+Josmoze.com - Bus d'invalidation du cache de réponses
+Les écritures (produits, promotions, blog) publient des tags, ex: "product:<id>",
+"blog:<slug>". Chaque worker supprime alors les réponses en cache portant ces
+tags, sans attendre l'expiration du TTL.
+
+La diffusion entre workers passe par Redis pub/sub une fois le bus démarré;
+sans Redis, l'invalidation reste locale au processus.
+"""
+
+import json
+import uuid
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class CacheInvalidationBus:
+    """Diffusion des invalidations de cache (local + autres workers)"""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0):
+        self.redis_options = {"host": host, "port": port, "db": db, "decode_responses": True}
+        self.origin = uuid.uuid4().hex  # Ignorer nos propres messages
+        self._listeners: List[Callable[[List[str], Optional[str]], int]] = []
+        self._redis = None
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self.stats = {"published": 0, "received": 0, "removed_entries": 0, "errors": 0}
+
+    def add_listener(self, callback: Callable[[List[str], Optional[str]], int]):
+        """callback(tags, pattern) -> nombre d'entrées supprimées"""
+        self._listeners.append(callback)
+
+    def _apply(self, tags: List[str], pattern: Optional[str]) -> int:
+        removed = 0
+        for callback in self._listeners:
+            try:
+                removed += callback(tags, pattern) or 0
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Cache invalidation listener error: {e}")
+        self.stats["removed_entries"] += removed
+        return removed
+
+    async def publish(self, *tags: str, pattern: Optional[str] = None) -> int:
+        """Invalider localement puis diffuser aux autres workers. Ne lève jamais d'exception."""
+        tags = sorted({tag for tag in tags if tag})
+        if not tags and not pattern:
+            return 0
+
+        removed = self._apply(tags, pattern)
+        self.stats["published"] += 1
+
+        if self._redis is not None:
+            try:
+                message = json.dumps({"origin": self.origin, "tags": tags, "pattern": pattern})
+                await self._redis.publish(CACHE_INVALIDATION_CHANNEL, message)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Cache invalidation broadcast failed ({tags or pattern}): {e}")
+        return removed
+
+    async def start(self) -> bool:
+        """S'abonner au canal Redis. False si Redis est indisponible (invalidation locale seulement)."""
+        if self._listener_task is not None:
+            return True
+
+        client = aioredis.Redis(**self.redis_options)
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+        except Exception as e:
+            logger.warning(f"Redis pub/sub unavailable, cache invalidation stays local: {e}")
+            await client.aclose()
+            return False
+
+        self._redis = client
+        self._pubsub = pubsub
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info("Cache invalidation bus subscribed")
+        return True
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") == self.origin:
+                        continue
+                    self.stats["received"] += 1
+                    self._apply(data.get("tags", []), data.get("pattern"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Connexion perdue: le pub/sub se réabonne à la reconnexion
+                self.stats["errors"] += 1
+                logger.error(f"Cache invalidation listener error, retrying: {e}")
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "listeners": len(self._listeners), "broadcasting": self._redis is not None}
+
+
+# ========== INSTANCE GLOBALE ==========
+
+cache_bus = None
+
+def get_cache_bus() -> CacheInvalidationBus:
+    """Obtenir le bus d'invalidation partagé"""
+    global cache_bus
+    if cache_bus is None:
+        cache_bus = CacheInvalidationBus()
+    return cache_bus
+
+
+async def invalidate_cache(*tags: str) -> int:
+    """Raccourci pour les écritures: invalider les réponses portant ces tags"""
+    return await get_cache_bus().publish(*tags)
@@ -0,0 +1,176 @@
+"""
+Josmoze.com - Catalogue produits précalculé
+Pour chaque (langue, type de client), la liste des produits traduite et
+annotée du stock est construite une fois puis servie sous forme de JSON
+déjà sérialisé: une requête de catalogue devient une lecture de dictionnaire.
+
+Les instantanés sont reconstruits en arrière-plan quand un événement catalogue
+("products") ou traduction est publié sur le bus d'invalidation du cache, ou
+quand ils dépassent max_age (chiffres de stock affichés); l'ancienne version
+reste servie pendant la reconstruction. Les mouvements de stock (product:<id>
+seul) ne déclenchent pas de reconstruction.
+"""
+
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from cache_invalidation import get_cache_bus
+from inventory_manager import get_inventory_manager
+from translation_service import translation_service, AVAILABLE_LANGUAGES
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_SNAPSHOT_CONFIG = {
+    "rebuild_delay": 2.0,      # Regroupe les événements rapprochés (ex: commande de plusieurs produits)
+    "default_stock": 50,       # Stock affiché par défaut (exigence client: tout est en stock)
+    "max_age": 300,            # Rafraîchir les chiffres de stock au plus tard après 5 minutes
+    "default_language": "FR",
+    "default_customer_type": "B2C"
+}
+
+CUSTOMER_TYPES = {"B2C", "B2B"}
+
+SNAPSHOT_TAGS = {"products", "translations"}
+
+
+class CatalogueSnapshotService:
+    """Instantanés JSON du catalogue par (langue, type de client)"""
+
+    def __init__(self, db, product_model):
+        self.db = db
+        self.product_model = product_model
+        self.snapshots: Dict[Tuple[str, str], bytes] = {}
+        self.built_at: Dict[Tuple[str, str], datetime] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._version = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "builds": 0, "invalidations": 0, "errors": 0}
+        get_cache_bus().add_listener(self.on_invalidation)
+
+    async def get(self, language: str, customer_type: str) -> bytes:
+        """JSON du catalogue, construit à la première demande"""
+        key = self.snapshot_key(language, customer_type)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None:
+            self.stats["hits"] += 1
+            if (datetime.utcnow() - self.built_at[key]).total_seconds() > CATALOGUE_SNAPSHOT_CONFIG["max_age"]:
+                self._schedule_rebuild()
+            return snapshot
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Construit entre-temps par une requête concurrente
+            if key not in self.snapshots:
+                await self._build(key)
+        return self.snapshots[key]
+
+    @staticmethod
+    def snapshot_key(language: str, customer_type: str) -> Tuple[str, str]:
+        """Clé d'instantané bornée: langue et type de client inconnus ramenés aux valeurs par défaut"""
+        language = (language or "").upper()
+        if language not in AVAILABLE_LANGUAGES:
+            language = CATALOGUE_SNAPSHOT_CONFIG["default_language"]
+        customer_type = (customer_type or "").upper()
+        if customer_type not in CUSTOMER_TYPES:
+            customer_type = CATALOGUE_SNAPSHOT_CONFIG["default_customer_type"]
+        return language, customer_type
+
+    async def _build(self, key: Tuple[str, str]):
+        language, customer_type = key
+        payload = await self.render(language, customer_type)
+        self.snapshots[key] = json.dumps(
+            jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.built_at[key] = datetime.utcnow()
+        self.stats["builds"] += 1
+
+    async def render(self, language: str, customer_type: str) -> Dict[str, Any]:
+        """Catalogue complet: produits traduits + informations de stock"""
+        products_data = await self.db.products.find({"target_audience": {"$in": [customer_type, "both"]}}).to_list(1000)
+        if not products_data:
+            logger.warning("⚠️ Aucun produit trouvé pour traduction")
+            return {"products": [], "message": "Aucun produit disponible"}
+
+        # Traduire tout le catalogue en une passe (requêtes DeepL groupées)
+        if language != "FR":
+            translated_data = await translation_service.translate_product_list(products_data, language)
+        else:
+            translated_data = products_data
+
+        stock_statuses = await self._get_stock_statuses([product["id"] for product in products_data])
+        default_stock = CATALOGUE_SNAPSHOT_CONFIG["default_stock"]
+
+        products: List[Dict[str, Any]] = []
+        for product, translated_product in zip(products_data, translated_data):
+            product_dict = self.product_model(**translated_product).dict()
+            available_stock = stock_statuses.get(product["id"], {}).get("available_stock", default_stock)
+            product_dict["stock_info"] = {
+                "in_stock": True,  # Force TOUS les produits en stock selon exigence client
+                "show_stock_warning": False,  # Pas d'alerte stock
+                "stock_warning_text": None,
+                "available_stock": available_stock if available_stock > 0 else default_stock  # Stock minimum 50 unités
+            }
+            products.append(product_dict)
+
+        return {
+            "products": products,
+            "language": language,
+            "customer_type": customer_type
+        }
+
+    async def _get_stock_statuses(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        statuses = await get_inventory_manager(self.db).get_stock_status_many(product_ids)
+        return {product_id: status for product_id, status in statuses.items() if "error" not in status}
+
+    def on_invalidation(self, tags: List[str], pattern: Optional[str]) -> int:
+        """Listener du bus d'invalidation: reconstruire si le catalogue ou une traduction change"""
+        if not pattern and not any(tag in SNAPSHOT_TAGS for tag in tags):
+            return 0
+        self._version += 1
+        self.stats["invalidations"] += 1
+        self._schedule_rebuild()
+        return 0
+
+    def _schedule_rebuild(self):
+        if self.snapshots and (self._rebuild_task is None or self._rebuild_task.done()):
+            self._rebuild_task = asyncio.get_running_loop().create_task(self._rebuild_later())
+
+    async def _rebuild_later(self):
+        """Reconstruire les instantanés existants; l'ancienne version reste servie en attendant"""
+        while True:
+            version = self._version
+            await asyncio.sleep(CATALOGUE_SNAPSHOT_CONFIG["rebuild_delay"])
+            for key in list(self.snapshots):
+                try:
+                    async with self._locks.setdefault(key, asyncio.Lock()):
+                        await self._build(key)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"❌ Catalogue snapshot rebuild failed for {key}: {e}")
+            # Nouvel événement pendant la reconstruction: recommencer
+            if self._version == version:
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "snapshots": {f"{language}/{customer_type}": len(snapshot) for (language, customer_type), snapshot in self.snapshots.items()},
+            "rebuilding": self._rebuild_task is not None and not self._rebuild_task.done()
+        }
+
+
+# ========== INSTANCE GLOBALE ==========
+
+catalogue_snapshots = None
+
+def get_catalogue_snapshots(db, product_model) -> CatalogueSnapshotService:
+    """Obtenir le service d'instantanés du catalogue"""
+    global catalogue_snapshots
+    if catalogue_snapshots is None:
+        catalogue_snapshots = CatalogueSnapshotService(db, product_model)
+    return catalogue_snapshots
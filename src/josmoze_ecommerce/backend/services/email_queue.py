@@ -0,0 +1,292 @@
+"""
+Josmoze.com - File d'envoi d'emails persistante
+Collection email_outbox alimentée par les planificateurs (séquences prospects,
+relances paniers abandonnés) et consommée par un pool de workers asynchrones.
+
+- Réservation atomique (find_one_and_update) avec bail: un job réservé par un
+  worker arrêté brutalement redevient disponible à l'expiration du bail.
+- Clé d'idempotence = _id du job: un même email ne peut être mis en file
+  qu'une seule fois, et seul le détenteur du bail peut le clôturer.
+- Les échecs temporaires sont réessayés avec backoff, les échecs définitifs
+  passent en lettre morte (status "dead"); le callback de lettre morte du
+  type de job clôture alors l'entrée source (séquence, email programmé).
+
+La livraison reste "au moins une fois": un arrêt entre l'acceptation SMTP et
+la clôture du job peut provoquer un renvoi, limité par la vérification d'état
+faite par chaque handler avant l'envoi.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "email_outbox"
+
+EMAIL_QUEUE_CONFIG = {
+    "workers": int(os.environ.get("EMAIL_QUEUE_WORKERS", "4")),
+    "lease_seconds": 300,          # Durée de réservation d'un job
+    "max_attempts": 5,             # Au-delà: lettre morte
+    "retry_base_seconds": 60,      # Backoff exponentiel entre tentatives
+    "poll_interval_seconds": 5,    # Attente quand la file est vide
+    "scheduler_batch_size": 500,   # Entrées mises en file par passage des planificateurs
+    "orphan_check_seconds": 900    # Entrée "queued" revérifiée (job perdu?) au plus toutes les 15 min
+}
+
+
+class PermanentDeliveryError(Exception):
+    """Échec définitif: le job part directement en lettre morte"""
+
+
+class TransientDeliveryError(Exception):
+    """Échec temporaire signalé par un handler: le job est réessayé avec backoff"""
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[str]]]
+DeadLetterHandler = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+
+class OutboundEmailQueue:
+    """File d'envoi persistante avec workers asynchrones"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db[OUTBOX_COLLECTION]
+        self.handlers: Dict[str, Handler] = {}
+        self.dead_letter_handlers: Dict[str, DeadLetterHandler] = {}
+        self.workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def create_indexes(self):
+        await self.collection.create_index([("status", 1), ("kind", 1), ("available_at", 1)])
+        await self.collection.create_index([("status", 1), ("lease_until", 1)])
+
+    def register_handler(self, kind: str, handler: Handler, on_dead: Optional[DeadLetterHandler] = None):
+        """
+        Associer un type de job à sa fonction d'envoi.
+        Le handler retourne le statut final ("sent" par défaut, ou "skipped"),
+        lève PermanentDeliveryError pour un échec définitif et toute autre
+        exception pour un échec temporaire.
+        on_dead(payload, erreur) est appelé quand le job passe en lettre morte.
+        """
+        self.handlers[kind] = handler
+        if on_dead is not None:
+            self.dead_letter_handlers[kind] = on_dead
+        self._wakeup.set()
+
+    # ========== MISE EN FILE ==========
+
+    def _job(self, kind: str, idempotency_key: str, payload: Dict[str, Any], available_at: Optional[datetime]) -> Dict:
+        now = datetime.utcnow()
+        return {
+            "_id": idempotency_key,
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "available_at": available_at or now,
+            "lease_until": None,
+            "worker_id": None,
+            "last_error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+
+    async def enqueue(self, kind: str, idempotency_key: str, payload: Dict[str, Any],
+                      available_at: Optional[datetime] = None) -> bool:
+        """Mettre un email en file. False si la clé existe déjà."""
+        try:
+            await self.collection.insert_one(self._job(kind, idempotency_key, payload, available_at))
+            self._wakeup.set()
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def enqueue_many(self, kind: str, jobs: List[Dict[str, Any]]) -> int:
+        """
+        Mettre plusieurs emails en file.
+        jobs: [{"idempotency_key": ..., "payload": {...}, "available_at": optionnel}]
+        Retourne le nombre de jobs réellement ajoutés (doublons ignorés).
+        """
+        if not jobs:
+            return 0
+        documents = [
+            self._job(kind, job["idempotency_key"], job["payload"], job.get("available_at"))
+            for job in jobs
+        ]
+        try:
+            result = await self.collection.insert_many(documents, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        if inserted:
+            self._wakeup.set()
+        return inserted
+
+    # ========== RÉSERVATION / CLÔTURE ==========
+
+    async def claim(self, worker_id: str) -> Optional[Dict]:
+        """Réserver atomiquement le prochain job disponible"""
+        if not self.handlers:
+            return None
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "kind": {"$in": list(self.handlers)},
+                "$or": [
+                    {"status": "pending", "available_at": {"$lte": now}},
+                    {"status": "sending", "lease_until": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "sending",
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=EMAIL_QUEUE_CONFIG["lease_seconds"]),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _finish(self, job: Dict, update: Dict) -> bool:
+        """Clôturer un job, uniquement si le bail est toujours détenu"""
+        update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+        update["$set"]["lease_until"] = None
+        result = await self.collection.update_one(
+            {"_id": job["_id"], "status": "sending", "worker_id": job["worker_id"]},
+            update
+        )
+        return result.modified_count == 1
+
+    async def process_job(self, job: Dict):
+        """Exécuter le handler d'un job réservé et enregistrer le résultat"""
+        handler = self.handlers[job["kind"]]
+        try:
+            status = await handler(job["payload"]) or "sent"
+            await self._finish(job, {"$set": {"status": status, "completed_at": datetime.utcnow()}})
+
+        except PermanentDeliveryError as e:
+            logger.warning(f"Email job {job['_id']} dead-lettered: {e}")
+            await self._dead_letter(job, str(e))
+
+        except Exception as e:
+            if job["attempts"] >= EMAIL_QUEUE_CONFIG["max_attempts"]:
+                logger.error(f"Email job {job['_id']} dead-lettered after {job['attempts']} attempts: {e}")
+                await self._dead_letter(job, str(e))
+            else:
+                delay = EMAIL_QUEUE_CONFIG["retry_base_seconds"] * (2 ** (job["attempts"] - 1))
+                logger.warning(f"Email job {job['_id']} failed (attempt {job['attempts']}), retry in {delay}s: {e}")
+                await self._finish(job, {"$set": {
+                    "status": "pending",
+                    "last_error": str(e),
+                    "available_at": datetime.utcnow() + timedelta(seconds=delay)
+                }})
+
+    async def _dead_letter(self, job: Dict, error: str):
+        """Passer le job en lettre morte puis clôturer son entrée source"""
+        finished = await self._finish(job, {"$set": {
+            "status": "dead", "last_error": error, "dead_at": datetime.utcnow()
+        }})
+        on_dead = self.dead_letter_handlers.get(job["kind"])
+        if finished and on_dead is not None:
+            try:
+                await on_dead(job["payload"], error)
+            except Exception as e:
+                # L'entrée reste "queued": le planificateur la clôturera en voyant le job mort
+                logger.error(f"Dead-letter callback failed for email job {job['_id']}: {e}")
+
+    async def job_statuses(self, idempotency_keys: List[str]) -> Dict[str, str]:
+        """Statut des jobs existants pour ces clés (clé absente: aucun job en file)"""
+        if not idempotency_keys:
+            return {}
+        cursor = self.collection.find({"_id": {"$in": idempotency_keys}}, {"status": 1})
+        return {job["_id"]: job["status"] async for job in cursor}
+
+    # ========== WORKERS ==========
+
+    async def _worker_loop(self, worker_id: str):
+        while True:
+            try:
+                job = await self.claim(worker_id)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), EMAIL_QUEUE_CONFIG["poll_interval_seconds"])
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self.process_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Email queue worker {worker_id} error: {e}")
+                await asyncio.sleep(EMAIL_QUEUE_CONFIG["poll_interval_seconds"])
+
+    def start(self, workers: int = EMAIL_QUEUE_CONFIG["workers"]):
+        """Démarrer le pool de workers (idempotent)"""
+        if self.workers:
+            return
+        instance = uuid.uuid4().hex[:8]
+        self.workers = [
+            asyncio.create_task(self._worker_loop(f"{instance}-{i}"))
+            for i in range(workers)
+        ]
+        logger.info(f"Email queue started with {workers} workers")
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    # ========== SUIVI ==========
+
+    async def get_stats(self) -> Dict[str, Any]:
+        rows = await self.collection.aggregate([
+            {"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row["_id"]["kind"], {})[row["_id"]["status"]] = row["count"]
+        return {"by_kind": stats, "workers": len(self.workers)}
+
+    async def get_dead_letters(self, limit: int = 100) -> List[Dict]:
+        return await self.collection.find({"status": "dead"}).sort("dead_at", -1).to_list(limit)
+
+    async def requeue_dead(self, idempotency_key: str) -> bool:
+        """Remettre en file un job en lettre morte"""
+        result = await self.collection.update_one(
+            {"_id": idempotency_key, "status": "dead"},
+            {"$set": {
+                "status": "pending", "attempts": 0, "available_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        if result.modified_count:
+            self._wakeup.set()
+        return result.modified_count == 1
+
+
+# ========== INSTANCE GLOBALE ==========
+
+email_queue = None
+
+def get_email_queue(db: AsyncIOMotorDatabase) -> OutboundEmailQueue:
+    """Obtenir l'instance de la file d'envoi"""
+    global email_queue
+    if email_queue is None:
+        email_queue = OutboundEmailQueue(db)
+    return email_queue
@@ -12,9 +12,14 @@ from typing import List, Dict, Any, Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from jinja2 import Template
 import logging
 
+from mail_transport import get_mail_transport, classify_delivery_error, DeliveryOutcome
+from email_queue import get_email_queue, PermanentDeliveryError, EMAIL_QUEUE_CONFIG
+from email_templates import get_template_registry
+from buffered_writer import BufferedBulkWriter
+from pymongo import InsertOne
+
 class EmailSequencerManager:
     def __init__(self, db, suppression_manager):
         self.db = db
@@ -24,6 +29,13 @@ class EmailSequencerManager:
         self.metrics_collection = db.email_metrics
         self.gdpr_journal = db.gdpr_journal
         
+        # Événements groupés (bulk_write par lot); les changements de statut s'écrivent en direct
+        self.event_logger = BufferedBulkWriter(self.metrics_collection)
+        
+        # File d'envoi persistante (workers partagés)
+        self.email_queue = get_email_queue(db)
+        self.email_queue.register_handler("sequence", self.deliver_queued_email, on_dead=self.dead_letter_email)
+        
         # Configuration SMTP
         self.smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
         self.smtp_port = int(os.environ.get('SMTP_PORT', '587'))
@@ -387,6 +399,13 @@ class EmailSequencerManager:
                 """
             }
         }
+        
+        # Templates compilés une seule fois (recompilés seulement si la source change)
+        self.template_registry = get_template_registry()
+        self.template_registry.register_many({
+            f"sequence/{step}": config["template"]
+            for step, config in self.email_templates.items()
+        })
     
     async def create_indexes(self):
         """Créer les index pour optimiser les performances"""
@@ -397,6 +416,8 @@ class EmailSequencerManager:
             await self.sequences_collection.create_index([("step", 1)])
             await self.sequences_collection.create_index([("scheduled_at", 1)])
             await self.sequences_collection.create_index([("status", 1)])
+            await self.sequences_collection.create_index([("status", 1), ("scheduled_at", 1)])
+            await self.sequences_collection.create_index([("status", 1), ("checked_at", 1)])
             
             # Index pour les métriques
             await self.metrics_collection.create_index([("sequence_id", 1)])
@@ -446,12 +467,16 @@ class EmailSequencerManager:
             filtered_prospects = []
             skipped_count = 0
             
+            # Vérifier la liste de suppression en une seule passe
+            suppressed = await self.suppression_manager.are_emails_suppressed(
+                [prospect.get("email", "") for prospect in eligible_prospects]
+            )
+            
             for prospect in eligible_prospects:
                 email = prospect.get("email", "")
                 
                 # Vérifier la liste de suppression
-                is_suppressed = await self.suppression_manager.is_email_suppressed(email)
-                if is_suppressed:
+                if suppressed.get(email):
                     skipped_count += 1
                     # Journaliser le skip
                     await self.log_email_event(
@@ -512,43 +537,15 @@ class EmailSequencerManager:
             if sequence_entries:
                 await self.sequences_collection.insert_many(sequence_entries)
             
-            # Envoyer immédiatement l'Email 1 (J+0)
+            # Mettre immédiatement l'Email 1 (J+0) dans la file d'envoi
             email1_entries = [entry for entry in sequence_entries if entry["step"] == "email1"]
-            sent_count = 0
-            
-            for entry in email1_entries:
-                success = await self.send_email(
-                    sequence_id=sequence_id,
-                    prospect_email=entry["prospect_email"],
-                    prospect_first_name=entry["prospect_first_name"],
-                    step="email1",
-                    test_mode=test_mode
-                )
-                
-                if success:
-                    sent_count += 1
-                    # Marquer l'entrée comme envoyée
-                    await self.sequences_collection.update_one(
-                        {"sequence_id": sequence_id, "prospect_email": entry["prospect_email"], "step": "email1"},
-                        {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}}
-                    )
-                    
-                    # Mettre à jour le statut du prospect
-                    await self.prospects_collection.update_one(
-                        {"email": entry["prospect_email"]},
-                        {
-                            "$set": {
-                                "status": "contacted",
-                                "last_contacted_at": datetime.now(timezone.utc)
-                            }
-                        }
-                    )
+            queued_count = await self._enqueue_entries(email1_entries)
             
             # Journaliser le lancement de séquence
             await self.suppression_manager.log_gdpr_action(
                 action_type="email_sequence_started",
                 email="",
-                details=f"Started sequence {sequence_id}: {sent_count} sent, {skipped_count} skipped",
+                details=f"Started sequence {sequence_id}: {queued_count} queued, {skipped_count} skipped",
                 agent_email=agent_email
             )
             
@@ -558,7 +555,7 @@ class EmailSequencerManager:
                 "total_prospects": len(eligible_prospects),
                 "filtered_prospects": len(filtered_prospects),
                 "skipped_count": skipped_count,
-                "email1_sent": sent_count,
+                "email1_queued": queued_count,
                 "test_mode": test_mode
             }
             
@@ -566,8 +563,12 @@ class EmailSequencerManager:
             logging.error(f"Erreur lors du démarrage de séquence: {e}")
             return {"success": False, "error": str(e)}
     
-    async def send_email(self, sequence_id: str, prospect_email: str, prospect_first_name: str, step: str, test_mode: bool = False) -> bool:
-        """Envoyer un email de la séquence"""
+    async def send_email(self, sequence_id: str, prospect_email: str, prospect_first_name: str, step: str, test_mode: bool = False) -> DeliveryOutcome:
+        """
+        Envoyer un email de la séquence.
+        Retourne SENT, SUPPRESSED ou HARD_BOUNCE; les échecs temporaires
+        (4xx restant, réseau, base) sont relevés pour que la file réessaie.
+        """
         try:
             # Vérifier une dernière fois la liste de suppression
             is_suppressed = await self.suppression_manager.is_email_suppressed(prospect_email)
@@ -579,7 +580,7 @@ class EmailSequencerManager:
                     event_type="skipped_suppressed",
                     details="Email suppressed at send time"
                 )
-                return False
+                return DeliveryOutcome.SUPPRESSED
             
             # Obtenir le template d'email
             template_config = self.email_templates.get(step)
@@ -593,8 +594,8 @@ class EmailSequencerManager:
             cta_link = f"{self.base_url}/acheter?utm_source=email&utm_campaign=osmozeur_seq1&utm_content={template_config['utm_content']}"
             
             # Rendu du template
-            template = Template(template_config["template"])
-            html_content = template.render(
+            html_content = self.template_registry.render(
+                f"sequence/{step}",
                 subject=template_config["subject"],
                 first_name=prospect_first_name,
                 cta_link=cta_link,
@@ -622,16 +623,17 @@ class EmailSequencerManager:
                     event_type="sent",
                     details="Test mode - simulated send"
                 )
-                return True
+                return DeliveryOutcome.SENT
             else:
                 # Mode production - envoi réel
                 try:
-                    with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                        server.starttls()
-                        if self.smtp_password:
-                            server.login(self.smtp_username, self.smtp_password)
-                        
-                        server.send_message(msg)
+                    await get_mail_transport().send_message(
+                        msg,
+                        host=self.smtp_host,
+                        port=self.smtp_port,
+                        username=self.smtp_username,
+                        password=self.smtp_password
+                    )
                     
                     print(f"📧 Email {step} envoyé avec succès à {prospect_email}")
                     
@@ -644,16 +646,36 @@ class EmailSequencerManager:
                         details="Email sent successfully"
                     )
                     
-                    return True
+                    return DeliveryOutcome.SENT
                     
                 except smtplib.SMTPException as e:
                     print(f"❌ Erreur SMTP pour {prospect_email}: {e}")
                     
                     # Déterminer le type d'erreur
+                    outcome = classify_delivery_error(e)
+                    event_types = {
+                        DeliveryOutcome.HARD_BOUNCE: "hard_bounce",
+                        DeliveryOutcome.UNCERTAIN: "delivery_uncertain"
+                    }
+                    await self.log_email_event(
+                        sequence_id=sequence_id,
+                        prospect_email=prospect_email,
+                        step=step,
+                        event_type=event_types.get(outcome, "soft_bounce"),
+                        details=str(e)
+                    )
+                    
+                    if outcome == DeliveryOutcome.UNCERTAIN:
+                        # Peut-être délivré: pas de renvoi automatique
+                        return outcome
+                    
+                    if outcome != DeliveryOutcome.HARD_BOUNCE:
+                        # Réessayé par la file d'envoi
+                        raise
+                    
                     error_str = str(e).lower()
                     if "550" in error_str or "5.1.1" in error_str:
-                        event_type = "hard_bounce"
-                        # Ajouter automatiquement à la liste de suppression
+                        # Adresse inexistante: ajouter automatiquement à la liste de suppression
                         await self.suppression_manager.add_email_to_suppression_list(
                             email=prospect_email,
                             reason="hard_bounce",
@@ -661,19 +683,10 @@ class EmailSequencerManager:
                             notes=f"Hard bounce from step {step}: {str(e)}",
                             agent_email="email_sequencer"
                         )
-                    else:
-                        event_type = "soft_bounce"
-                    
-                    await self.log_email_event(
-                        sequence_id=sequence_id,
-                        prospect_email=prospect_email,
-                        step=step,
-                        event_type=event_type,
-                        details=str(e)
-                    )
-                    
-                    return False
+                    return DeliveryOutcome.HARD_BOUNCE
             
+        except smtplib.SMTPException:
+            raise
         except Exception as e:
             print(f"❌ Erreur lors de l'envoi email: {e}")
             await self.log_email_event(
@@ -683,59 +696,164 @@ class EmailSequencerManager:
                 event_type="error",
                 details=str(e)
             )
-            return False
+            raise
+    
+    async def _enqueue_entries(self, entries: List[Dict[str, Any]]) -> int:
+        """Mettre des entrées de séquence dans la file d'envoi (idempotent par séquence/destinataire/étape)"""
+        if not entries:
+            return 0
+        
+        # Marquer avant la mise en file: un worker ne délivre que les entrées "queued"
+        now = datetime.now(timezone.utc)
+        await self.sequences_collection.update_many(
+            {"_id": {"$in": [entry["_id"] for entry in entries]}, "status": "scheduled"},
+            {"$set": {"status": "queued", "queued_at": now, "checked_at": now}}
+        )
+        
+        jobs = [
+            {
+                "idempotency_key": self._job_key(entry),
+                "payload": {
+                    "sequence_id": entry["sequence_id"],
+                    "prospect_email": entry["prospect_email"],
+                    "prospect_first_name": entry.get("prospect_first_name", ""),
+                    "step": entry["step"],
+                    "test_mode": entry.get("test_mode", False)
+                }
+            }
+            for entry in entries
+        ]
+        return await self.email_queue.enqueue_many("sequence", jobs)
+    
+    @staticmethod
+    def _job_key(entry: Dict[str, Any]) -> str:
+        return f"sequence:{entry['sequence_id']}:{entry['prospect_email']}:{entry['step']}"
+    
+    async def _recover_queued_entries(self, now: datetime) -> int:
+        """
+        Entrées "queued" revérifiées périodiquement: remises en file si leur job
+        n'existe pas (arrêt entre le marquage et la mise en file), clôturées si
+        leur job est en lettre morte. Les jobs vivants ne sont pas touchés.
+        """
+        cutoff = now - timedelta(seconds=EMAIL_QUEUE_CONFIG["orphan_check_seconds"])
+        batch_size = EMAIL_QUEUE_CONFIG["scheduler_batch_size"]
+        entries = await self.sequences_collection.find({
+            "status": "queued",
+            "$or": [{"checked_at": {"$lte": cutoff}}, {"checked_at": {"$exists": False}}]
+        }).limit(batch_size).to_list(batch_size)
+        if not entries:
+            return 0
+        
+        await self.sequences_collection.update_many(
+            {"_id": {"$in": [entry["_id"] for entry in entries]}, "status": "queued"},
+            {"$set": {"checked_at": now}}
+        )
+        statuses = await self.email_queue.job_statuses([self._job_key(entry) for entry in entries])
+        for entry in entries:
+            if statuses.get(self._job_key(entry)) == "dead":
+                await self.dead_letter_email(entry, "Job en lettre morte")
+        return await self._enqueue_entries([entry for entry in entries if self._job_key(entry) not in statuses])
+    
+    async def dead_letter_email(self, payload: Dict[str, Any], error: str):
+        """Callback de lettre morte: l'entrée ne reste pas "queued" après l'abandon du job"""
+        await self.sequences_collection.update_one(
+            {
+                "sequence_id": payload["sequence_id"],
+                "prospect_email": payload["prospect_email"],
+                "step": payload["step"],
+                "status": "queued"
+            },
+            {"$set": {"status": "error", "error_at": datetime.now(timezone.utc), "last_error": error}}
+        )
+    
+    async def deliver_queued_email(self, payload: Dict[str, Any]) -> str:
+        """Handler de la file d'envoi pour une étape de séquence"""
+        entry_filter = {
+            "sequence_id": payload["sequence_id"],
+            "prospect_email": payload["prospect_email"],
+            "step": payload["step"]
+        }
+        
+        # Séquence arrêtée ou email déjà envoyé: ne rien renvoyer
+        entry = await self.sequences_collection.find_one({**entry_filter, "status": "queued"})
+        if not entry:
+            return "skipped"
+        
+        # Échec temporaire: l'exception remonte, l'entrée reste "queued" et le job est réessayé
+        outcome = await self.send_email(
+            sequence_id=payload["sequence_id"],
+            prospect_email=payload["prospect_email"],
+            prospect_first_name=payload["prospect_first_name"],
+            step=payload["step"],
+            test_mode=payload.get("test_mode", False)
+        )
+        
+        now = datetime.now(timezone.utc)
+        if outcome == DeliveryOutcome.SUPPRESSED:
+            await self.sequences_collection.update_one(
+                {"_id": entry["_id"]},
+                {"$set": {"status": "suppressed", "suppressed_at": now}}
+            )
+            return "skipped"
+        
+        if outcome == DeliveryOutcome.HARD_BOUNCE:
+            await self.sequences_collection.update_one(
+                {"_id": entry["_id"]},
+                {"$set": {"status": "error", "error_at": now}}
+            )
+            raise PermanentDeliveryError(f"Email {payload['step']} rejeté (hard bounce) pour {payload['prospect_email']}")
+        
+        if outcome == DeliveryOutcome.UNCERTAIN:
+            # Lettre morte sans renvoi: à vérifier (et remettre en file) manuellement
+            await self.sequences_collection.update_one(
+                {"_id": entry["_id"]},
+                {"$set": {"status": "error", "error_at": now, "last_error": "delivery_uncertain"}}
+            )
+            raise PermanentDeliveryError(f"Email {payload['step']} peut-être délivré à {payload['prospect_email']} (coupure après DATA)")
+        
+        # Écrit avant la clôture du job: l'entrée ne peut pas rester "queued" sans job
+        await self.sequences_collection.update_one(
+            {"_id": entry["_id"]},
+            {"$set": {"status": "sent", "sent_at": now}}
+        )
+        
+        if payload["step"] == "email1":
+            # Mettre à jour le statut du prospect
+            await self.prospects_collection.update_one(
+                {"email": payload["prospect_email"]},
+                {
+                    "$set": {
+                        "status": "contacted",
+                        "last_contacted_at": now
+                    }
+                }
+            )
+        
+        return "sent"
     
     async def process_scheduled_emails(self) -> Dict[str, Any]:
-        """Traiter les emails programmés (à appeler périodiquement)"""
+        """Mettre en file les emails programmés arrivés à échéance (à appeler périodiquement)"""
         try:
             current_time = datetime.now(timezone.utc)
             
-            # Trouver les emails à envoyer
+            # Trouver les emails à envoyer (par lots: le reste au passage suivant)
+            batch_size = EMAIL_QUEUE_CONFIG["scheduler_batch_size"]
             cursor = self.sequences_collection.find({
                 "status": "scheduled",
                 "scheduled_at": {"$lte": current_time}
-            })
+            }).sort("scheduled_at", 1).limit(batch_size)
             
-            scheduled_emails = await cursor.to_list(length=None)
+            scheduled_emails = await cursor.to_list(length=batch_size)
             print(f"📧 Emails programmés à traiter: {len(scheduled_emails)}")
             
-            sent_count = 0
-            error_count = 0
-            
-            for email_entry in scheduled_emails:
-                try:
-                    success = await self.send_email(
-                        sequence_id=email_entry["sequence_id"],
-                        prospect_email=email_entry["prospect_email"],
-                        prospect_first_name=email_entry["prospect_first_name"],
-                        step=email_entry["step"],
-                        test_mode=email_entry.get("test_mode", False)
-                    )
-                    
-                    if success:
-                        sent_count += 1
-                        # Marquer comme envoyé
-                        await self.sequences_collection.update_one(
-                            {"_id": email_entry["_id"]},
-                            {"$set": {"status": "sent", "sent_at": current_time}}
-                        )
-                    else:
-                        error_count += 1
-                        # Marquer comme erreur
-                        await self.sequences_collection.update_one(
-                            {"_id": email_entry["_id"]},
-                            {"$set": {"status": "error", "error_at": current_time}}
-                        )
-                        
-                except Exception as e:
-                    print(f"❌ Erreur traitement email programmé: {e}")
-                    error_count += 1
+            queued_count = await self._enqueue_entries(scheduled_emails)
+            recovered_count = await self._recover_queued_entries(current_time)
             
             return {
                 "success": True,
                 "processed": len(scheduled_emails),
-                "sent": sent_count,
-                "errors": error_count
+                "queued": queued_count,
+                "recovered": recovered_count
             }
             
         except Exception as e:
@@ -754,14 +872,23 @@ class EmailSequencerManager:
                 "created_at": datetime.now(timezone.utc)
             }
             
-            await self.metrics_collection.insert_one(event_entry)
+            await self.event_logger.add(InsertOne(event_entry))
             
         except Exception as e:
             print(f"❌ Erreur journalisation événement: {e}")
     
+    async def flush(self):
+        """Écrire immédiatement les événements en attente"""
+        await self.event_logger.flush()
+    
+    async def close(self):
+        await self.event_logger.close()
+    
     async def get_sequence_metrics(self, sequence_id: str = None, limit: int = 100) -> Dict[str, Any]:
         """Obtenir les métriques des séquences"""
         try:
+            await self.flush()
+            
             # Filtres
             match_filter = {}
             if sequence_id:
@@ -824,6 +951,8 @@ class EmailSequencerManager:
     async def get_sequence_status(self, sequence_id: str) -> Dict[str, Any]:
         """Obtenir le statut d'une séquence spécifique"""
         try:
+            await self.flush()
+            
             # Statuts des emails de la séquence
             cursor = self.sequences_collection.find({"sequence_id": sequence_id})
             sequence_entries = await cursor.to_list(length=None)
@@ -862,7 +991,7 @@ class EmailSequencerManager:
         try:
             # Marquer les emails programmés comme annulés
             result = await self.sequences_collection.update_many(
-                {"sequence_id": sequence_id, "status": "scheduled"},
+                {"sequence_id": sequence_id, "status": {"$in": ["scheduled", "queued"]}},
                 {"$set": {"status": "cancelled", "cancelled_at": datetime.now(timezone.utc)}}
             )
             
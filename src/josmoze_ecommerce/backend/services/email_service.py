@@ -8,7 +8,6 @@ import asyncio
 import logging
 from typing import List, Dict, Optional
 from datetime import datetime
-import smtplib
 import imaplib
 import email
 from email.mime.text import MIMEText
@@ -16,7 +15,9 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 import uuid
-from motor.motor_asyncio import AsyncIOMotorClient
+
+from mongo_provider import get_mongo_provider
+from mail_transport import get_mail_transport, classify_delivery_error, DeliveryOutcome
 
 # Configuration email (à configurer selon votre fournisseur)
 EMAIL_CONFIG = {
@@ -120,10 +121,13 @@ Référence de votre message : #{reference}
 
 class EmailService:
     def __init__(self):
-        self.mongo_client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-        self.db = self.mongo_client[os.getenv("DB_NAME", "josmoze_production")]
         self.setup_logging()
 
+    @property
+    def db(self):
+        """Base MongoDB via le client partagé (créé au premier accès)"""
+        return get_mongo_provider().client[os.getenv("DB_NAME", "josmoze_production")]
+
     def setup_logging(self):
         """Configure logging pour le service email"""
         logging.basicConfig(level=logging.INFO)
@@ -157,14 +161,22 @@ class EmailService:
                     msg.attach(part)
 
             # Envoyer l'email
-            server = smtplib.SMTP(EMAIL_CONFIG["smtp_server"], EMAIL_CONFIG["smtp_port"])
-            server.starttls()
-            server.login(from_email, email_password)
-            
-            text = msg.as_string()
-            server.sendmail(from_email, to_email, text)
-            server.quit()
+            await get_mail_transport().send_message(
+                msg,
+                host=EMAIL_CONFIG["smtp_server"],
+                port=EMAIL_CONFIG["smtp_port"],
+                username=from_email,
+                password=email_password,
+                from_addr=from_email,
+                to_addrs=[to_email],
+                use_tls=EMAIL_CONFIG["use_tls"]
+            )
+        except Exception as e:
+            self.logger.error(f"Erreur envoi email: {str(e)}")
+            # outcome: hard_bounce (5xx destinataire) ou transient (à réessayer)
+            return {"success": False, "error": str(e), "outcome": classify_delivery_error(e).value}
 
+        try:
             # Enregistrer l'email envoyé dans la base
             email_record = {
                 "id": str(uuid.uuid4()),
@@ -180,14 +192,14 @@ class EmailService:
             }
             
             await self.db.emails.insert_one(email_record)
-            
-            self.logger.info(f"Email envoyé avec succès de {from_email} vers {to_email}")
-            
-            return {"success": True, "message": "Email envoyé", "email_id": email_record["id"]}
-            
         except Exception as e:
-            self.logger.error(f"Erreur envoi email: {str(e)}")
-            return {"success": False, "error": str(e)}
+            # L'email est parti: un échec d'archivage ne doit pas provoquer de renvoi
+            self.logger.error(f"Erreur archivage email envoyé à {to_email}: {str(e)}")
+            return {"success": True, "message": "Email envoyé", "email_id": None, "outcome": DeliveryOutcome.SENT.value}
+            
+        self.logger.info(f"Email envoyé avec succès de {from_email} vers {to_email}")
+        
+        return {"success": True, "message": "Email envoyé", "email_id": email_record["id"], "outcome": DeliveryOutcome.SENT.value}
 
     async def send_auto_reply(self, to_email: str, sender_email: str, original_subject: str) -> Dict:
         """
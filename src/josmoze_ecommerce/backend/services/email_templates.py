@@ -0,0 +1,93 @@
+"""
+Josmoze.com - Registre des templates d'emails
+Chaque template est compilé une seule fois (à l'enregistrement ou quand sa
+source change) puis rendu avec un environnement Jinja pré-configuré.
+
+Les partiels (ex: ligne d'article de panier) s'écrivent {% include "nom" %}:
+quand le partiel est enregistré, il est intégré au template à la compilation
+(pas de résolution ni de nouveau contexte à chaque rendu) et les templates
+qui l'utilisent sont recompilés s'il change.
+"""
+
+import re
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Set
+
+from jinja2 import Environment, FunctionLoader, Template
+
+logger = logging.getLogger(__name__)
+
+_INCLUDE = re.compile(r"""\{%-?\s*include\s+["']([^"']+)["']\s*-?%\}""")
+
+
+class EmailTemplateRegistry:
+    """Templates compilés, indexés par nom"""
+
+    def __init__(self):
+        self._sources: Dict[str, str] = {}
+        self._versions: Dict[str, str] = {}
+        self._dependencies: Dict[str, Set[str]] = {}
+        self._compiled: Dict[str, Template] = {}
+        # autoescape désactivé: rendu identique aux anciens Template()/str.format
+        # Le loader ne sert qu'aux includes dynamiques (non intégrés à la compilation)
+        self.env = Environment(loader=FunctionLoader(self._sources.get), autoescape=False)
+
+    def _expand(self, source: str, dependencies: Set[str], stack: tuple = ()) -> str:
+        """Intégrer récursivement les partiels enregistrés"""
+        def replace(match):
+            name = match.group(1)
+            if name not in self._sources or name in stack:
+                return match.group(0)
+            dependencies.add(name)
+            return self._expand(self._sources[name], dependencies, stack + (name,))
+        return _INCLUDE.sub(replace, source)
+
+    def _compile(self, name: str):
+        dependencies: Set[str] = set()
+        source = self._expand(self._sources[name], dependencies, (name,))
+        self._compiled[name] = self.env.from_string(source)
+        self._dependencies[name] = dependencies
+
+    def register(self, name: str, source: str) -> bool:
+        """Enregistrer (ou mettre à jour) un template. False si la source est inchangée."""
+        version = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        if self._versions.get(name) == version:
+            return False
+        self._sources[name] = source
+        self._versions[name] = version
+        self._compile(name)
+
+        # Recompiler les templates qui intègrent ce partiel (ou qui l'incluaient sans le connaître)
+        for other in list(self._compiled):
+            if other != name and (name in self._dependencies[other] or name in _INCLUDE.findall(self._sources[other])):
+                self._compile(other)
+        return True
+
+    def register_many(self, templates: Dict[str, str]) -> int:
+        return sum(self.register(name, source) for name, source in templates.items())
+
+    def bind_globals(self, **values: Any):
+        """Variables disponibles dans tous les templates (ex: base_url)"""
+        self.env.globals.update(values)
+
+    def get(self, name: str) -> Optional[Template]:
+        return self._compiled.get(name)
+
+    def render(self, template_name: str, /, **context: Any) -> str:
+        template = self._compiled.get(template_name)
+        if template is None:
+            raise KeyError(f"Template email inconnu: {template_name}")
+        return template.render(**context)
+
+
+# ========== INSTANCE GLOBALE ==========
+
+template_registry = None
+
+def get_template_registry() -> EmailTemplateRegistry:
+    """Obtenir le registre de templates partagé"""
+    global template_registry
+    if template_registry is None:
+        template_registry = EmailTemplateRegistry()
+    return template_registry
@@ -20,6 +20,23 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from io import BytesIO
 import base64
 import asyncio
+from pymongo import ReturnDocument
+
+from cache_invalidation import invalidate_cache
+
+STOCK_RESERVATION_CONFIG = {
+    "ttl_seconds": int(os.environ.get("STOCK_RESERVATION_TTL", "1800")),   # Panier abandonné: libéré après 30 min
+    "sweep_interval": 60,
+    # Le site affiche tout le catalogue en stock (exigence client): au paiement, un
+    # manque de stock est réservé en rupture (disponible négatif) au lieu d'être refusé
+    "checkout_backorder": True
+}
+
+# Les mouvements de stock ne publient que product:<id> (fiche produit): le catalogue
+# affiche tout en stock (exigence client) et n'a pas à être reconstruit à chaque panier.
+
+# Services illimités: jamais réservés ni décomptés
+SERVICE_PRODUCTS = {"garantie-2ans", "garantie-5ans", "installation-service", "consultation-expert"}
 
 
 # ========== MODELS ==========
@@ -42,6 +59,7 @@ class StockItem(BaseModel):
     last_restocked: Optional[datetime] = None
     next_restock_due: Optional[datetime] = None
     stock_alerts_sent: List[datetime] = []
+    holds: List[Dict[str, Any]] = []  # Réservations en cours {reservation_id, quantity, expires_at}
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -111,6 +129,7 @@ class InventoryManager:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
         self.logger = logging.getLogger(__name__)
+        self._sweeper_task: Optional[asyncio.Task] = None
         
         # Stock par défaut pour les nouveaux produits finalisés  
         self.default_stock_items = [
@@ -138,6 +157,11 @@ class InventoryManager:
                     )
                     await self.db.stock_items.insert_one(stock_item.dict())
             
+            await self.db.stock_items.create_index("product_id")
+            await self.db.stock_items.create_index("holds.expires_at", sparse=True)
+            await self.db.stock_reservations.create_index("reservation_id", unique=True)
+            await self.db.stock_reservations.create_index([("status", 1), ("expires_at", 1)])
+            
             self.logger.info("Stock initialized successfully")
             
         except Exception as e:
@@ -150,56 +174,74 @@ class InventoryManager:
             if not stock_item:
                 return {"error": "Product not found", "stock_level": "unknown"}
             
-            available = stock_item.get("available_stock", 0)
-            
-            # Déterminer le niveau d'alerte
-            if available < stock_item.get("min_threshold", 10):
-                alert_level = "critical"  # Rouge
-                alert_message = "Stock critique - Réapprovisionnement urgent"
-                color = "red"
-            elif available < stock_item.get("warning_threshold", 20):
-                alert_level = "warning"  # Orange
-                alert_message = "Stock faible - Préparer commande"
-                color = "orange"
-            elif available >= stock_item.get("optimal_threshold", 30):
-                alert_level = "optimal"  # Vert
-                alert_message = "Stock optimal"
-                color = "green"
-            else:
-                alert_level = "normal"
-                alert_message = "Stock normal"
-                color = "blue"
-            
-            # Pour l'affichage public du site
-            show_stock_warning = available < 20  # "stock limité" si < 20
+            return self._build_stock_status(product_id, stock_item)
+            
+        except Exception as e:
+            self.logger.error(f"Error getting stock status: {e}")
+            return {"error": str(e), "stock_level": "unknown"}
+    
+    async def get_stock_status_many(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Statut du stock de plusieurs produits en une seule requête ($in)"""
+        try:
+            stock_items = await self.db.stock_items.find(
+                {"product_id": {"$in": list(product_ids)}}
+            ).to_list(len(product_ids) or 1)
+            by_product = {item["product_id"]: item for item in stock_items}
             
             return {
-                "product_id": product_id,
-                "current_stock": stock_item.get("current_stock", 0),
-                "available_stock": available,
-                "reserved_stock": stock_item.get("reserved_stock", 0),
-                "alert_level": alert_level,
-                "alert_message": alert_message,
-                "alert_color": color,
-                "show_stock_warning": show_stock_warning,
-                "stock_warning_text": "Stock limité ⚠️" if show_stock_warning else None,
-                "reorder_needed": available <= stock_item.get("reorder_point", 15),
-                "days_until_restock": self._calculate_restock_days(stock_item)
+                product_id: self._build_stock_status(product_id, by_product[product_id])
+                if product_id in by_product else {"error": "Product not found", "stock_level": "unknown"}
+                for product_id in product_ids
             }
             
         except Exception as e:
             self.logger.error(f"Error getting stock status: {e}")
-            return {"error": str(e), "stock_level": "unknown"}
+            return {product_id: {"error": str(e), "stock_level": "unknown"} for product_id in product_ids}
+    
+    def _build_stock_status(self, product_id: str, stock_item: Dict[str, Any]) -> Dict[str, Any]:
+        """Niveau d'alerte et affichage public à partir d'un document stock_items"""
+        available = stock_item.get("available_stock", 0)
+        
+        # Déterminer le niveau d'alerte
+        if available < stock_item.get("min_threshold", 10):
+            alert_level = "critical"  # Rouge
+            alert_message = "Stock critique - Réapprovisionnement urgent"
+            color = "red"
+        elif available < stock_item.get("warning_threshold", 20):
+            alert_level = "warning"  # Orange
+            alert_message = "Stock faible - Préparer commande"
+            color = "orange"
+        elif available >= stock_item.get("optimal_threshold", 30):
+            alert_level = "optimal"  # Vert
+            alert_message = "Stock optimal"
+            color = "green"
+        else:
+            alert_level = "normal"
+            alert_message = "Stock normal"
+            color = "blue"
+        
+        # Pour l'affichage public du site
+        show_stock_warning = available < 20  # "stock limité" si < 20
+        
+        return {
+            "product_id": product_id,
+            "current_stock": stock_item.get("current_stock", 0),
+            "available_stock": available,
+            "reserved_stock": stock_item.get("reserved_stock", 0),
+            "alert_level": alert_level,
+            "alert_message": alert_message,
+            "alert_color": color,
+            "show_stock_warning": show_stock_warning,
+            "stock_warning_text": "Stock limité ⚠️" if show_stock_warning else None,
+            "reorder_needed": available <= stock_item.get("reorder_point", 15),
+            "days_until_restock": self._calculate_restock_days(stock_item)
+        }
     
     async def get_all_stock_status(self) -> List[Dict[str, Any]]:
         """Obtenir le statut de tous les stocks (pour le CRM)"""
         try:
             stock_items = await self.db.stock_items.find().to_list(100)
-            stock_status = []
-            
-            for item in stock_items:
-                status = await self.get_stock_status(item["product_id"])
-                stock_status.append(status)
+            stock_status = [self._build_stock_status(item["product_id"], item) for item in stock_items]
             
             # Trier par niveau d'alerte (critique en premier)
             priority_order = {"critical": 0, "warning": 1, "normal": 2, "optimal": 3}
@@ -211,69 +253,281 @@ class InventoryManager:
             self.logger.error(f"Error getting all stock status: {e}")
             return []
     
-    async def reserve_stock(self, product_id: str, quantity: int) -> Dict[str, Any]:
+    # ========== RÉSERVATIONS DE STOCK ==========
+    #
+    # Chaque réservation est un "hold" {reservation_id, quantity, expires_at}
+    # poussé dans le document stock_items par la même opération atomique que le
+    # $inc: la garde available_stock >= quantité est évaluée par MongoDB, deux
+    # commandes simultanées ne peuvent pas réserver les mêmes unités. Libération
+    # et confirmation ne s'appliquent que si le hold existe encore (idempotent,
+    # sûr face au balayage des réservations expirées).
+    
+    async def reserve_stock(self, product_id: str, quantity: int,
+                            ttl_seconds: Optional[int] = None) -> Dict[str, Any]:
         """Réserver du stock pour une commande"""
+        result = await self.reserve_items([{"product_id": product_id, "quantity": quantity}], ttl_seconds)
+        if not result["success"]:
+            return {"success": False, "error": result["error"]}
+        
+        item = result["items"][0]
+        return {
+            "success": True,
+            "reservation_id": result["reservation_id"],
+            "expires_at": result["expires_at"],
+            "reserved_quantity": quantity,
+            "new_available_stock": item["available_stock"],
+            "new_reserved_stock": item["reserved_stock"]
+        }
+    
+    async def reserve_items(self, items: List[Dict[str, Any]], ttl_seconds: Optional[int] = None,
+                            allow_backorder: bool = False) -> Dict[str, Any]:
+        """Réserver un panier complet: tout ou rien (les holds déjà posés sont annulés en cas d'échec)
+        
+        Avec allow_backorder, un stock insuffisant ne refuse pas le panier: le hold est posé
+        quand même (disponible négatif = unités à réapprovisionner) et l'article est marqué
+        "backordered" dans la réservation.
+        """
+        quantities: Dict[str, int] = {}
+        for item in items:
+            if item["product_id"] in SERVICE_PRODUCTS:
+                continue
+            quantity = int(item["quantity"])
+            if quantity <= 0:
+                return {"success": False, "error": f"Quantité invalide pour {item['product_id']}: {quantity}"}
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + quantity
+        
+        reservation_id = f"RES-{uuid.uuid4().hex[:12].upper()}"
+        expires_at = datetime.utcnow() + timedelta(
+            seconds=ttl_seconds or STOCK_RESERVATION_CONFIG["ttl_seconds"]
+        )
+        
+        held: List[Dict[str, Any]] = []
         try:
-            stock_item = await self.db.stock_items.find_one({"product_id": product_id})
-            if not stock_item:
-                return {"success": False, "error": "Product not found"}
-            
-            available = stock_item.get("available_stock", 0)
-            if available < quantity:
-                return {
-                    "success": False, 
-                    "error": f"Stock insuffisant. Disponible: {available}, Demandé: {quantity}"
+            # Ordre stable des produits: deux paniers concurrents échouent de la même façon
+            for product_id in sorted(quantities):
+                quantity = quantities[product_id]
+                hold_update = {
+                    "$inc": {"available_stock": -quantity, "reserved_stock": quantity},
+                    "$push": {"holds": {"reservation_id": reservation_id, "quantity": quantity, "expires_at": expires_at}},
+                    "$set": {"updated_at": datetime.utcnow()}
                 }
+                stock_item = await self.db.stock_items.find_one_and_update(
+                    {"product_id": product_id, "available_stock": {"$gte": quantity}},
+                    hold_update,
+                    projection={"available_stock": 1, "reserved_stock": 1},
+                    return_document=ReturnDocument.AFTER
+                )
+                backordered = False
+                
+                if stock_item is None and allow_backorder:
+                    stock_item = await self.db.stock_items.find_one_and_update(
+                        {"product_id": product_id},
+                        hold_update,
+                        projection={"available_stock": 1, "reserved_stock": 1},
+                        return_document=ReturnDocument.AFTER
+                    )
+                    backordered = stock_item is not None
+                    if backordered:
+                        self.logger.warning(
+                            f"Reservation {reservation_id}: {product_id} backordered "
+                            f"(available {stock_item.get('available_stock', 0)})"
+                        )
+                
+                if stock_item is None:
+                    await self._release_holds(reservation_id, held)
+                    return {"success": False, "product_id": product_id, "error": await self._reservation_error(product_id, quantity)}
+                
+                held.append({
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "available_stock": stock_item.get("available_stock", 0),
+                    "reserved_stock": stock_item.get("reserved_stock", 0),
+                    "backordered": backordered
+                })
             
-            # Réserver le stock
-            new_reserved = stock_item.get("reserved_stock", 0) + quantity
-            new_available = available - quantity
+            await self.db.stock_reservations.insert_one({
+                "reservation_id": reservation_id,
+                "items": [
+                    {"product_id": item["product_id"], "quantity": item["quantity"], "backordered": item["backordered"]}
+                    for item in held
+                ],
+                "status": "held",
+                "expires_at": expires_at,
+                "created_at": datetime.utcnow()
+            })
             
-            await self.db.stock_items.update_one(
-                {"product_id": product_id},
-                {
-                    "$set": {
-                        "reserved_stock": new_reserved,
-                        "available_stock": new_available,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
+        except Exception as e:
+            self.logger.error(f"Error reserving stock: {e}")
+            await self._release_holds(reservation_id, held)
+            return {"success": False, "error": str(e)}
+        
+        if held:
+            await invalidate_cache(*(f"product:{item['product_id']}" for item in held))
+        self.logger.info(f"Reservation {reservation_id}: {quantities}")
+        
+        return {"success": True, "reservation_id": reservation_id, "expires_at": expires_at, "items": held}
+    
+    async def _reservation_error(self, product_id: str, quantity: int) -> str:
+        stock_item = await self.db.stock_items.find_one({"product_id": product_id}, {"available_stock": 1})
+        if not stock_item:
+            return "Product not found"
+        return f"Stock insuffisant. Disponible: {stock_item.get('available_stock', 0)}, Demandé: {quantity}"
+    
+    async def _release_hold(self, product_id: str, reservation_id: str, quantity: int) -> bool:
+        """Rendre les unités d'un hold au stock disponible (sans effet si le hold n'existe plus)"""
+        result = await self.db.stock_items.update_one(
+            {"product_id": product_id, "holds": {"$elemMatch": {"reservation_id": reservation_id, "quantity": quantity}}},
+            {
+                "$inc": {"available_stock": quantity, "reserved_stock": -quantity},
+                "$pull": {"holds": {"reservation_id": reservation_id}},
+                "$set": {"updated_at": datetime.utcnow()}
+            }
+        )
+        return result.modified_count > 0
+    
+    async def _release_holds(self, reservation_id: str, items: List[Dict[str, Any]]) -> int:
+        """Compensation: annuler les holds d'une réservation"""
+        released = 0
+        for item in items:
+            try:
+                released += await self._release_hold(item["product_id"], reservation_id, item["quantity"])
+            except Exception as e:
+                # Le hold expirera et sera libéré par le balayage
+                self.logger.error(f"Error releasing hold {reservation_id} on {item['product_id']}: {e}")
+        return released
+    
+    async def release_reservation(self, reservation_id: str) -> Dict[str, Any]:
+        """Annuler une réservation (paiement abandonné ou échoué)"""
+        try:
+            reservation = await self.db.stock_reservations.find_one_and_update(
+                {"reservation_id": reservation_id, "status": "held"},
+                {"$set": {"status": "released", "updated_at": datetime.utcnow()}}
             )
+            if not reservation:
+                return {"success": False, "error": "Reservation not found or already closed"}
             
-            self.logger.info(f"Reserved {quantity} units of {product_id}")
+            released = await self._release_holds(reservation_id, reservation["items"])
+            await invalidate_cache(*(f"product:{item['product_id']}" for item in reservation["items"]))
+            return {"success": True, "released_items": released}
             
-            return {
-                "success": True,
-                "reserved_quantity": quantity,
-                "new_available_stock": new_available,
-                "new_reserved_stock": new_reserved
-            }
+        except Exception as e:
+            self.logger.error(f"Error releasing reservation: {e}")
+            return {"success": False, "error": str(e)}
+    
+    async def confirm_reservation(self, reservation_id: str) -> Dict[str, Any]:
+        """Transformer une réservation en sortie de stock (après paiement)"""
+        try:
+            reservation = await self.db.stock_reservations.find_one_and_update(
+                {"reservation_id": reservation_id, "status": {"$in": ["held", "expired"]}},
+                {"$set": {"status": "confirmed", "updated_at": datetime.utcnow()}}
+            )
+            if not reservation:
+                return {"success": False, "error": "Reservation not found or already closed"}
+            
+            confirmed = []
+            for item in reservation["items"]:
+                product_id, quantity = item["product_id"], item["quantity"]
+                stock_item = await self.db.stock_items.find_one_and_update(
+                    {"product_id": product_id, "holds": {"$elemMatch": {"reservation_id": reservation_id, "quantity": quantity}}},
+                    {
+                        "$inc": {"current_stock": -quantity, "reserved_stock": -quantity},
+                        "$pull": {"holds": {"reservation_id": reservation_id}},
+                        "$set": {"updated_at": datetime.utcnow()}
+                    },
+                    projection={"current_stock": 1},
+                    return_document=ReturnDocument.AFTER
+                )
+                if stock_item is None:
+                    # Hold expiré et libéré avant le paiement: la vente est due, prélever le disponible
+                    self.logger.warning(f"Reservation {reservation_id} expired for {product_id}, consuming available stock")
+                    stock_item = await self.db.stock_items.find_one_and_update(
+                        {"product_id": product_id},
+                        {
+                            "$inc": {"current_stock": -quantity, "available_stock": -quantity},
+                            "$set": {"updated_at": datetime.utcnow()}
+                        },
+                        projection={"current_stock": 1},
+                        return_document=ReturnDocument.AFTER
+                    )
+                if stock_item is not None:
+                    confirmed.append(product_id)
+                    await self._check_restock_alert(product_id, stock_item.get("current_stock", 0))
+            
+            await invalidate_cache(*(f"product:{product_id}" for product_id in confirmed))
+            self.logger.info(f"Confirmed reservation {reservation_id}")
+            return {"success": True, "confirmed_items": confirmed}
             
         except Exception as e:
-            self.logger.error(f"Error reserving stock: {e}")
+            self.logger.error(f"Error confirming reservation: {e}")
             return {"success": False, "error": str(e)}
     
+    async def release_expired_reservations(self) -> int:
+        """Libérer les holds dont le TTL est dépassé (paniers abandonnés)"""
+        now = datetime.utcnow()
+        released_products = set()
+        released = 0
+        
+        async for stock_item in self.db.stock_items.find({"holds.expires_at": {"$lte": now}}, {"product_id": 1, "holds": 1}):
+            for hold in stock_item.get("holds", []):
+                if hold["expires_at"] <= now and await self._release_hold(stock_item["product_id"], hold["reservation_id"], hold["quantity"]):
+                    released += 1
+                    released_products.add(stock_item["product_id"])
+        
+        await self.db.stock_reservations.update_many(
+            {"status": "held", "expires_at": {"$lte": now}},
+            {"$set": {"status": "expired", "updated_at": now}}
+        )
+        
+        if released:
+            await invalidate_cache(*(f"product:{product_id}" for product_id in released_products))
+            self.logger.info(f"Released {released} expired stock holds")
+        return released
+    
+    async def _sweep_reservations(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.release_expired_reservations()
+            except Exception as e:
+                self.logger.error(f"Reservation sweep failed: {e}")
+    
+    def start_reservation_sweeper(self, interval: Optional[float] = None):
+        """Balayage périodique des réservations expirées (boucle asyncio de l'application)"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(
+                self._sweep_reservations(interval or STOCK_RESERVATION_CONFIG["sweep_interval"])
+            )
+    
+    async def stop_reservation_sweeper(self):
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+    
     async def confirm_stock_usage(self, product_id: str, quantity: int) -> Dict[str, Any]:
-        """Confirmer l'utilisation du stock (après paiement)"""
+        """Confirmer l'utilisation du stock (après paiement, commande sans réservation)"""
         try:
-            stock_item = await self.db.stock_items.find_one({"product_id": product_id})
+            # Une seule mise à jour atomique (pipeline): pas de lecture-calcul-écriture
+            stock_item = await self.db.stock_items.find_one_and_update(
+                {"product_id": product_id},
+                [{"$set": {
+                    "current_stock": {"$subtract": [{"$ifNull": ["$current_stock", 0]}, quantity]},
+                    "reserved_stock": {"$max": [0, {"$subtract": [{"$ifNull": ["$reserved_stock", 0]}, quantity]}]},
+                    "updated_at": datetime.utcnow()
+                }}],
+                projection={"current_stock": 1, "reserved_stock": 1},
+                return_document=ReturnDocument.AFTER
+            )
             if not stock_item:
                 return {"success": False, "error": "Product not found"}
             
-            # Diminuer le stock physique et les réservations
-            new_current = stock_item.get("current_stock", 0) - quantity
-            new_reserved = max(0, stock_item.get("reserved_stock", 0) - quantity)
+            new_current = stock_item["current_stock"]
+            new_reserved = stock_item["reserved_stock"]
             
-            await self.db.stock_items.update_one(
-                {"product_id": product_id},
-                {
-                    "$set": {
-                        "current_stock": new_current,
-                        "reserved_stock": new_reserved,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
+            await invalidate_cache(f"product:{product_id}")
             
             # Vérifier si une alerte de réapprovisionnement est nécessaire
             await self._check_restock_alert(product_id, new_current)
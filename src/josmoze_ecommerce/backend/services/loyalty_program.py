@@ -1,13 +1,24 @@
 """
 Josmoze.com - Smart Loyalty Program System
 Programme de fidélité intelligent pour augmenter la rétention
+
+Le solde (points) et le cumul gagné (lifetime_points) du client sont des
+compteurs matérialisés modifiés par $inc atomique; loyalty_transactions est le
+journal (append-only) des mouvements. Chaque attribution porte une clé
+d'idempotence, unique dans loyalty_transactions: l'entrée du journal est écrite
+avant le $inc et marquée appliquée après, donc un webhook de paiement rejoué ne
+crédite pas deux fois la même commande. Seules les dernières clés appliquées
+sont gardées dans ledger_keys, pour le rejeu d'une attribution interrompue
+entre les deux écritures.
 """
 
 import logging
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from enum import Enum
 import uuid
 
@@ -32,14 +43,15 @@ class LoyaltyCustomer(BaseModel):
     name: str
     tier: LoyaltyTier = LoyaltyTier.BRONZE
     points: int = 0
+    lifetime_points: int = 0  # Cumul des points gagnés (base du niveau)
     total_spent: float = 0
     orders_count: int = 0
-    created_at: datetime = datetime.now()
-    last_activity: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
+    last_activity: datetime = Field(default_factory=datetime.now)
     tier_upgrade_date: Optional[datetime] = None
 
 class LoyaltyReward(BaseModel):
-    id: str = uuid.uuid4().hex
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     name: str
     description: str
     reward_type: RewardType
@@ -52,14 +64,16 @@ class LoyaltyReward(BaseModel):
     is_active: bool = True
 
 class LoyaltyTransaction(BaseModel):
-    id: str = uuid.uuid4().hex
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     customer_id: str
     transaction_type: str  # "earned", "redeemed", "expired"
     points_change: int  # Positive for earned, negative for redeemed/expired
     description: str
     order_id: Optional[str] = None
     reward_id: Optional[str] = None
-    created_at: datetime = datetime.now()
+    idempotency_key: Optional[str] = None
+    applied: bool = True  # False tant que le solde du client n'est pas crédité
+    created_at: datetime = Field(default_factory=datetime.now)
 
 class LoyaltyProgramManager:
     """Gestionnaire du programme de fidélité intelligent"""
@@ -85,7 +99,8 @@ class LoyaltyProgramManager:
             "birthday_bonus_points": 100,
             "referral_bonus_points": 200,
             "review_bonus_points": 50,
-            "points_expiry_days": 365
+            "points_expiry_days": 365,
+            "ledger_keys_window": 50  # Clés récentes gardées sur le client (rejeu après interruption)
         }
         
         # Récompenses par défaut
@@ -149,29 +164,92 @@ class LoyaltyProgramManager:
             logger.error(f"Loyalty program initialization error: {e}")
             return False
     
+    async def initialize_ledger(self):
+        """Index du journal + calcul initial de lifetime_points pour les clients existants"""
+        indexes_ok = await self._create_ledger_indexes()
+        backfill_ok = await self._backfill_lifetime_points()
+        return indexes_ok and backfill_ok
+    
+    async def _create_ledger_indexes(self) -> bool:
+        """Index uniques; chaque échec est journalisé sans bloquer les autres"""
+        ok = True
+        try:
+            await self.db.loyalty_customers.create_index("customer_id", unique=True)
+        except DuplicateKeyError:
+            ok = False
+            duplicates = await self.db.loyalty_customers.aggregate([
+                {"$group": {"_id": "$customer_id", "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+                {"$limit": 100}
+            ]).to_list(None)
+            logger.error(
+                f"Loyalty customers: unique customer_id index not created, {len(duplicates)} duplicated ids "
+                f"(first 100): {[(row['_id'], row['count']) for row in duplicates]}"
+            )
+        except Exception as e:
+            ok = False
+            logger.error(f"Loyalty customers index error: {e}")
+        
+        try:
+            await self.db.loyalty_transactions.create_index("customer_id")
+            await self.db.loyalty_transactions.create_index(
+                "idempotency_key", unique=True,
+                partialFilterExpression={"idempotency_key": {"$type": "string"}}
+            )
+        except Exception as e:
+            ok = False
+            logger.error(f"Loyalty transactions index error: {e}")
+        return ok
+    
+    async def _backfill_lifetime_points(self) -> bool:
+        """Clients créés avant le compteur: le reconstruire une fois depuis le journal"""
+        try:
+            missing = await self.db.loyalty_customers.distinct("customer_id", {"lifetime_points": {"$exists": False}})
+            if missing:
+                totals = {customer_id: 0 for customer_id in missing}
+                async for row in self.db.loyalty_transactions.aggregate([
+                    {"$match": {"customer_id": {"$in": missing}, "transaction_type": "earned"}},
+                    {"$group": {"_id": "$customer_id", "total": {"$sum": "$points_change"}}}
+                ]):
+                    totals[row["_id"]] = row["total"]
+                for customer_id, total in totals.items():
+                    await self.db.loyalty_customers.update_one(
+                        {"customer_id": customer_id, "lifetime_points": {"$exists": False}},
+                        {"$set": {"lifetime_points": total}}
+                    )
+                logger.info(f"Loyalty lifetime points backfilled for {len(missing)} customers")
+            
+            return True
+        except Exception as e:
+            logger.error(f"Loyalty lifetime points backfill error: {e}")
+            return False
+    
     async def get_or_create_customer(self, customer_id: str, email: str, name: str) -> LoyaltyCustomer:
         """Récupérer ou créer un client fidélité"""
         try:
-            # Rechercher le client existant
-            existing = await self.db.loyalty_customers.find_one({"customer_id": customer_id})
-            
-            if existing:
-                return LoyaltyCustomer(**existing)
-            
-            # Créer un nouveau client
             new_customer = LoyaltyCustomer(
                 customer_id=customer_id,
                 email=email,
                 name=name
             )
             
-            await self.db.loyalty_customers.insert_one(new_customer.dict())
+            # Création atomique: deux commandes simultanées ne créent pas deux clients
+            existing = await self.db.loyalty_customers.find_one_and_update(
+                {"customer_id": customer_id},
+                {"$setOnInsert": new_customer.dict()},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            
+            if existing:
+                return LoyaltyCustomer(**existing)
             
             # Bonus de bienvenue
             await self.award_points(
                 customer_id,
                 50,
-                "Bonus de bienvenue - Merci de rejoindre notre programme de fidélité !"
+                "Bonus de bienvenue - Merci de rejoindre notre programme de fidélité !",
+                idempotency_key=f"welcome:{customer_id}"
             )
             
             logger.info(f"Created new loyalty customer: {email}")
@@ -187,47 +265,64 @@ class LoyaltyProgramManager:
         customer_id: str, 
         points: int, 
         description: str,
-        order_id: Optional[str] = None
+        order_id: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        increments: Optional[Dict[str, float]] = None
     ) -> bool:
-        """Attribuer des points à un client"""
+        """Attribuer des points à un client (une seule fois par clé d'idempotence)"""
         try:
-            # Récupérer le client
-            customer = await self.db.loyalty_customers.find_one({"customer_id": customer_id})
+            # Récupérer le niveau du client (multiplicateur)
+            customer = await self.db.loyalty_customers.find_one({"customer_id": customer_id}, {"tier": 1})
             if not customer:
                 logger.warning(f"Customer not found for points award: {customer_id}")
                 return False
             
-            loyalty_customer = LoyaltyCustomer(**customer)
-            
             # Appliquer le multiplicateur de niveau
-            tier_multiplier = self.config["tier_multipliers"][loyalty_customer.tier]
-            final_points = int(points * tier_multiplier)
+            tier = LoyaltyTier(customer.get("tier", LoyaltyTier.BRONZE))
+            final_points = int(points * self.config["tier_multipliers"][tier])
+            key = idempotency_key or uuid.uuid4().hex
             
-            # Mettre à jour les points du client
-            new_points = loyalty_customer.points + final_points
-            await self.db.loyalty_customers.update_one(
-                {"customer_id": customer_id},
-                {
-                    "$set": {
-                        "points": new_points,
-                        "last_activity": datetime.now()
-                    }
-                }
-            )
-            
-            # Enregistrer la transaction
+            # Le journal d'abord: l'index unique sur idempotency_key arbitre les rejeux
             transaction = LoyaltyTransaction(
                 customer_id=customer_id,
                 transaction_type="earned",
                 points_change=final_points,
                 description=description,
-                order_id=order_id
+                order_id=order_id,
+                idempotency_key=key,
+                applied=False
             )
+            try:
+                await self.db.loyalty_transactions.insert_one(transaction.dict())
+            except DuplicateKeyError:
+                existing = await self.db.loyalty_transactions.find_one({"idempotency_key": key})
+                # Entrées antérieures au champ "applied": écrites après le $inc, donc appliquées
+                if existing.get("applied", True):
+                    logger.info(f"Points already awarded to {customer_id} ({key})")
+                    return True
+                # Attribution interrompue avant le $inc: la reprendre avec les points journalisés
+                final_points = existing["points_change"]
+            
+            # Solde, cumul et compteurs annexes en une opération; ledger_keys (borné) protège
+            # la reprise d'une attribution interrompue entre le $inc et le marquage du journal
+            updated = await self.db.loyalty_customers.find_one_and_update(
+                {"customer_id": customer_id, "ledger_keys": {"$ne": key}},
+                {
+                    "$inc": {"points": final_points, "lifetime_points": final_points, **(increments or {})},
+                    "$push": {"ledger_keys": {"$each": [key], "$slice": -self.config["ledger_keys_window"]}},
+                    "$set": {"last_activity": datetime.now()}
+                },
+                projection={"tier": 1, "points": 1, "lifetime_points": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            await self.db.loyalty_transactions.update_one({"idempotency_key": key}, {"$set": {"applied": True}})
             
-            await self.db.loyalty_transactions.insert_one(transaction.dict())
+            if updated is None:
+                logger.info(f"Points already awarded to {customer_id} ({key})")
+                return True
             
-            # Vérifier une éventuelle promotion de niveau
-            await self._check_tier_upgrade(customer_id)
+            # Vérifier une éventuelle promotion de niveau (à partir des compteurs)
+            await self._check_tier_upgrade(customer_id, updated)
             
             logger.info(f"Awarded {final_points} points to {customer_id}: {description}")
             return True
@@ -267,21 +362,13 @@ class LoyaltyProgramManager:
             if bonus_points > 0:
                 description += f" (bonus {bonus_points} pts)"
             
-            await self.award_points(customer_email, total_points, description, order_id)
-            
-            # Mettre à jour les statistiques du client
-            await self.db.loyalty_customers.update_one(
-                {"customer_id": customer_email},
-                {
-                    "$inc": {
-                        "total_spent": order_total,
-                        "orders_count": 1
-                    }
-                }
+            # Points et statistiques du client appliqués ensemble, une seule fois par commande
+            return await self.award_points(
+                customer_email, total_points, description, order_id,
+                idempotency_key=f"order:{order_id}",
+                increments={"total_spent": order_total, "orders_count": 1}
             )
             
-            return True
-            
         except Exception as e:
             logger.error(f"Process order points error: {e}")
             return False
@@ -315,12 +402,25 @@ class LoyaltyProgramManager:
             if loyalty_reward.max_uses and loyalty_reward.current_uses >= loyalty_reward.max_uses:
                 return {"success": False, "error": "Limite d'utilisation atteinte"}
             
-            # Déduire les points
-            new_points = loyalty_customer.points - loyalty_reward.points_cost
-            await self.db.loyalty_customers.update_one(
-                {"customer_id": customer_id},
-                {"$set": {"points": new_points, "last_activity": datetime.now()}}
+            # Réserver une utilisation de la récompense (garde max_uses évaluée par MongoDB)
+            reward_filter = {"id": reward_id}
+            if loyalty_reward.max_uses:
+                reward_filter["current_uses"] = {"$lt": loyalty_reward.max_uses}
+            claimed = await self.db.loyalty_rewards.update_one(reward_filter, {"$inc": {"current_uses": 1}})
+            if claimed.modified_count == 0:
+                return {"success": False, "error": "Limite d'utilisation atteinte"}
+            
+            # Déduire les points (garde sur le solde: pas de solde négatif en cas d'échanges simultanés)
+            updated = await self.db.loyalty_customers.find_one_and_update(
+                {"customer_id": customer_id, "points": {"$gte": loyalty_reward.points_cost}},
+                {"$inc": {"points": -loyalty_reward.points_cost}, "$set": {"last_activity": datetime.now()}},
+                projection={"points": 1},
+                return_document=ReturnDocument.AFTER
             )
+            if updated is None:
+                await self.db.loyalty_rewards.update_one({"id": reward_id}, {"$inc": {"current_uses": -1}})
+                return {"success": False, "error": "Points insuffisants"}
+            new_points = updated["points"]
             
             # Enregistrer la transaction
             transaction = LoyaltyTransaction(
@@ -333,12 +433,6 @@ class LoyaltyProgramManager:
             
             await self.db.loyalty_transactions.insert_one(transaction.dict())
             
-            # Mettre à jour l'utilisation de la récompense
-            await self.db.loyalty_rewards.update_one(
-                {"id": reward_id},
-                {"$inc": {"current_uses": 1}}
-            )
-            
             # Générer le code de récompense
             reward_code = f"LOYAL-{reward_id[:8]}-{customer_id[:8]}".upper()
             
@@ -378,7 +472,7 @@ class LoyaltyProgramManager:
             
             if next_tier:
                 next_tier_value = self.config["tier_thresholds"][next_tier]
-                points_to_next_tier = max(0, next_tier_value - loyalty_customer.points)
+                points_to_next_tier = max(0, next_tier_value - loyalty_customer.lifetime_points)
             
             # Récompenses disponibles
             available_rewards = await self.db.loyalty_rewards.find({
@@ -400,7 +494,8 @@ class LoyaltyProgramManager:
                 "recent_transactions": recent_transactions,
                 "statistics": {
                     "member_since": loyalty_customer.created_at.isoformat(),
-                    "total_points_earned": await self._get_total_points_earned(customer_id),
+                    "total_points_earned": customer["lifetime_points"] if "lifetime_points" in customer
+                    else await self._get_total_points_earned(customer_id),
                     "rewards_redeemed": await self._get_rewards_count(customer_id)
                 }
             }
@@ -409,21 +504,17 @@ class LoyaltyProgramManager:
             logger.error(f"Get customer status error: {e}")
             return {"success": False, "error": "Erreur lors de la récupération du statut"}
     
-    async def _check_tier_upgrade(self, customer_id: str):
-        """Vérifier et effectuer une promotion de niveau si nécessaire"""
+    async def _check_tier_upgrade(self, customer_id: str, counters: Dict[str, Any]):
+        """Promotion de niveau à partir des compteurs renvoyés par l'attribution (O(1), sans relecture)"""
         try:
-            customer = await self.db.loyalty_customers.find_one({"customer_id": customer_id})
-            if not customer:
-                return
-            
-            loyalty_customer = LoyaltyCustomer(**customer)
-            current_tier = loyalty_customer.tier
-            new_tier = self._calculate_tier(loyalty_customer.points)
-            
-            if new_tier != current_tier:
-                # Promotion de niveau
-                await self.db.loyalty_customers.update_one(
-                    {"customer_id": customer_id},
+            current_tier = LoyaltyTier(counters.get("tier", LoyaltyTier.BRONZE))
+            new_tier = self._calculate_tier(counters.get("lifetime_points", counters.get("points", 0)))
+            tiers = list(self.config["tier_thresholds"])
+            
+            if tiers.index(new_tier) > tiers.index(current_tier):
+                # Promotion conditionnelle: une seule attribution concurrente l'applique
+                result = await self.db.loyalty_customers.update_one(
+                    {"customer_id": customer_id, "tier": current_tier.value},
                     {
                         "$set": {
                             "tier": new_tier.value,
@@ -431,6 +522,8 @@ class LoyaltyProgramManager:
                         }
                     }
                 )
+                if result.modified_count == 0:
+                    return
                 
                 # Bonus de promotion
                 bonus_points = self._get_tier_upgrade_bonus(new_tier)
@@ -438,7 +531,8 @@ class LoyaltyProgramManager:
                     await self.award_points(
                         customer_id,
                         bonus_points,
-                        f"Bonus promotion niveau {new_tier.value.upper()}"
+                        f"Bonus promotion niveau {new_tier.value.upper()}",
+                        idempotency_key=f"tier:{customer_id}:{new_tier.value}"
                     )
                 
                 logger.info(f"Tier upgraded: {customer_id} from {current_tier.value} to {new_tier.value}")
@@ -447,7 +541,7 @@ class LoyaltyProgramManager:
             logger.error(f"Tier upgrade check error: {e}")
     
     def _calculate_tier(self, points: int) -> LoyaltyTier:
-        """Calculer le niveau basé sur les points"""
+        """Calculer le niveau basé sur les points gagnés"""
         if points >= self.config["tier_thresholds"][LoyaltyTier.PLATINUM]:
             return LoyaltyTier.PLATINUM
         elif points >= self.config["tier_thresholds"][LoyaltyTier.GOLD]:
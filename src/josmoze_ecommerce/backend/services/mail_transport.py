@@ -0,0 +1,268 @@
+"""
+Josmoze.com - Transport SMTP mutualisé
+Pool de connexions SMTP partagé par EmailService, EmailSequencerManager et
+AbandonedCartService: réutilisation des connexions (STARTTLS + login une seule
+fois), limite globale de connexions, limite de concurrence par domaine
+destinataire et nouvelles tentatives avec backoff sur les réponses 4xx.
+
+Une coupure après la commande DATA n'est jamais réessayée: le serveur a pu
+accepter le message, elle remonte en DeliveryUncertainError (pas de renvoi
+automatique, ni ici ni par la file d'envoi).
+
+smtplib étant bloquant, chaque opération réseau s'exécute dans un thread
+(asyncio.to_thread): la boucle d'événements n'est jamais bloquée.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import smtplib
+from collections import deque
+from enum import Enum
+from email.message import Message
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAIL_TRANSPORT_CONFIG = {
+    "max_connections": int(os.environ.get("SMTP_POOL_SIZE", "10")),
+    "per_domain_limit": int(os.environ.get("SMTP_PER_DOMAIN_LIMIT", "5")),
+    "max_retries": int(os.environ.get("SMTP_MAX_RETRIES", "3")),
+    "backoff_base_seconds": float(os.environ.get("SMTP_BACKOFF_SECONDS", "1.0")),
+    "idle_timeout_seconds": 60,       # Fermer les connexions inactives
+    "max_messages_per_connection": 100,
+    "connect_timeout_seconds": 30
+}
+
+
+class DeliveryOutcome(str, Enum):
+    """Résultat d'un envoi, tel que vu par les handlers de la file d'envoi"""
+    SENT = "sent"
+    SUPPRESSED = "suppressed"      # Destinataire désinscrit: rien envoyé
+    HARD_BOUNCE = "hard_bounce"    # 5xx sur le destinataire: échec définitif
+    TRANSIENT = "transient"        # 4xx restant, réseau, base...: à réessayer
+    UNCERTAIN = "uncertain"        # Coupure après DATA: peut-être délivré, ne pas renvoyer automatiquement
+
+
+class DeliveryUncertainError(smtplib.SMTPException):
+    """Connexion perdue après DATA: le serveur a peut-être déjà accepté le message"""
+
+
+def classify_delivery_error(error: Exception) -> DeliveryOutcome:
+    """Échec définitif lié au destinataire (5xx), envoi incertain ou échec temporaire"""
+    if isinstance(error, DeliveryUncertainError):
+        return DeliveryOutcome.UNCERTAIN
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused)):
+        # Problème de configuration de l'expéditeur: ne jamais pénaliser le destinataire
+        return DeliveryOutcome.TRANSIENT
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        if codes and all(code >= 500 for code in codes):
+            return DeliveryOutcome.HARD_BOUNCE
+        return DeliveryOutcome.TRANSIENT
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500:
+        return DeliveryOutcome.HARD_BOUNCE
+    return DeliveryOutcome.TRANSIENT
+
+
+def _is_transient(error: Exception) -> bool:
+    """4xx SMTP ou coupure réseau avant DATA: on peut réessayer"""
+    if isinstance(error, DeliveryUncertainError):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class _TrackingSMTP(smtplib.SMTP):
+    """smtplib.SMTP qui note le passage à la commande DATA"""
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.messages_sent = 0
+
+
+class _ConnectionPool:
+    """Connexions inactives pour un couple (serveur, identifiants)"""
+
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str], use_tls: bool):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.idle: deque = deque()
+        self.created = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = _TrackingSMTP(self.host, self.port, timeout=MAIL_TRANSPORT_CONFIG["connect_timeout_seconds"])
+        smtp.ehlo()
+        if self.use_tls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    async def acquire(self) -> _PooledConnection:
+        now = time.monotonic()
+        while self.idle:
+            connection = self.idle.pop()
+            if now - connection.last_used < MAIL_TRANSPORT_CONFIG["idle_timeout_seconds"]:
+                return connection
+            await asyncio.to_thread(_close_quietly, connection.smtp)
+
+        smtp = await asyncio.to_thread(self._connect)
+        self.created += 1
+        return _PooledConnection(smtp)
+
+    async def release(self, connection: _PooledConnection, healthy: bool):
+        connection.last_used = time.monotonic()
+        if healthy and connection.messages_sent < MAIL_TRANSPORT_CONFIG["max_messages_per_connection"]:
+            self.idle.append(connection)
+        else:
+            await asyncio.to_thread(_close_quietly, connection.smtp)
+
+    async def close(self):
+        while self.idle:
+            await asyncio.to_thread(_close_quietly, self.idle.pop().smtp)
+
+
+def _close_quietly(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+class MailTransport:
+    """Transport SMTP asynchrone avec pool de connexions borné"""
+
+    def __init__(
+        self,
+        max_connections: int = MAIL_TRANSPORT_CONFIG["max_connections"],
+        per_domain_limit: int = MAIL_TRANSPORT_CONFIG["per_domain_limit"],
+        max_retries: int = MAIL_TRANSPORT_CONFIG["max_retries"],
+        backoff_base_seconds: float = MAIL_TRANSPORT_CONFIG["backoff_base_seconds"]
+    ):
+        self.max_connections = max_connections
+        self.per_domain_limit = per_domain_limit
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self._pools: Dict[Tuple, _ConnectionPool] = {}
+        self._domain_limits: Dict[str, asyncio.Semaphore] = {}
+        self._connection_slots: Optional[asyncio.Semaphore] = None
+        self.stats = {"sent": 0, "retries": 0, "failed": 0}
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Créé paresseusement pour être lié à la boucle d'événements active
+        if self._connection_slots is None:
+            self._connection_slots = asyncio.Semaphore(self.max_connections)
+        return self._connection_slots
+
+    def _domain_limit(self, recipients: List[str]) -> asyncio.Semaphore:
+        domain = recipients[0].rsplit("@", 1)[-1].lower() if recipients else ""
+        if domain not in self._domain_limits:
+            self._domain_limits[domain] = asyncio.Semaphore(self.per_domain_limit)
+        return self._domain_limits[domain]
+
+    def _pool(self, host: str, port: int, username: Optional[str], password: Optional[str], use_tls: bool) -> _ConnectionPool:
+        key = (host, port, username, password, use_tls)
+        if key not in self._pools:
+            self._pools[key] = _ConnectionPool(host, port, username, password, use_tls)
+        return self._pools[key]
+
+    async def send_message(
+        self,
+        msg: Message,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        from_addr: Optional[str] = None,
+        to_addrs: Optional[List[str]] = None,
+        use_tls: bool = True
+    ) -> Dict:
+        """
+        Envoyer un message via une connexion du pool.
+        Les erreurs définitives (5xx) sont relevées telles quelles (exceptions smtplib).
+        """
+        pool = self._pool(host, port, username, password, use_tls)
+        recipients = to_addrs or [addr.strip() for addr in str(msg.get("To", "")).split(",") if addr.strip()]
+
+        attempt = 0
+        while True:
+            try:
+                async with self._domain_limit(recipients), self._slots():
+                    connection = await pool.acquire()
+                    healthy = False
+                    connection.smtp.data_started = False
+                    try:
+                        refused = await asyncio.to_thread(
+                            connection.smtp.send_message, msg, from_addr, to_addrs
+                        )
+                        connection.messages_sent += 1
+                        healthy = True
+                    except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                        # smtplib fait un RSET: la connexion reste utilisable après un refus
+                        healthy = True
+                        raise
+                    except (smtplib.SMTPServerDisconnected, OSError) as e:
+                        if connection.smtp.data_started:
+                            raise DeliveryUncertainError(f"Connexion perdue après DATA, message peut-être délivré: {e}") from e
+                        raise
+                    finally:
+                        await pool.release(connection, healthy)
+
+                self.stats["sent"] += 1
+                return {"success": True, "refused": refused, "attempts": attempt + 1}
+
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    self.stats["failed"] += 1
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                delay = self.backoff_base_seconds * (2 ** (attempt - 1)) * (1 + random.random() * 0.1)
+                logger.warning(f"SMTP transient error ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "pools": len(self._pools),
+            "idle_connections": sum(len(pool.idle) for pool in self._pools.values()),
+            "connections_created": sum(pool.created for pool in self._pools.values())
+        }
+
+    async def close(self):
+        for pool in self._pools.values():
+            await pool.close()
+
+
+# ========== INSTANCE GLOBALE ==========
+
+mail_transport = None
+
+def get_mail_transport() -> MailTransport:
+    """Obtenir le transport SMTP partagé"""
+    global mail_transport
+    if mail_transport is None:
+        mail_transport = MailTransport()
+    return mail_transport
@@ -0,0 +1,158 @@
+"""
+Josmoze.com - Client MongoDB partagé
+Un seul AsyncIOMotorClient par processus (pool de connexions dimensionné)
+pour l'application, les routers et les services: plus de handshake TCP/TLS
+ni de pool créé à chaque requête.
+
+Usage: `get_mongo_provider().client[DB_NAME]` ou `get_mongo_provider().database()`.
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+MONGO_POOL_CONFIG = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", "5")),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000")),       # 5 minutes
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+}
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Compteurs du pool de connexions (appelé depuis les threads du driver)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections_created": 0, "connections_closed": 0,
+            "checked_out": 0, "checked_in": 0, "checkout_failures": 0, "pool_cleared": 0
+        }
+        self.max_in_use = 0
+
+    def _incr(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+            in_use = self.counters["checked_out"] - self.counters["checked_in"]
+            if in_use > self.max_in_use:
+                self.max_in_use = in_use
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr("pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._incr("checked_out")
+
+    def connection_checked_in(self, event):
+        self._incr("checked_in")
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self.counters)
+            max_in_use = self.max_in_use
+        return {
+            **counters,
+            "open_connections": counters["connections_created"] - counters["connections_closed"],
+            "in_use": counters["checked_out"] - counters["checked_in"],
+            "max_in_use": max_in_use
+        }
+
+
+class MongoProvider:
+    """Client Motor unique de l'application"""
+
+    def __init__(self, mongo_url: Optional[str] = None, db_name: Optional[str] = None):
+        # Résolus à la création du client: les services instanciés à l'import
+        # ne doivent pas figer la configuration avant le chargement du .env
+        self._mongo_url = mongo_url
+        self._db_name = db_name
+        self.metrics = PoolMetricsListener()
+        self._client: Optional[AsyncIOMotorClient] = None
+
+    @property
+    def mongo_url(self) -> str:
+        return self._mongo_url or os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+    @property
+    def db_name(self) -> str:
+        return self._db_name or os.environ.get("DB_NAME", "josmoze_production")
+
+    def configure(self, mongo_url: Optional[str] = None, db_name: Optional[str] = None):
+        if self._client is not None and mongo_url and mongo_url != self.mongo_url:
+            logger.warning("MongoDB client already created, new MONGO_URL ignored")
+            return
+        self._mongo_url = mongo_url or self._mongo_url
+        self._db_name = db_name or self._db_name
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        """Créé au premier accès (dans la boucle asyncio de l'application)"""
+        if self._client is None:
+            self._client = AsyncIOMotorClient(
+                self.mongo_url, event_listeners=[self.metrics], **MONGO_POOL_CONFIG
+            )
+            logger.info(f"MongoDB client created (maxPoolSize={MONGO_POOL_CONFIG['maxPoolSize']})")
+        return self._client
+
+    def database(self, name: Optional[str] = None) -> AsyncIOMotorDatabase:
+        return self.client[name or self.db_name]
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        stats = self.metrics.snapshot()
+        max_pool_size = MONGO_POOL_CONFIG["maxPoolSize"]
+        return {
+            **stats,
+            "max_pool_size": max_pool_size,
+            "min_pool_size": MONGO_POOL_CONFIG["minPoolSize"],
+            "utilization": round(stats["in_use"] / max_pool_size, 4) if max_pool_size else 0.0,
+            "connected": self._client is not None
+        }
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+# ========== INSTANCE GLOBALE ==========
+
+mongo_provider = None
+
+def get_mongo_provider(mongo_url: Optional[str] = None, db_name: Optional[str] = None) -> MongoProvider:
+    """Obtenir le client MongoDB partagé (URL/base pris en compte tant que le client n'est pas créé)"""
+    global mongo_provider
+    if mongo_provider is None:
+        mongo_provider = MongoProvider(mongo_url, db_name)
+    elif mongo_url or db_name:
+        mongo_provider.configure(mongo_url, db_name)
+    return mongo_provider
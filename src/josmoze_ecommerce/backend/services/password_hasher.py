@@ -0,0 +1,134 @@
+"""
+Josmoze.com - Hachage des mots de passe hors de la boucle asyncio
+bcrypt coûte ~200 ms par opération: exécuté dans un handler async, il bloque
+toutes les autres requêtes du worker. Les calculs passent ici par un pool de
+threads dimensionné (bcrypt libère le GIL pendant le calcul) avec une file
+d'attente bornée: au-delà, PasswordHasherOverloaded est levée et les endpoints
+répondent 503 au lieu de geler le serveur.
+
+Les empreintes produites avec un coût inférieur à BCRYPT_ROUNDS sont
+recalculées à la connexion suivante (verify_and_update).
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASHING_CONFIG = {
+    "rounds": int(os.environ.get("BCRYPT_ROUNDS", "12")),
+    "workers": int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    "max_pending": int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32")),   # Calculs en cours + en attente
+    "retry_after": 1                                                          # Secondes (en-tête Retry-After)
+}
+
+
+class PasswordHasherOverloaded(Exception):
+    """Trop de calculs bcrypt en attente: la requête doit être rejetée (503)"""
+
+
+class PasswordHasher:
+    """Pool de threads borné pour bcrypt"""
+
+    def __init__(self, rounds: int = PASSWORD_HASHING_CONFIG["rounds"],
+                 workers: int = PASSWORD_HASHING_CONFIG["workers"],
+                 max_pending: int = PASSWORD_HASHING_CONFIG["max_pending"]):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0, "max_pending_seen": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Exécuter un calcul de mot de passe dans le pool (PasswordHasherOverloaded si la file est pleine)"""
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise PasswordHasherOverloaded(f"{self.pending} password hashes pending")
+
+        self.pending += 1
+        self.stats["max_pending_seen"] = max(self.stats["max_pending_seen"], self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    # ========== OPÉRATIONS BCRYPT (exécutées dans le pool) ==========
+
+    def _hash_sync(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify_sync(password: str, hashed: str) -> bool:
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # Empreinte mal formée
+            return False
+
+    # ========== API ==========
+
+    async def hash(self, password: str) -> str:
+        hashed = await self.run(self._hash_sync, password)
+        self.stats["hashed"] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        valid = await self.run(self._verify_sync, password, hashed)
+        self.stats["verified"] += 1
+        return valid
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Empreinte calculée avec un coût inférieur à la configuration actuelle"""
+        try:
+            # Format: $2b$12$<sel+hash>
+            return int(hashed.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """(mot de passe valide, nouvelle empreinte à enregistrer ou None)"""
+        if not await self.verify(password, hashed):
+            return False, None
+        if not self.needs_rehash(hashed):
+            return True, None
+        new_hash = await self.hash(password)
+        self.stats["rehashed"] += 1
+        return True, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "pending": self.pending,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "rounds": self.rounds
+        }
+
+
+# ========== INSTANCE GLOBALE ==========
+
+password_hasher = None
+
+def get_password_hasher() -> PasswordHasher:
+    """Obtenir le pool de hachage partagé"""
+    global password_hasher
+    if password_hasher is None:
+        password_hasher = PasswordHasher()
+    return password_hasher
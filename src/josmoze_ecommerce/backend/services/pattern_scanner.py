@@ -0,0 +1,116 @@
+"""
+Josmoze.com - Moteur de détection de patterns suspects
+Partagé par SecurityMiddleware (validation des requêtes) et SecurityAuditAgent
+(analyse des logs et payloads).
+
+Chaque règle est précompilée et associée aux littéraux dont elle a besoin
+(ex: "union", "<script", "../"), extraits automatiquement de l'expression.
+Un texte est d'abord réduit en minuscules puis filtré par ces littéraux
+(recherche de sous-chaîne en C): seules les règles dont un littéral est
+présent exécutent leur regex. Les textes légitimes, l'immense majorité,
+ne déclenchent donc aucune regex.
+"""
+
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# Un littéral plus court ne filtre quasiment rien: la règle est alors toujours évaluée
+MIN_LITERAL_LENGTH = 2
+
+
+def _literal_runs(items) -> List[FrozenSet[str]]:
+    """Ensembles de littéraux candidats (un des littéraux de l'ensemble est requis)"""
+    candidates: List[FrozenSet[str]] = []
+    run = ""
+    for op, value in items:
+        if op is sre_constants.LITERAL and value < 128:
+            run += chr(value).lower()
+            continue
+        if run:
+            candidates.append(frozenset([run]))
+            run = ""
+        if op is sre_constants.SUBPATTERN:
+            group_literals = _required_literals(value[-1])
+            if group_literals:
+                candidates.append(group_literals)
+        elif op is sre_constants.BRANCH:
+            branch_literals = [_required_literals(branch) for branch in value[1]]
+            if all(branch_literals):
+                candidates.append(frozenset().union(*branch_literals))
+        elif op is sre_constants.IN:
+            # Classe de caractères simples (ex: alternatives d'un seul caractère)
+            chars = [chr(v).lower() for o, v in value if o is sre_constants.LITERAL and v < 128]
+            if chars and len(chars) == len(value):
+                candidates.append(frozenset(chars))
+    if run:
+        candidates.append(frozenset([run]))
+    return candidates
+
+
+def _required_literals(items) -> Optional[FrozenSet[str]]:
+    """Meilleur ensemble de littéraux requis pour une séquence (le plus sélectif)"""
+    candidates = _literal_runs(items)
+    if not candidates:
+        return None
+    return max(candidates, key=lambda literals: min(len(literal) for literal in literals))
+
+
+def extract_literals(pattern: str, flags: int = 0) -> Optional[FrozenSet[str]]:
+    """Littéraux (minuscules) dont au moins un apparaît dans tout texte reconnu par le pattern"""
+    try:
+        literals = _required_literals(sre_parse.parse(pattern, flags))
+    except Exception:
+        return None
+    if not literals or min(len(literal) for literal in literals) < MIN_LITERAL_LENGTH:
+        return None
+    return literals
+
+
+class PatternScanner:
+    """Détection multi-règles en une passe de préfiltrage"""
+
+    def __init__(self, patterns: List[str], flags: int = 0):
+        self.rules: List[Tuple[str, "re.Pattern", Optional[FrozenSet[str]]]] = [
+            (pattern, re.compile(pattern, flags), extract_literals(pattern, flags))
+            for pattern in patterns
+        ]
+        self.patterns = [pattern for pattern, _, _ in self.rules]
+
+    def _candidates(self, text: str):
+        if not text.isascii():
+            # Équivalences de casse Unicode (ex: "ſ" ~ "s"): pas de préfiltrage
+            for pattern, compiled, _ in self.rules:
+                yield pattern, compiled
+            return
+        lowered = text.lower()
+        for pattern, compiled, literals in self.rules:
+            if literals is None or any(literal in lowered for literal in literals):
+                yield pattern, compiled
+
+    def first_match(self, text: str) -> Optional[str]:
+        """Première règle (dans l'ordre de configuration) reconnue dans le texte"""
+        for pattern, compiled in self._candidates(text):
+            if compiled.search(text):
+                return pattern
+        return None
+
+    def matches(self, text: str) -> List[str]:
+        """Toutes les règles reconnues dans le texte"""
+        return [pattern for pattern, compiled in self._candidates(text) if compiled.search(text)]
+
+
+@lru_cache(maxsize=16)
+def _cached_scanner(patterns: Tuple[str, ...], flags: int) -> PatternScanner:
+    return PatternScanner(list(patterns), flags)
+
+
+def get_pattern_scanner(patterns: List[str], flags: int = 0) -> PatternScanner:
+    """Scanner partagé pour une liste de règles (compilé une seule fois)"""
+    return _cached_scanner(tuple(patterns), flags)
@@ -6,20 +6,25 @@ Intégration avec le CRM pour ajustement prix
 """
 
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import json
 from datetime import datetime
 
+from mongo_provider import get_mongo_provider
+
 class PriceManager:
     def __init__(self):
         self.mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+
+    @property
+    def db(self):
+        """Base des prix via le client MongoDB partagé"""
+        return get_mongo_provider().client.josmose_db
         
     async def get_current_products(self):
         """Récupère les produits actuels depuis MongoDB"""
         
-        client = AsyncIOMotorClient(self.mongo_url)
-        db = client.josmose_db
+        db = self.db
         products = db.products
         
         current_products = []
@@ -31,14 +36,12 @@ class PriceManager:
                 "category": product.get("category", "osmoseur")
             })
         
-        await client.close()
         return current_products
     
     async def update_product_prices(self, price_updates):
         """Met à jour les prix dans la base de données"""
         
-        client = AsyncIOMotorClient(self.mongo_url)
-        db = client.josmose_db
+        db = self.db
         products = db.products
         
         updated_products = []
@@ -71,15 +74,13 @@ class PriceManager:
         
         # Logger les changements
         await self.log_price_changes(updated_products)
-        await client.close()
         
         return updated_products
     
     async def log_price_changes(self, changes):
         """Log des changements de prix pour historique"""
         
-        client = AsyncIOMotorClient(self.mongo_url)
-        db = client.josmose_db
+        db = self.db
         price_history = db.price_history
         
         for change in changes:
@@ -90,8 +91,6 @@ class PriceManager:
                 "reason": "competitive_analysis_recommendation",
                 "analyst": "ai_market_analyzer"
             })
-        
-        await client.close()
 
 # RECOMMANDATIONS FINALES BASÉES SUR L'ANALYSE
 price_recommendations = {
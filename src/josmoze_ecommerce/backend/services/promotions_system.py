@@ -11,10 +11,16 @@ FONCTIONNALITÉS :
 
 COLLECTIONS MONGODB :
 - promotions : codes promo avec paramètres
+- promotion_usage : utilisations (une par client/commande, index uniques)
 - referrals : système parrainage complet
 - users : comptes clients pour espace client
+
+UTILISATION SANS DÉPASSEMENT :
+- Limite globale : $inc conditionnel (used_count < usage_limit) évalué par MongoDB
+- Limite par client : emplacement (customer_slot) unique par code et client
 """
 
+import time
 import logging
 import secrets
 import string
@@ -22,11 +28,16 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
 import uuid
 import hashlib
 
+from cache_invalidation import get_cache_bus, invalidate_cache
+
 logger = logging.getLogger(__name__)
 
+ACTIVE_PROMOTIONS_CACHE_TTL = 300  # Secondes (filet de sécurité, invalidé par le bus à chaque écriture)
+
 # ========== MODELS PYDANTIC ==========
 
 class Promotion(BaseModel):
@@ -58,6 +69,7 @@ class PromotionUsage(BaseModel):
     discount_amount: float
     original_amount: float
     final_amount: float
+    customer_slot: int = 0  # 0..usage_limit_per_customer-1, unique par (code, client)
     used_at: datetime = Field(default_factory=datetime.utcnow)
     ip_address: Optional[str] = None
 
@@ -111,6 +123,11 @@ class PromotionsSystem:
         self.referrals_collection = db.referrals
         self.users_collection = db.users
         
+        # Définitions des promotions actives, par code (sans used_count, qui change à chaque utilisation)
+        self._active_promotions: Optional[Dict[str, Dict[str, Any]]] = None
+        self._active_promotions_loaded_at = 0.0
+        get_cache_bus().add_listener(self._on_cache_invalidation)
+        
     async def initialize(self):
         """Initialiser collections et index"""
         try:
@@ -119,6 +136,8 @@ class PromotionsSystem:
             await self.promotions_collection.create_index("active")
             await self.promotions_collection.create_index("expires_at")
             
+            await self._create_usage_indexes()
+            
             await self.referrals_collection.create_index("referrer_code", unique=True)
             await self.referrals_collection.create_index("referrer_email")
             await self.referrals_collection.create_index("status")
@@ -137,6 +156,21 @@ class PromotionsSystem:
             logger.error(f"Error initializing PromotionsSystem: {e}")
             raise
     
+    async def _create_usage_indexes(self):
+        """Utilisations: une par emplacement client, une par commande (rejeu idempotent)"""
+        try:
+            # Les utilisations antérieures (sans customer_slot) restent comptées par la validation
+            await self.promotion_usage_collection.create_index(
+                [("promotion_code", 1), ("user_email", 1), ("customer_slot", 1)], unique=True,
+                partialFilterExpression={"customer_slot": {"$exists": True}}
+            )
+            await self.promotion_usage_collection.create_index(
+                [("promotion_code", 1), ("user_email", 1), ("order_id", 1)], unique=True,
+                partialFilterExpression={"order_id": {"$type": "string"}}
+            )
+        except Exception as e:
+            logger.error(f"Error creating promotion usage indexes: {e}")
+    
     async def _create_default_promotions(self):
         """Créer promotions par défaut"""
         default_promotions = [
@@ -201,6 +235,7 @@ class PromotionsSystem:
             promotion = Promotion(**promotion_data)
             
             await self.promotions_collection.insert_one(promotion.dict())
+            await invalidate_cache("promotions")
             logger.info(f"✅ Promotion créée: {promotion.code}")
             
             return promotion
@@ -209,6 +244,37 @@ class PromotionsSystem:
             logger.error(f"Error creating promotion: {e}")
             raise
     
+    async def toggle_promotion(self, promotion_id: str) -> bool:
+        """Activer/désactiver une promotion"""
+        result = await self.promotions_collection.update_one(
+            {"id": promotion_id},
+            [{"$set": {"active": {"$not": "$active"}}}]
+        )
+        if result.modified_count > 0:
+            await invalidate_cache("promotions")
+        return result.modified_count > 0
+    
+    def _on_cache_invalidation(self, tags: List[str], pattern: Optional[str]) -> int:
+        """Listener du bus d'invalidation: recharger les définitions après create/toggle"""
+        if "promotions" in tags or pattern:
+            self._active_promotions = None
+        return 0
+    
+    async def _get_active_promotion(self, code: str) -> Optional[Dict[str, Any]]:
+        """Définition d'une promotion active, servie depuis la mémoire"""
+        if self._active_promotions is None or time.monotonic() - self._active_promotions_loaded_at > ACTIVE_PROMOTIONS_CACHE_TTL:
+            promotions = await self.promotions_collection.find({"active": True}, {"_id": 0}).to_list(None)
+            self._active_promotions = {promo["code"]: promo for promo in promotions}
+            self._active_promotions_loaded_at = time.monotonic()
+        
+        promo = self._active_promotions.get(code)
+        if promo is None:
+            # Code créé par un autre chemin (ex: bon de parrainage) depuis le chargement
+            promo = await self.promotions_collection.find_one({"code": code, "active": True}, {"_id": 0})
+            if promo is not None:
+                self._active_promotions[code] = promo
+        return promo
+    
     async def get_promotions(self, active_only: bool = False) -> List[Dict[str, Any]]:
         """Récupérer liste promotions"""
         try:
@@ -229,11 +295,8 @@ class PromotionsSystem:
     async def validate_promotion_code(self, code: str, user_email: str, order_amount: float, customer_type: str = "B2C") -> Dict[str, Any]:
         """Valider et calculer réduction code promo"""
         try:
-            # Récupérer promotion
-            promo = await self.promotions_collection.find_one({
-                "code": code.upper(),
-                "active": True
-            })
+            # Récupérer promotion (used_count peut dater: la limite globale est garantie à l'application)
+            promo = await self._get_active_promotion(code.upper())
             
             if not promo:
                 return {"valid": False, "error": "Code promotionnel invalide"}
@@ -301,15 +364,37 @@ class PromotionsSystem:
     async def apply_promotion(self, code: str, user_email: str, order_amount: float, order_id: str = None, ip_address: str = None) -> Dict[str, Any]:
         """Appliquer promotion et enregistrer utilisation"""
         try:
+            code = code.upper()
+            
+            # Commande déjà traitée (paiement rejoué): même résultat, sans nouvelle utilisation
+            if order_id:
+                existing_usage = await self.promotion_usage_collection.find_one(
+                    {"promotion_code": code, "user_email": user_email, "order_id": order_id}
+                )
+                if existing_usage:
+                    return await self._usage_result(existing_usage)
+            
             # Valider d'abord
             validation = await self.validate_promotion_code(code, user_email, order_amount)
             if not validation["valid"]:
                 return validation
             
-            # Enregistrer utilisation
+            promotion = await self._get_active_promotion(code)
+            if promotion is None:
+                return {"valid": False, "error": "Code promotionnel invalide"}
+            
+            # Réserver une utilisation globale: le $inc n'a lieu que sous la limite
+            claim_filter = {"id": promotion["id"], "active": True}
+            if promotion.get("usage_limit"):
+                claim_filter["used_count"] = {"$lt": promotion["usage_limit"]}
+            claimed = await self.promotions_collection.update_one(claim_filter, {"$inc": {"used_count": 1}})
+            if claimed.modified_count == 0:
+                return {"valid": False, "error": "Code promotionnel épuisé"}
+            
+            # Enregistrer utilisation dans un emplacement libre du client
             usage = PromotionUsage(
-                promotion_id=validation["promotion"]["id"],
-                promotion_code=code.upper(),
+                promotion_id=promotion["id"],
+                promotion_code=code,
                 user_email=user_email,
                 order_id=order_id,
                 discount_amount=validation["discount_amount"],
@@ -318,21 +403,50 @@ class PromotionsSystem:
                 ip_address=ip_address
             )
             
-            await self.promotion_usage_collection.insert_one(usage.dict())
-            
-            # Incrémenter compteur utilisation
-            await self.promotions_collection.update_one(
-                {"code": code.upper()},
-                {"$inc": {"used_count": 1}}
-            )
-            
-            logger.info(f"✅ Promotion appliquée: {code} pour {user_email}")
-            return validation
+            existing_usage = None
+            for slot in range(promotion.get("usage_limit_per_customer", 1)):
+                usage.customer_slot = slot
+                try:
+                    await self.promotion_usage_collection.insert_one(usage.dict())
+                    logger.info(f"✅ Promotion appliquée: {code} pour {user_email}")
+                    return validation
+                except DuplicateKeyError:
+                    # Quel que soit l'index en conflit, la même commande a pu être
+                    # appliquée en parallèle (et occuper cet emplacement): vérifier avant de continuer
+                    if order_id:
+                        existing_usage = await self.promotion_usage_collection.find_one(
+                            {"promotion_code": code, "user_email": user_email, "order_id": order_id}
+                        )
+                        if existing_usage:
+                            break
+            
+            # Pas d'emplacement (ou commande déjà appliquée): rendre l'utilisation globale réservée
+            await self.promotions_collection.update_one({"id": promotion["id"]}, {"$inc": {"used_count": -1}})
+            if existing_usage:
+                return await self._usage_result(existing_usage)
+            return {"valid": False, "error": "Limite d'utilisation atteinte pour ce code"}
             
         except Exception as e:
             logger.error(f"Error applying promotion: {e}")
             return {"valid": False, "error": "Erreur lors de l'application"}
     
+    async def _usage_result(self, usage: Dict[str, Any]) -> Dict[str, Any]:
+        """Résultat d'application reconstruit depuis une utilisation enregistrée"""
+        promo = await self.promotions_collection.find_one({"id": usage["promotion_id"]}, {"_id": 0}) or {}
+        return {
+            "valid": True,
+            "promotion": {
+                "id": usage["promotion_id"],
+                "code": usage["promotion_code"],
+                "name": promo.get("name"),
+                "description": promo.get("description"),
+                "type": promo.get("type"),
+                "value": promo.get("value")
+            },
+            "discount_amount": usage["discount_amount"],
+            "final_amount": usage["final_amount"]
+        }
+    
     # ========== SYSTÈME PARRAINAGE ==========
     
     def _generate_referral_code(self, email: str) -> str:
@@ -512,6 +626,7 @@ class PromotionsSystem:
             )
             
             await self.promotions_collection.insert_one(reward_promotion.dict())
+            await invalidate_cache("promotions")
             
             # Mettre à jour parrainage
             await self.referrals_collection.update_one(
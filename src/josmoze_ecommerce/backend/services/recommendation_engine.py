@@ -6,13 +6,188 @@ Moteur de recommandations intelligent pour augmenter les ventes
 import logging
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+import asyncio
 import json
 import math
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 logger = logging.getLogger(__name__)
 
+# Statuts de commande considérés comme des achats effectifs
+# ("paid" est le statut écrit par create_order_from_payment)
+PURCHASE_STATUSES = ["completed", "paid"]
+
+
+class CoPurchaseIndex:
+    """
+    Index en mémoire des achats, construit une seule fois depuis `orders`
+    puis maintenu de façon incrémentale à chaque nouvelle commande.
+
+    - customer_products: client -> produits achetés
+    - product_customers: produit -> clients acheteurs (index inversé)
+    - co_purchase: produit -> Counter des produits achetés dans la même commande
+    - popularité: ventes par jour sur la fenêtre `recency_days`, avec totaux
+      glissants pour un score O(1) par produit
+    """
+
+    def __init__(self, recency_days: int = 90):
+        self.recency_days = recency_days
+        self.customer_products: Dict[str, set] = defaultdict(set)
+        self.product_customers: Dict[str, set] = defaultdict(set)
+        self.co_purchase: Dict[str, Counter] = defaultdict(Counter)
+        self.product_orders: Counter = Counter()
+
+        self._daily_sales: Dict[Any, Counter] = {}
+        self._days: deque = deque()
+        self._recent_sales: Counter = Counter()
+        self._recent_total = 0
+
+        self._seen_orders: set = set()
+        self.built_at: Optional[datetime] = None
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        """Construire l'index en un seul passage sur la collection orders"""
+        cursor = db.orders.find(
+            {"status": {"$in": PURCHASE_STATUSES}},
+            {"_id": 0, "id": 1, "customer_email": 1, "items": 1, "created_at": 1}
+        )
+        count = 0
+        async for order in cursor:
+            self.add_order(order)
+            count += 1
+
+        self.built_at = datetime.now()
+        logger.info(f"Co-purchase index built from {count} orders")
+
+    def add_order(self, order: Dict):
+        """Intégrer une commande dans l'index (idempotent sur l'id de commande)"""
+        order_id = order.get("id")
+        if order_id:
+            if order_id in self._seen_orders:
+                return
+            self._seen_orders.add(order_id)
+
+        items = order.get("items", []) or []
+        product_ids = set(item.get("product_id") for item in items if item.get("product_id"))
+        customer = order.get("customer_email")
+
+        if customer:
+            self.customer_products[customer] |= product_ids
+            for product_id in product_ids:
+                self.product_customers[product_id].add(customer)
+
+        for product_id in product_ids:
+            self.product_orders[product_id] += 1
+            for other_id in product_ids:
+                if other_id != product_id:
+                    self.co_purchase[product_id][other_id] += 1
+
+        self._add_sales(order.get("created_at"), items)
+
+    def _add_sales(self, created_at: Any, items: List[Dict]):
+        """Ajouter les quantités vendues au compteur journalier"""
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        if not isinstance(created_at, datetime):
+            created_at = datetime.now()
+
+        day = created_at.replace(tzinfo=None).date()
+        if day < self._cutoff_day():
+            return
+
+        if day not in self._daily_sales:
+            self._daily_sales[day] = Counter()
+            # Les commandes arrivent quasi toujours dans l'ordre chronologique
+            if self._days and day < self._days[-1]:
+                self._days = deque(sorted(list(self._days) + [day]))
+            else:
+                self._days.append(day)
+
+        for item in items:
+            quantity = item.get("quantity", 1)
+            self._daily_sales[day][item.get("product_id")] += quantity
+            self._recent_sales[item.get("product_id")] += quantity
+            self._recent_total += quantity
+
+    def _cutoff_day(self):
+        return (datetime.now() - timedelta(days=self.recency_days)).date()
+
+    def _expire_old_days(self):
+        """Retirer des totaux glissants les jours sortis de la fenêtre"""
+        cutoff = self._cutoff_day()
+        while self._days and self._days[0] < cutoff:
+            day = self._days.popleft()
+            expired = self._daily_sales.pop(day)
+            self._recent_sales.subtract(expired)
+            self._recent_total -= sum(expired.values())
+
+    def popularity(self, product_id: str) -> float:
+        """Part des ventes récentes réalisée par ce produit"""
+        self._expire_old_days()
+        if self._recent_total <= 0:
+            return 0.0
+        return self._recent_sales.get(product_id, 0) / self._recent_total
+
+    def has_purchased(self, customer_email: str, product_id: str) -> bool:
+        return product_id in self.customer_products.get(customer_email, ())
+
+    def co_purchase_rate(self, source_id: str, target_id: str) -> float:
+        """Proportion des commandes contenant source_id qui contiennent aussi target_id"""
+        orders_with_source = self.product_orders.get(source_id, 0)
+        if orders_with_source == 0:
+            return 0.0
+        return self.co_purchase[source_id].get(target_id, 0) / orders_with_source
+
+    def similar_customers(self, customer_id: str, customer_products: set, limit: int = 10) -> List[Dict]:
+        """Clients partageant des achats, via l'index inversé produit -> clients"""
+        candidates = Counter()
+        for product_id in customer_products:
+            for other_customer in self.product_customers.get(product_id, ()):
+                if other_customer != customer_id:
+                    candidates[other_customer] += 1
+
+        similar = []
+        total_current = len(customer_products)
+        for other_customer, common in candidates.items():
+            total_other = len(self.customer_products[other_customer])
+            # Coefficient de Jaccard
+            similarity = common / (total_current + total_other - common)
+            if similarity > 0.1:  # Seuil de similarité minimum
+                similar.append({
+                    "email": other_customer,
+                    "common_products": common,
+                    "total_products": total_other,
+                    "similarity": similarity
+                })
+
+        return sorted(similar, key=lambda x: x["similarity"], reverse=True)[:limit]
+
+
+co_purchase_index: Optional[CoPurchaseIndex] = None
+_index_lock = asyncio.Lock()
+
+
+async def get_co_purchase_index(db: AsyncIOMotorDatabase, recency_days: int = 90) -> CoPurchaseIndex:
+    """Obtenir l'index de co-achat (construit au premier appel, reconstruit si la fenêtre change)"""
+    global co_purchase_index
+    if co_purchase_index is None or co_purchase_index.recency_days != recency_days:
+        async with _index_lock:
+            if co_purchase_index is None or co_purchase_index.recency_days != recency_days:
+                index = CoPurchaseIndex(recency_days)
+                await index.build(db)
+                co_purchase_index = index
+    return co_purchase_index
+
+
+def record_order_for_recommendations(order: Dict):
+    """Mettre à jour l'index après l'écriture d'une commande"""
+    if co_purchase_index is None:
+        # L'index sera construit depuis la base au prochain appel
+        return
+    if order.get("status") in PURCHASE_STATUSES:
+        co_purchase_index.add_order(order)
+
 class ProductRecommendationEngine:
     """Moteur de recommandations de produits intelligent"""
     
@@ -80,9 +255,11 @@ class ProductRecommendationEngine:
         """Calculer les recommandations avec différents algorithmes"""
         
         # 1. Récupérer les données nécessaires
+        index = await get_co_purchase_index(self.db, self.config["recency_days"])
         products = await self._get_products_data()
+        products_by_id = {p["id"]: p for p in products}
         customer_history = await self._get_customer_history(customer_id) if customer_id else []
-        similar_customers = await self._find_similar_customers(customer_id) if customer_id else []
+        similar_customers = await self._find_similar_customers(customer_id, customer_history) if customer_id else []
         
         # 2. Calculer les scores pour chaque produit
         product_scores = {}
@@ -96,13 +273,13 @@ class ProductRecommendationEngine:
                 continue
             
             # Calculer les différents scores
-            collaborative_score = await self._calculate_collaborative_score(
-                product_id, similar_customers, customer_history
+            collaborative_score = self._calculate_collaborative_score(
+                index, product_id, similar_customers, cart_product_ids
             )
-            content_score = await self._calculate_content_similarity_score(
-                product_id, cart_product_ids, customer_history
+            content_score = self._calculate_content_similarity_score(
+                product_id, cart_product_ids, customer_history, products_by_id
             )
-            popularity_score = await self._calculate_popularity_score(product_id)
+            popularity_score = index.popularity(product_id)
             business_score = await self._calculate_business_rules_score(
                 product, customer_type, context
             )
@@ -141,33 +318,22 @@ class ProductRecommendationEngine:
         
         return sorted_recommendations
     
-    async def _calculate_collaborative_score(
-        self, product_id: str, similar_customers: List[Dict], customer_history: List[Dict]
+    def _calculate_collaborative_score(
+        self, index: CoPurchaseIndex, product_id: str,
+        similar_customers: List[Dict], cart_product_ids: List[str]
     ) -> float:
         """Filtrage collaboratif - "Les clients qui ont acheté X ont aussi acheté Y" """
         if not similar_customers:
-            return 0.0
+            # Sans historique client, s'appuyer sur les co-achats du panier
+            rates = [index.co_purchase_rate(cart_id, product_id) for cart_id in cart_product_ids]
+            return max(rates) if rates else 0.0
         
         score = 0.0
         total_weight = 0.0
         
         for similar_customer in similar_customers:
             # Vérifier si ce client similaire a acheté le produit
-            customer_orders = await self.db.orders.find({
-                "customer_email": similar_customer["email"],
-                "status": "completed"
-            }).to_list(None)
-            
-            has_product = False
-            for order in customer_orders:
-                for item in order.get("items", []):
-                    if item.get("product_id") == product_id:
-                        has_product = True
-                        break
-                if has_product:
-                    break
-            
-            if has_product:
+            if index.has_purchased(similar_customer["email"], product_id):
                 # Pondérer par la similarité du client
                 similarity = similar_customer.get("similarity", 0.5)
                 score += similarity
@@ -175,14 +341,15 @@ class ProductRecommendationEngine:
         
         return score / total_weight if total_weight > 0 else 0.0
     
-    async def _calculate_content_similarity_score(
-        self, product_id: str, cart_product_ids: List[str], customer_history: List[Dict]
+    def _calculate_content_similarity_score(
+        self, product_id: str, cart_product_ids: List[str],
+        customer_history: List[Dict], products_by_id: Dict[str, Dict]
     ) -> float:
         """Similarité basée sur le contenu des produits"""
         if not cart_product_ids and not customer_history:
             return 0.0
         
-        target_product = await self._get_product_by_id(product_id)
+        target_product = products_by_id.get(product_id)
         if not target_product:
             return 0.0
         
@@ -190,14 +357,14 @@ class ProductRecommendationEngine:
         
         # Similarité avec les produits du panier
         for cart_product_id in cart_product_ids:
-            cart_product = await self._get_product_by_id(cart_product_id)
+            cart_product = products_by_id.get(cart_product_id)
             if cart_product:
                 similarity = self._calculate_product_similarity(target_product, cart_product)
                 similarity_scores.append(similarity)
         
         # Similarité avec l'historique d'achat
         for history_item in customer_history:
-            history_product = await self._get_product_by_id(history_item.get("product_id"))
+            history_product = products_by_id.get(history_item.get("product_id"))
             if history_product:
                 similarity = self._calculate_product_similarity(target_product, history_product)
                 # Pondérer par l'ancienneté de l'achat
@@ -234,34 +401,6 @@ class ProductRecommendationEngine:
         
         return min(similarity, 1.0)
     
-    async def _calculate_popularity_score(self, product_id: str) -> float:
-        """Score de popularité basé sur les ventes récentes"""
-        try:
-            # Période récente
-            cutoff_date = datetime.now() - timedelta(days=self.config["recency_days"])
-            
-            # Compter les ventes récentes
-            orders = await self.db.orders.find({
-                "created_at": {"$gte": cutoff_date},
-                "status": "completed"
-            }).to_list(None)
-            
-            product_sales = 0
-            total_sales = 0
-            
-            for order in orders:
-                for item in order.get("items", []):
-                    if item.get("product_id") == product_id:
-                        product_sales += item.get("quantity", 1)
-                    total_sales += item.get("quantity", 1)
-            
-            # Normaliser le score
-            return product_sales / total_sales if total_sales > 0 else 0.0
-            
-        except Exception as e:
-            logger.error(f"Popularity score error: {e}")
-            return 0.0
-    
     async def _calculate_business_rules_score(
         self, product: Dict, customer_type: str, context: Dict
     ) -> float:
@@ -375,7 +514,7 @@ class ProductRecommendationEngine:
         try:
             orders = await self.db.orders.find({
                 "customer_email": customer_id,
-                "status": "completed"
+                "status": {"$in": PURCHASE_STATUSES}
             }).sort("created_at", -1).limit(50).to_list(None)
             
             history = []
@@ -394,60 +533,22 @@ class ProductRecommendationEngine:
             logger.error(f"Customer history error: {e}")
             return []
     
-    async def _find_similar_customers(self, customer_id: str) -> List[Dict]:
+    async def _find_similar_customers(self, customer_id: str, customer_history: List[Dict]) -> List[Dict]:
         """Trouver des clients similaires"""
         if not customer_id:
             return []
         
         try:
             # Algorithme simple basé sur les achats communs
-            customer_history = await self._get_customer_history(customer_id)
-            customer_products = set(item["product_id"] for item in customer_history)
+            customer_products = set(item["product_id"] for item in customer_history if item.get("product_id"))
             
             if not customer_products:
                 return []
             
-            # Trouver d'autres clients qui ont acheté des produits similaires
-            similar_customers = []
-            
-            orders = await self.db.orders.find({
-                "customer_email": {"$ne": customer_id},
-                "status": "completed"
-            }).to_list(None)
-            
-            customer_similarities = defaultdict(lambda: {"email": "", "common_products": 0, "total_products": 0})
-            
-            for order in orders:
-                other_customer = order.get("customer_email")
-                if not other_customer:
-                    continue
-                
-                other_products = set()
-                for item in order.get("items", []):
-                    other_products.add(item.get("product_id"))
-                
-                if other_products:
-                    common = len(customer_products & other_products)
-                    if common > 0:
-                        customer_similarities[other_customer]["email"] = other_customer
-                        customer_similarities[other_customer]["common_products"] += common
-                        customer_similarities[other_customer]["total_products"] += len(other_products)
-            
-            # Calculer la similarité et trier
-            for customer_data in customer_similarities.values():
-                common = customer_data["common_products"]
-                total_other = customer_data["total_products"]
-                total_current = len(customer_products)
-                
-                # Coefficient de Jaccard
-                similarity = common / (total_current + total_other - common)
-                customer_data["similarity"] = similarity
-                
-                if similarity > 0.1:  # Seuil de similarité minimum
-                    similar_customers.append(customer_data)
+            index = await get_co_purchase_index(self.db, self.config["recency_days"])
             
             # Retourner les 10 clients les plus similaires
-            return sorted(similar_customers, key=lambda x: x["similarity"], reverse=True)[:10]
+            return index.similar_customers(customer_id, customer_products, limit=10)
             
         except Exception as e:
             logger.error(f"Similar customers error: {e}")
@@ -35,6 +35,8 @@ import threading
 import schedule
 import pytz
 
+from pattern_scanner import get_pattern_scanner
+
 # Configuration de l'agent de sécurité
 SECURITY_CONFIG = {
     "audit_time": "00:00",  # Minuit heure française
@@ -122,9 +124,8 @@ class SecurityAuditAgent:
         self.active_sessions = {}
         self.blocked_ips = set()
         
-        # Patterns de sécurité compilés
-        self.security_patterns = [re.compile(pattern, re.IGNORECASE) 
-                                 for pattern in SECURITY_CONFIG["suspicious_patterns"]]
+        # Moteur de détection partagé avec SecurityMiddleware
+        self.pattern_scanner = get_pattern_scanner(SECURITY_CONFIG["suspicious_patterns"], re.IGNORECASE)
         
         # Timezone française
         self.timezone = pytz.timezone(SECURITY_CONFIG["timezone"])
@@ -233,15 +234,14 @@ class SecurityAuditAgent:
             
             for line in lines:
                 # Détecter les patterns suspects
-                for pattern in self.security_patterns:
-                    if pattern.search(line):
-                        await self._handle_security_threat({
-                            "type": "suspicious_pattern",
-                            "severity": "MEDIUM",
-                            "source": log_file,
-                            "content": line.strip(),
-                            "pattern": pattern.pattern
-                        })
+                for pattern in self.pattern_scanner.matches(line):
+                    await self._handle_security_threat({
+                        "type": "suspicious_pattern",
+                        "severity": "MEDIUM",
+                        "source": log_file,
+                        "content": line.strip(),
+                        "pattern": pattern
+                    })
                 
                 # Détecter les erreurs 404 répétées (scan de vulnérabilités)
                 if "404" in line and any(suspicious in line.lower() for suspicious in 
@@ -299,17 +299,16 @@ class SecurityAuditAgent:
                 payload = str(request.get("payload", "")) + str(request.get("params", ""))
                 
                 # Vérifier les patterns de sécurité
-                for pattern in self.security_patterns:
-                    if pattern.search(payload):
-                        await self._handle_security_threat({
-                            "type": "malicious_payload",
-                            "severity": "HIGH",
-                            "source_ip": request.get("ip", "unknown"),
-                            "endpoint": request.get("endpoint", ""),
-                            "payload": payload[:500],  # Limiter la taille
-                            "user_agent": request.get("user_agent", ""),
-                            "pattern_matched": pattern.pattern
-                        })
+                for pattern in self.pattern_scanner.matches(payload):
+                    await self._handle_security_threat({
+                        "type": "malicious_payload",
+                        "severity": "HIGH",
+                        "source_ip": request.get("ip", "unknown"),
+                        "endpoint": request.get("endpoint", ""),
+                        "payload": payload[:500],  # Limiter la taille
+                        "user_agent": request.get("user_agent", ""),
+                        "pattern_matched": pattern
+                    })
                         
         except Exception as e:
             self.logger.error(f"Erreur analyse patterns: {str(e)}")
@@ -8,16 +8,23 @@ import json
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from collections import defaultdict, deque
+from collections import defaultdict, OrderedDict
+import os
 import redis
+import redis.asyncio as aioredis
 import asyncio
 from fastapi import Request, Response, HTTPException, status
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request as StarletteRequest
-from starlette.responses import Response as StarletteResponse
+from starlette.responses import Response as StarletteResponse, StreamingResponse
 import ipaddress
 import re
 import hashlib
+import fnmatch
+from urllib.parse import urlencode
+
+from pattern_scanner import get_pattern_scanner
+from cache_invalidation import get_cache_bus
 
 logger = logging.getLogger(__name__)
 
@@ -31,12 +38,38 @@ except:
     REDIS_AVAILABLE = False
     logger.warning("Redis not available, using memory fallback")
 
+# Client asynchrone (pool de connexions) pour le chemin critique des requêtes
+async_redis_pool = aioredis.ConnectionPool(
+    host='localhost', port=6379, db=0, decode_responses=True,
+    max_connections=int(os.environ.get("REDIS_POOL_SIZE", "50"))
+)
+async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
+
+# Blocage + compteurs minute/heure en un seul aller-retour Redis
+# KEYS: blocked_ip, compteur minute, compteur heure - ARGV: TTL minute, TTL heure
+IP_CHECK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == '1' then
+    return {1, 0, 0}
+end
+local minute_count = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+local hour_count = redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return {0, minute_count, hour_count}
+"""
+
 # Configuration sécurité
 SECURITY_CONFIG = {
     "rate_limit": {
         "requests_per_minute": 300,
         "requests_per_hour": 5000,
-        "burst_limit": 50
+        "burst_limit": 50,
+        "max_tracked_ips": 100000,        # Fallback mémoire: IPs suivies au maximum (LRU)
+        "idle_ip_ttl_seconds": 3600       # Oubli des IPs inactives
+    },
+    "route_limits": {
+        "sensitive": {"requests_per_minute": 10, "requests_per_hour": 100},
+        "public": {"requests_per_minute": 120, "requests_per_hour": 2000}
     },
     "blocked_ips": set(),
     "suspicious_patterns": [
@@ -53,33 +86,119 @@ SECURITY_CONFIG = {
     "public_endpoints": ["/api/", "/api/detect-location", "/api/products", "/api/company/legal-info"]
 }
 
+class _WindowState:
+    """Compteurs fenêtre courante/précédente pour la minute et l'heure"""
+    __slots__ = ("minute_start", "minute_count", "minute_previous",
+                 "hour_start", "hour_count", "hour_previous", "last_seen")
+
+    def __init__(self, now: float):
+        self.minute_start = now - now % 60
+        self.minute_count = 0
+        self.minute_previous = 0
+        self.hour_start = now - now % 3600
+        self.hour_count = 0
+        self.hour_previous = 0
+        self.last_seen = now
+
+
+class SlidingWindowRateLimiter:
+    """
+    Rate limiter à fenêtre glissante (compteur pondéré de la fenêtre précédente).
+    État fixe par IP, décision en temps constant, IPs évincées par LRU et inactivité:
+    la mémoire reste bornée même face à un grand nombre d'IPs sources.
+    """
+
+    def __init__(self, max_keys: int = 100000, idle_ttl: float = 3600):
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._states: "OrderedDict[str, _WindowState]" = OrderedDict()
+
+    @staticmethod
+    def _slide(start: float, count: int, previous: int, window: int, now: float) -> tuple:
+        current_start = now - now % window
+        if current_start == start:
+            return start, count, previous
+        if current_start - start == window:
+            return current_start, 0, count
+        return current_start, 0, 0
+
+    @staticmethod
+    def _estimate(start: float, count: int, previous: int, window: int, now: float) -> float:
+        return previous * (window - (now - start)) / window + count
+
+    def hit(self, key: str, limit_per_minute: int, limit_per_hour: int, now: Optional[float] = None) -> bool:
+        """Compter une requête et indiquer si elle reste dans les limites"""
+        now = time.time() if now is None else now
+
+        state = self._states.get(key)
+        if state is None:
+            state = _WindowState(now)
+            self._states[key] = state
+        else:
+            self._states.move_to_end(key)
+        state.last_seen = now
+
+        state.minute_start, state.minute_count, state.minute_previous = self._slide(
+            state.minute_start, state.minute_count, state.minute_previous, 60, now)
+        state.hour_start, state.hour_count, state.hour_previous = self._slide(
+            state.hour_start, state.hour_count, state.hour_previous, 3600, now)
+        state.minute_count += 1
+        state.hour_count += 1
+
+        self._evict(now)
+
+        return (
+            self._estimate(state.minute_start, state.minute_count, state.minute_previous, 60, now) <= limit_per_minute
+            and self._estimate(state.hour_start, state.hour_count, state.hour_previous, 3600, now) <= limit_per_hour
+        )
+
+    def _evict(self, now: float):
+        # Les plus anciennes IPs sont en tête: coût amorti constant
+        while self._states:
+            oldest_key, oldest = next(iter(self._states.items()))
+            if len(self._states) > self.max_keys or now - oldest.last_seen > self.idle_ttl:
+                del self._states[oldest_key]
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
 class SecurityMiddleware(BaseHTTPMiddleware):
     """Middleware de sécurité avancé pour protection DDoS, injections, etc."""
     
     def __init__(self, app, config: Dict = None):
         super().__init__(app)
         self.config = config or SECURITY_CONFIG
-        self.ip_requests = defaultdict(lambda: deque(maxlen=1000))
+        rate_limit = self.config["rate_limit"]
+        self.rate_limiter = SlidingWindowRateLimiter(
+            max_keys=rate_limit.get("max_tracked_ips", 100000),
+            idle_ttl=rate_limit.get("idle_ip_ttl_seconds", 3600)
+        )
         self.blocked_until = defaultdict(datetime)
         
-        # Compiler les patterns de sécurité
-        self.compiled_patterns = [re.compile(pattern) for pattern in self.config["suspicious_patterns"]]
+        # Moteur de détection partagé (règles précompilées + préfiltre par littéraux)
+        self.pattern_scanner = get_pattern_scanner(self.config["suspicious_patterns"])
+        
+        # Script Lua enregistré une fois (EVALSHA, repli EVAL si absent du cache Redis)
+        self.ip_check_script = async_redis_client.register_script(IP_CHECK_SCRIPT)
     
     async def dispatch(self, request: Request, call_next) -> Response:
         start_time = time.time()
         client_ip = self._get_client_ip(request)
         
         try:
-            # 1. Vérifier les IPs bloquées
-            if await self._is_ip_blocked(client_ip):
+            # 1-2. IP bloquée + rate limiting (un seul aller-retour Redis)
+            blocked, within_limit = await self._check_ip(client_ip, request.url.path)
+            if blocked:
                 logger.warning(f"Blocked IP attempt: {client_ip}")
                 raise HTTPException(
                     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                     detail="Too many requests. Try again later."
                 )
             
-            # 2. Rate limiting
-            if not await self._check_rate_limit(client_ip, request.url.path):
+            if not within_limit:
                 await self._block_ip_temporarily(client_ip, minutes=15)
                 logger.warning(f"Rate limit exceeded: {client_ip} - {request.url.path}")
                 raise HTTPException(
@@ -126,8 +245,8 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         
         return request.client.host if request.client else "unknown"
     
-    async def _is_ip_blocked(self, ip: str) -> bool:
-        """Vérifier si une IP est bloquée"""
+    def _is_ip_blocked_locally(self, ip: str) -> bool:
+        """Vérifier les blocages connus de cette instance (sans réseau)"""
         if ip in self.config["blocked_ips"]:
             return True
         
@@ -138,73 +257,55 @@ class SecurityMiddleware(BaseHTTPMiddleware):
             else:
                 del self.blocked_until[ip]
         
-        # Vérifier dans Redis si disponible
-        if REDIS_AVAILABLE:
-            try:
-                blocked = redis_client.get(f"blocked_ip:{ip}")
-                return blocked == "1"
-            except:
-                pass
-        
         return False
     
-    async def _check_rate_limit(self, ip: str, path: str) -> bool:
-        """Rate limiting intelligent par IP et endpoint"""
-        now = datetime.now()
+    def _get_limits(self, path: str) -> tuple:
+        """Limites (par minute, par heure) selon la classe de l'endpoint"""
+        route_limits = self.config.get("route_limits", SECURITY_CONFIG["route_limits"])
         
         # Configuration spéciale pour les endpoints sensibles
         if any(path.startswith(sensitive) for sensitive in self.config["sensitive_endpoints"]):
-            limit_per_minute = 10
-            limit_per_hour = 100
+            policy = route_limits["sensitive"]
         elif any(path.startswith(public) for public in self.config["public_endpoints"]):
-            limit_per_minute = 120
-            limit_per_hour = 2000
+            policy = route_limits["public"]
         else:
-            limit_per_minute = self.config["rate_limit"]["requests_per_minute"]
-            limit_per_hour = self.config["rate_limit"]["requests_per_hour"]
+            policy = self.config["rate_limit"]
+        return policy["requests_per_minute"], policy["requests_per_hour"]
+    
+    async def _check_ip(self, ip: str, path: str) -> tuple:
+        """
+        Blocage et rate limiting par IP et endpoint.
+        Retourne (bloquée, dans_la_limite).
+        """
+        if self._is_ip_blocked_locally(ip):
+            return True, True
+        
+        limit_per_minute, limit_per_hour = self._get_limits(path)
         
         if REDIS_AVAILABLE:
             try:
-                # Utiliser Redis pour le rate limiting distribué
-                pipe = redis_client.pipeline()
-                
-                # Compteur par minute
-                minute_key = f"rate_limit:{ip}:{now.strftime('%Y%m%d%H%M')}"
-                pipe.incr(minute_key)
-                pipe.expire(minute_key, 60)
-                
-                # Compteur par heure
-                hour_key = f"rate_limit:{ip}:{now.strftime('%Y%m%d%H')}"
-                pipe.incr(hour_key)
-                pipe.expire(hour_key, 3600)
-                
-                results = pipe.execute()
-                
-                minute_count = results[0]
-                hour_count = results[2]
-                
-                return minute_count <= limit_per_minute and hour_count <= limit_per_hour
+                # Rate limiting distribué: blocage + 2 compteurs via un script Lua
+                now = datetime.now()
+                blocked, minute_count, hour_count = await self.ip_check_script(
+                    keys=[
+                        f"blocked_ip:{ip}",
+                        f"rate_limit:{ip}:{now.strftime('%Y%m%d%H%M')}",
+                        f"rate_limit:{ip}:{now.strftime('%Y%m%d%H')}"
+                    ],
+                    args=[60, 3600]
+                )
+                if blocked:
+                    return True, True
+                return False, minute_count <= limit_per_minute and hour_count <= limit_per_hour
                 
             except Exception as e:
                 logger.warning(f"Redis rate limiting failed: {e}")
         
-        # Fallback en mémoire
-        requests = self.ip_requests[ip]
-        
-        # Nettoyer les anciennes requêtes
-        cutoff = now - timedelta(hours=1)
-        while requests and requests[0] < cutoff:
-            requests.popleft()
-        
-        # Ajouter la requête actuelle
-        requests.append(now)
-        
-        # Compter les requêtes par minute et par heure
-        minute_ago = now - timedelta(minutes=1)
-        minute_requests = sum(1 for req_time in requests if req_time > minute_ago)
-        hour_requests = len(requests)
-        
-        return minute_requests <= limit_per_minute and hour_requests <= limit_per_hour
+        return False, self._check_rate_limit_in_memory(ip, limit_per_minute, limit_per_hour)
+    
+    def _check_rate_limit_in_memory(self, ip: str, limit_per_minute: int, limit_per_hour: int) -> bool:
+        """Fallback en mémoire (instance unique)"""
+        return self.rate_limiter.hit(ip, limit_per_minute, limit_per_hour)
     
     async def _block_ip_temporarily(self, ip: str, minutes: int):
         """Bloquer temporairement une IP"""
@@ -213,7 +314,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         
         if REDIS_AVAILABLE:
             try:
-                redis_client.setex(f"blocked_ip:{ip}", minutes * 60, "1")
+                await async_redis_client.setex(f"blocked_ip:{ip}", minutes * 60, "1")
             except:
                 pass
         
@@ -252,10 +353,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
     
     def _contains_suspicious_patterns(self, text: str) -> bool:
         """Détecter les patterns suspects (injections SQL, XSS, etc.)"""
-        for pattern in self.compiled_patterns:
-            if pattern.search(text):
-                return True
-        return False
+        return self.pattern_scanner.first_match(text) is not None
     
     async def _log_request(self, request: Request, response: Response, process_time: float, client_ip: str):
         """Log des requêtes pour monitoring"""
@@ -273,8 +371,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         # Log en base si nécessaire (pour analytics)
         if REDIS_AVAILABLE and process_time > 2.0:  # Log des requêtes lentes
             try:
-                redis_client.lpush("slow_requests", json.dumps(log_data))
-                redis_client.ltrim("slow_requests", 0, 999)  # Garder les 1000 dernières
+                await self._push_capped("slow_requests", json.dumps(log_data), 1000)  # Garder les 1000 dernières
             except:
                 pass
     
@@ -294,55 +391,224 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         
         if REDIS_AVAILABLE:
             try:
-                redis_client.lpush("security_events", json.dumps(security_event))
-                redis_client.ltrim("security_events", 0, 4999)  # Garder les 5000 derniers
+                await self._push_capped("security_events", json.dumps(security_event), 5000)  # Garder les 5000 derniers
             except:
                 pass
+    
+    async def _push_capped(self, key: str, value: str, max_length: int):
+        """LPUSH + LTRIM en un seul aller-retour"""
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, value)
+            pipe.ltrim(key, 0, max_length - 1)
+            await pipe.execute()
+
+# Configuration du cache de réponses HTTP (mémoire locale)
+CACHE_CONFIG = {
+    "max_bytes": int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    "max_entry_bytes": 1024 * 1024,     # Réponses plus grosses: transmises sans cache
+    "stale_while_revalidate": 60,       # Secondes servies périmées pendant le rafraîchissement
+    "tracking_params": ["utm_", "gclid", "fbclid", "msclkid"]
+}
+
+
+class CachedResponse:
+    """Réponse mise en cache (corps complet + en-têtes bruts)"""
+    __slots__ = ("body", "status_code", "raw_headers", "etag", "stored_at", "ttl", "size", "tags")
+
+    def __init__(self, body: bytes, status_code: int, raw_headers: list, ttl: int, tags: frozenset = frozenset()):
+        self.body = body
+        self.status_code = status_code
+        self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.raw_headers = raw_headers + [(b"etag", self.etag.encode("latin-1"))]
+        self.stored_at = time.monotonic()
+        self.ttl = ttl
+        self.tags = tags
+        self.size = len(body) + sum(len(k) + len(v) for k, v in self.raw_headers) + 200
+
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+class ResponseCache:
+    """Cache LRU borné en octets, entrées indexées par tags pour l'invalidation"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.tag_index: Dict[str, set] = defaultdict(set)
+        self.total_bytes = 0
+        # Incrémenté à chaque invalidation: une réponse calculée avant ne doit pas être stockée
+        self.generation = 0
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CachedResponse, generation: Optional[int] = None) -> bool:
+        """Stocker une entrée. False si une invalidation a eu lieu depuis `generation`."""
+        if generation is not None and generation != self.generation:
+            return False
+        self.delete(key)
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        for tag in entry.tags:
+            self.tag_index[tag].add(key)
+        while self.total_bytes > self.max_bytes and self.entries:
+            self.delete(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+        return True
+
+    def delete(self, key: str) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry.size
+        for tag in entry.tags:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+        return True
+
+    def clear(self, pattern: str = "*") -> int:
+        self.generation += 1
+        keys = [key for key in self.entries if fnmatch.fnmatchcase(key, pattern)]
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    def invalidate(self, tags: List[str], pattern: Optional[str] = None) -> int:
+        """Supprimer les entrées portant un des tags (et/ou dont la clé correspond au pattern)"""
+        self.generation += 1
+        self.stats["invalidations"] += 1
+        keys = set()
+        for tag in tags:
+            keys.update(self.tag_index.get(tag, ()))
+        removed = sum(self.delete(key) for key in keys)
+        if pattern:
+            removed += self.clear(pattern)
+        return removed
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats, "entries": len(self.entries), "tags": len(self.tag_index),
+            "bytes": self.total_bytes, "max_bytes": self.max_bytes
+        }
+
+
+# Cache partagé par toutes les instances du middleware, invalidé via le bus (tags ou clear_cache)
+response_cache = ResponseCache(CACHE_CONFIG["max_bytes"])
+get_cache_bus().add_listener(response_cache.invalidate)
+
 
 class CacheMiddleware(BaseHTTPMiddleware):
     """Middleware de cache intelligent pour améliorer les performances"""
     
-    def __init__(self, app):
+    def __init__(self, app, cache: ResponseCache = None):
         super().__init__(app)
-        self.memory_cache = {}
+        self.cache = cache or response_cache
         self.cache_ttl = {
             "/api/products": 300,  # 5 minutes
             "/api/detect-location": 3600,  # 1 heure
             "/api/company/legal-info": 3600,  # 1 heure
             "/api/crm/dashboard": 60,  # 1 minute
+            "/api/promotions/rules": 300,  # 5 minutes
+            "/api/blog/categories": 600,  # 10 minutes
+            "/api/blog/search": 300,  # 5 minutes
         }
+        # Éléments de requête qui différencient les réponses (None: tous les paramètres hors tracking)
+        # "@ip": réponse propre à l'IP du client
+        self.cache_vary = {
+            # Langue détectée depuis l'IP quand "language" est absent (ou FR): voir server.py
+            "/api/products/translated": ["customer_type", "language", "@ip"],
+            "/api/products": ["customer_type", "lang", "language"],
+            "/api/detect-location": ["@ip"],
+            "/api/company/legal-info": [],
+            "/api/crm/dashboard": None,
+        }
+        # Tags posés sur les réponses, publiés par les écritures (admin_upload, promotions, blog)
+        self.cache_tags = [
+            (re.compile(r"^/api/products/(?P<id>[^/]+)"), "product:{id}"),
+            (re.compile(r"^/api/products"), "products"),
+            (re.compile(r"^/api/blog/articles/(?P<slug>[^/]+)"), "blog:{slug}"),
+            (re.compile(r"^/api/blog"), "blog"),
+            (re.compile(r"^/api/promotions"), "promotions"),
+        ]
+        self._revalidating = set()
     
     async def dispatch(self, request: Request, call_next) -> Response:
         # Only cache GET requests
         if request.method != "GET":
             return await call_next(request)
         
-        cache_key = self._get_cache_key(request)
         ttl = self._get_ttl(request.url.path)
         
         if ttl == 0:  # No caching
             return await call_next(request)
         
+        cache_key = self._get_cache_key(request)
+        
         # Check cache
-        cached_response = await self._get_from_cache(cache_key)
-        if cached_response:
-            logger.debug(f"Cache hit: {cache_key}")
-            return cached_response
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            age = entry.age()
+            if age < entry.ttl:
+                self.cache.stats["hits"] += 1
+                return self._cached_response(request, entry, "HIT")
+            if age < entry.ttl + CACHE_CONFIG["stale_while_revalidate"]:
+                # Servir la version périmée et rafraîchir en arrière-plan
+                self.cache.stats["stale_hits"] += 1
+                if cache_key not in self._revalidating:
+                    self._revalidating.add(cache_key)
+                    asyncio.create_task(self._revalidate(request.scope, cache_key, ttl))
+                return self._cached_response(request, entry, "STALE")
+        
+        self.cache.stats["misses"] += 1
+        generation = self.cache.generation
         
         # Execute request
         response = await call_next(request)
         
         # Cache successful responses
-        if response.status_code == 200:
-            await self._store_in_cache(cache_key, response, ttl)
+        if not self._is_cacheable(response.status_code, response.headers):
+            return response
         
-        return response
+        return await self._store_in_cache(request, cache_key, response, ttl, generation)
+    
+    def _get_client_ip(self, request: Request) -> str:
+        forwarded_for = request.headers.get("X-Forwarded-For")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+        return request.headers.get("X-Real-IP") or (request.client.host if request.client else "unknown")
     
     def _get_cache_key(self, request: Request) -> str:
-        """Générer une clé de cache unique"""
+        """Clé de cache: chemin + paramètres pertinents (ordre normalisé) + identité si nécessaire"""
         path = request.url.path
-        query = request.url.query
-        return f"cache:{hashlib.md5(f'{path}?{query}'.encode()).hexdigest()}"
+        vary = self._get_vary(path)
+        
+        if vary is None:
+            params = sorted(
+                (key, value) for key, value in request.query_params.multi_items()
+                if not any(key.startswith(prefix) for prefix in CACHE_CONFIG["tracking_params"])
+            )
+        else:
+            params = sorted(
+                (key, value) for key, value in request.query_params.multi_items() if key in vary
+            )
+            if "@ip" in vary:
+                params.append(("@ip", self._get_client_ip(request)))
+        
+        key = f"cache:{path}?{urlencode(params)}"
+        
+        # Réponses authentifiées: jamais partagées entre utilisateurs
+        authorization = request.headers.get("authorization")
+        if authorization:
+            key += f"|auth:{hashlib.sha256(authorization.encode()).hexdigest()[:16]}"
+        return key
     
     def _get_ttl(self, path: str) -> int:
         """Obtenir le TTL pour un path donné"""
@@ -351,76 +617,123 @@ class CacheMiddleware(BaseHTTPMiddleware):
                 return ttl
         return 0  # No cache by default
     
-    async def _get_from_cache(self, key: str) -> Optional[Response]:
-        """Récupérer du cache"""
-        if REDIS_AVAILABLE:
-            try:
-                cached_data = redis_client.get(key)
-                if cached_data:
-                    data = json.loads(cached_data)
-                    return Response(
-                        content=data["content"],
-                        status_code=data["status_code"],
-                        headers={**data["headers"], "X-Cache": "HIT"},
-                        media_type=data.get("media_type")
-                    )
-            except Exception as e:
-                logger.warning(f"Redis cache get failed: {e}")
-        
-        # Fallback to memory cache
-        if key in self.memory_cache:
-            cached_data, expiry = self.memory_cache[key]
-            if datetime.now() < expiry:
-                data = json.loads(cached_data)
-                return Response(
-                    content=data["content"],
-                    status_code=data["status_code"],
-                    headers={**data["headers"], "X-Cache": "HIT-MEMORY"},
-                    media_type=data.get("media_type")
-                )
-            else:
-                del self.memory_cache[key]
-        
+    def _get_vary(self, path: str) -> Optional[List[str]]:
+        for cached_path, vary in self.cache_vary.items():
+            if path.startswith(cached_path):
+                return vary
         return None
     
-    async def _store_in_cache(self, key: str, response: Response, ttl: int):
-        """Stocker en cache"""
+    def _get_tags(self, path: str) -> frozenset:
+        tags = set()
+        for regex, template in self.cache_tags:
+            match = regex.match(path)
+            if match:
+                tags.add(template.format(**match.groupdict()))
+        return frozenset(tags)
+    
+    def _is_cacheable(self, status_code: int, headers) -> bool:
+        if status_code != 200 or "set-cookie" in headers:
+            return False
+        cache_control = headers.get("cache-control", "")
+        return "no-store" not in cache_control and "private" not in cache_control
+    
+    def _cached_response(self, request: Request, entry: CachedResponse, cache_status: str) -> Response:
+        """Réponse depuis le cache, ou 304 si le client possède déjà cette version"""
+        if self._etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.cache.stats["not_modified"] += 1
+            response = Response(status_code=304)
+            response.headers["ETag"] = entry.etag
+        else:
+            response = Response(content=entry.body, status_code=entry.status_code)
+            response.raw_headers = list(entry.raw_headers)
+        response.headers["X-Cache"] = cache_status
+        response.headers["Age"] = str(int(entry.age()))
+        return response
+    
+    @staticmethod
+    def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+    
+    async def _store_in_cache(self, request: Request, key: str, response: Response, ttl: int, generation: int) -> Response:
+        """Capturer le corps, le mettre en cache et le retransmettre au client"""
+        chunks = []
+        size = 0
+        body_iterator = response.body_iterator
+        async for chunk in body_iterator:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(response.charset)
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > CACHE_CONFIG["max_entry_bytes"]:
+                # Trop gros pour le cache: retransmettre la suite en streaming
+                async def forward():
+                    for captured in chunks:
+                        yield captured
+                    async for rest in body_iterator:
+                        yield rest
+                
+                streamed = StreamingResponse(forward(), status_code=response.status_code, background=response.background)
+                streamed.raw_headers = list(response.raw_headers)
+                return streamed
+        
+        body = b"".join(chunks)
+        raw_headers = [
+            (name, value) for name, value in response.raw_headers
+            if name.lower() not in (b"etag", b"x-cache", b"age")
+        ]
+        entry = CachedResponse(body, response.status_code, raw_headers, ttl, self._get_tags(request.url.path))
+        self.cache.set(key, entry, generation)
+        
+        fresh = self._cached_response(request, entry, "MISS")
+        fresh.background = response.background
+        return fresh
+    
+    async def _revalidate(self, scope: dict, key: str, ttl: int):
+        """Rejouer la requête GET sur l'application pour rafraîchir une entrée périmée"""
+        start = {}
+        chunks = []
+        request_sent = False
+        
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Aucune déconnexion à signaler: attendre l'annulation par l'application
+            await asyncio.Event().wait()
+        
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+        
+        generation = self.cache.generation
         try:
-            # Read response body
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-            
-            cache_data = {
-                "content": response_body.decode("utf-8"),
-                "status_code": response.status_code,
-                "headers": dict(response.headers),
-                "media_type": response.media_type
-            }
-            
-            cache_json = json.dumps(cache_data)
-            
-            if REDIS_AVAILABLE:
-                try:
-                    redis_client.setex(key, ttl, cache_json)
-                except Exception as e:
-                    logger.warning(f"Redis cache set failed: {e}")
-            
-            # Fallback to memory cache
-            expiry = datetime.now() + timedelta(seconds=ttl)
-            self.memory_cache[key] = (cache_json, expiry)
-            
-            # Recreate response with cached body
-            return Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers={**response.headers, "X-Cache": "MISS"},
-                media_type=response.media_type
-            )
+            revalidation_scope = dict(scope)
+            revalidation_scope["headers"] = [
+                (name, value) for name, value in scope["headers"] if name.lower() != b"if-none-match"
+            ]
+            await self.app(revalidation_scope, receive, send)
             
+            raw_headers = [
+                (name, value) for name, value in start.get("headers", [])
+                if name.lower() not in (b"etag", b"x-cache", b"age")
+            ]
+            headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in raw_headers}
+            body = b"".join(chunks)
+            if self._is_cacheable(start.get("status", 500), headers) and len(body) <= CACHE_CONFIG["max_entry_bytes"]:
+                tags = self._get_tags(scope["path"])
+                self.cache.set(key, CachedResponse(body, start["status"], raw_headers, ttl, tags), generation)
         except Exception as e:
-            logger.error(f"Cache store error: {e}")
-            return response
+            logger.warning(f"Cache revalidation failed for {key}: {e}")
+        finally:
+            self._revalidating.discard(key)
 
 # Fonctions utilitaires
 def get_security_stats() -> Dict:
@@ -429,7 +742,9 @@ def get_security_stats() -> Dict:
         "blocked_ips_count": len(SECURITY_CONFIG["blocked_ips"]),
         "redis_available": REDIS_AVAILABLE,
         "security_events_24h": 0,
-        "slow_requests_24h": 0
+        "slow_requests_24h": 0,
+        "response_cache": response_cache.get_stats(),
+        "cache_invalidation": get_cache_bus().get_stats()
     }
     
     if REDIS_AVAILABLE:
@@ -469,16 +784,26 @@ def get_security_stats() -> Dict:
     
     return stats
 
+async def close_redis():
+    """Fermer le pool de connexions Redis asynchrone (arrêt de l'application)"""
+    await async_redis_client.aclose()
+
 async def clear_cache(pattern: str = "*"):
-    """Nettoyer le cache"""
-    cleared = 0
+    """Nettoyer le cache (tous les workers via le bus d'invalidation)"""
+    cleared = await get_cache_bus().publish(pattern=f"cache:{pattern}")
     
     if REDIS_AVAILABLE:
+        # Anciennes entrées Redis: SCAN par lots plutôt que KEYS (non bloquant pour Redis)
         try:
-            keys = redis_client.keys(f"cache:{pattern}")
-            if keys:
-                cleared = redis_client.delete(*keys)
+            batch = []
+            async for key in async_redis_client.scan_iter(match=f"cache:{pattern}", count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    cleared += await async_redis_client.delete(*batch)
+                    batch = []
+            if batch:
+                cleared += await async_redis_client.delete(*batch)
         except Exception as e:
             logger.error(f"Redis cache clear error: {e}")
     
-    return {"cleared_keys": cleared, "redis_available": REDIS_AVAILABLE}
\ No newline at end of file
+    return {"cleared_keys": cleared, "redis_available": REDIS_AVAILABLE}
@@ -11,7 +11,7 @@ from typing import List, Optional, Dict, Any
 from enum import Enum
 
 from fastapi import HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient
+from mongo_provider import get_mongo_provider
 from pydantic import BaseModel, Field, validator
 
 # Configuration
@@ -55,7 +55,7 @@ class TestimonialsManager:
     async def initialize(self):
         """Initialiser la connexion MongoDB"""
         if not self.client:
-            self.client = AsyncIOMotorClient(MONGO_URL)
+            self.client = get_mongo_provider().client
             self.db = self.client[DB_NAME]
             
     async def submit_testimonial(self, testimonial_data: CustomerTestimonial) -> dict:
@@ -0,0 +1,115 @@
+"""
+Josmoze.com - Cache des jetons JWT vérifiés
+Un rendu du dashboard CRM déclenche des dizaines d'appels API avec le même
+jeton: la signature est vérifiée et l'utilisateur résolu une seule fois, puis
+le résultat est servi depuis un LRU borné, indexé par l'empreinte du jeton.
+
+Une entrée expire au plus tôt entre le TTL du cache et le champ `exp` du
+jeton. Les écritures sur un compte publient "user:<email>" sur le bus
+d'invalidation pour retirer ses jetons immédiatement.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_invalidation import get_cache_bus
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_CONFIG = {
+    "ttl": float(os.environ.get("JWT_CACHE_TTL", "60")),          # Secondes
+    "max_size": int(os.environ.get("JWT_CACHE_SIZE", "10000"))
+}
+
+
+def token_digest(token: str) -> str:
+    """Le jeton lui-même n'est jamais gardé en mémoire comme clé"""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class VerifiedTokenCache:
+    """LRU jeton vérifié -> utilisateur authentifié"""
+
+    def __init__(self, ttl: float = TOKEN_CACHE_CONFIG["ttl"], max_size: int = TOKEN_CACHE_CONFIG["max_size"]):
+        self.ttl = ttl
+        self.max_size = max_size
+        # empreinte -> (expiration monotonic, sujet, utilisateur)
+        self.entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidated": 0}
+
+    def get(self, token: str) -> Optional[Any]:
+        key = token_digest(token)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, _, principal = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return principal
+
+    def set(self, token: str, subject: str, principal: Any, exp: Optional[float] = None):
+        """Mémoriser un jeton vérifié (exp: timestamp epoch du champ `exp` du JWT)"""
+        ttl = self.ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        key = token_digest(token)
+        self.entries[key] = (time.monotonic() + ttl, subject.lower(), principal)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate_subject(self, subject: str) -> int:
+        subject = subject.lower()
+        keys = [key for key, (_, entry_subject, _) in self.entries.items() if entry_subject == subject]
+        for key in keys:
+            del self.entries[key]
+        self.stats["invalidated"] += len(keys)
+        return len(keys)
+
+    def on_invalidation(self, tags: List[str], pattern: Optional[str]) -> int:
+        """Listener du bus d'invalidation: tags "user:<email>" """
+        removed = 0
+        for tag in tags:
+            if tag.startswith("user:"):
+                removed += self.invalidate_subject(tag[len("user:"):])
+        return removed
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+
+# ========== INSTANCES GLOBALES ==========
+
+# Un cache par pile d'authentification (CRM et espace client): les sujets diffèrent
+token_caches: Dict[str, VerifiedTokenCache] = {}
+
+def get_token_cache(name: str) -> VerifiedTokenCache:
+    """Obtenir le cache de jetons vérifiés d'une pile d'authentification"""
+    cache = token_caches.get(name)
+    if cache is None:
+        cache = token_caches[name] = VerifiedTokenCache()
+        get_cache_bus().add_listener(cache.on_invalidation)
+    return cache
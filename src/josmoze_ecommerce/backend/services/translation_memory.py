@@ -0,0 +1,171 @@
+"""
+Mémoire de traduction persistante
+Les traductions DeepL sont stockées dans MongoDB (collection translation_memory),
+indexées par une empreinte stable de (langue source, langue cible, texte): elles
+survivent aux redémarrages et sont partagées entre workers. Un LRU borné en
+mémoire sert les textes fréquents sans aller-retour MongoDB.
+"""
+
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from buffered_writer import BufferedBulkWriter
+
+logger = logging.getLogger(__name__)
+
+TRANSLATION_MEMORY_CONFIG = {
+    "max_size": int(os.environ.get("TRANSLATION_CACHE_SIZE", "5000")),   # Entrées gardées en mémoire
+    "warm_up_limit": int(os.environ.get("TRANSLATION_WARM_UP_LIMIT", "5000")),
+    "collection": "translation_memory"
+}
+
+
+def translation_key(source_language: str, target_language: str, text: str) -> str:
+    """Empreinte stable (contrairement à hash(), randomisé par processus)"""
+    payload = f"{source_language.upper()}\x1f{target_language.upper()}\x1f{text}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """LRU en mémoire devant un stockage MongoDB"""
+
+    def __init__(self, max_size: int = TRANSLATION_MEMORY_CONFIG["max_size"]):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.collection = None
+        self.writer: Optional[BufferedBulkWriter] = None
+        self.stats = {"hits": 0, "store_hits": 0, "misses": 0, "stored": 0, "evictions": 0, "store_errors": 0}
+
+    async def attach(self, db, warm_up: bool = True) -> int:
+        """Brancher le stockage MongoDB et précharger les traductions les plus récentes"""
+        self.collection = db[TRANSLATION_MEMORY_CONFIG["collection"]]
+        self.writer = BufferedBulkWriter(self.collection, batch_size=200, flush_interval=2.0)
+        try:
+            await self.collection.create_index("updated_at")
+        except Exception as e:
+            logger.warning(f"Translation memory index creation failed: {e}")
+        return await self.warm_up() if warm_up else 0
+
+    async def warm_up(self, limit: int = TRANSLATION_MEMORY_CONFIG["warm_up_limit"]) -> int:
+        if self.collection is None:
+            return 0
+        limit = min(limit, self.max_size)
+        loaded = 0
+        try:
+            cursor = self.collection.find({}, {"translated_text": 1}).sort("updated_at", -1).limit(limit)
+            documents = await cursor.to_list(length=limit)
+            # Du plus ancien au plus récent: les plus récents finissent en tête du LRU
+            for document in reversed(documents):
+                self._remember(document["_id"], document["translated_text"])
+                loaded += 1
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            logger.error(f"Translation memory warm-up failed: {e}")
+        logger.info(f"Translation memory warmed up with {loaded} entries")
+        return loaded
+
+    def _remember(self, key: str, translated_text: str):
+        self.entries[key] = translated_text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get(self, source_language: str, target_language: str, text: str) -> Optional[str]:
+        key = translation_key(source_language, target_language, text)
+        translated_text = self.entries.get(key)
+        if translated_text is not None:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return translated_text
+
+        if self.collection is not None:
+            try:
+                document = await self.collection.find_one({"_id": key}, {"translated_text": 1})
+            except Exception as e:
+                self.stats["store_errors"] += 1
+                logger.warning(f"Translation memory lookup failed: {e}")
+                document = None
+            if document is not None:
+                self.stats["store_hits"] += 1
+                self._remember(key, document["translated_text"])
+                return document["translated_text"]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def get_many(self, source_language: str, target_language: str, texts: List[str]) -> Dict[str, str]:
+        """Traductions connues pour plusieurs textes: {texte: traduction}, une requête MongoDB au plus"""
+        found: Dict[str, str] = {}
+        missing: Dict[str, str] = {}
+        for text in texts:
+            key = translation_key(source_language, target_language, text)
+            translated_text = self.entries.get(key)
+            if translated_text is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                found[text] = translated_text
+            else:
+                missing[key] = text
+
+        if missing and self.collection is not None:
+            try:
+                cursor = self.collection.find({"_id": {"$in": list(missing)}}, {"translated_text": 1})
+                async for document in cursor:
+                    self.stats["store_hits"] += 1
+                    self._remember(document["_id"], document["translated_text"])
+                    found[missing.pop(document["_id"])] = document["translated_text"]
+            except Exception as e:
+                self.stats["store_errors"] += 1
+                logger.warning(f"Translation memory lookup failed: {e}")
+
+        self.stats["misses"] += len(missing)
+        return found
+
+    async def set(self, source_language: str, target_language: str, text: str, translated_text: str,
+                  persist: bool = True):
+        """Mémoriser une traduction (persist=False: mémoire du processus seulement)"""
+        key = translation_key(source_language, target_language, text)
+        self._remember(key, translated_text)
+        if not persist or self.writer is None:
+            return
+        now = datetime.utcnow()
+        await self.writer.add(UpdateOne(
+            {"_id": key},
+            {
+                "$set": {"translated_text": translated_text, "updated_at": now},
+                "$setOnInsert": {
+                    "source_language": source_language.upper(),
+                    "target_language": target_language.upper(),
+                    "text": text,
+                    "created_at": now
+                }
+            },
+            upsert=True
+        ))
+        self.stats["stored"] += 1
+
+    def clear(self):
+        """Vider le LRU du processus (le stockage MongoDB est conservé)"""
+        self.entries.clear()
+
+    async def close(self):
+        if self.writer is not None:
+            await self.writer.close()
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["store_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "cache_size": len(self.entries),
+            "max_size": self.max_size,
+            "hit_rate": round((self.stats["hits"] + self.stats["store_hits"]) / lookups, 4) if lookups else 0.0,
+            "persistent": self.collection is not None,
+            "pending_writes": self.writer.get_stats()["pending"] if self.writer else 0
+        }
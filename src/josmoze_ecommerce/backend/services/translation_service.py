@@ -16,6 +16,9 @@ import requests
 from functools import lru_cache
 from dotenv import load_dotenv
 
+from translation_memory import TranslationMemory
+from cache_invalidation import invalidate_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -198,12 +201,25 @@ AVAILABLE_LANGUAGES = {
     "PL": {"name": "Polski", "native_name": "Polski", "flag": "🇵🇱"},
 }
 
+# Requêtes DeepL groupées (DeepL accepte jusqu'à 50 textes par requête)
+TRANSLATION_BATCH_CONFIG = {
+    "batch_size": int(os.getenv("DEEPL_BATCH_SIZE", "50")),
+    "max_concurrency": int(os.getenv("DEEPL_MAX_CONCURRENCY", "4"))
+}
+
 class TranslationService:
     def __init__(self):
         self.translator = translator
-        self.cache = {}
+        self.cache = TranslationMemory()
         self.setup_logging()
 
+    async def attach_memory(self, db) -> int:
+        """
+        Branche la mémoire de traduction persistante (MongoDB) et la préchauffe
+        À appeler au démarrage de l'application
+        """
+        return await self.cache.attach(db)
+
     def setup_logging(self):
         """Configure logging pour le service de traduction"""
         logging.basicConfig(level=logging.INFO)
@@ -278,94 +294,151 @@ class TranslationService:
         if not text or type(text) != str:
             return text
 
+        translations = await self.translate_many([text], target_language, source_language)
+        return translations.get(text, text)
+
+    async def translate_many(self, texts: List[str], target_language: str, source_language: str = "FR") -> Dict[str, str]:
+        """
+        Traduit un ensemble de textes en un minimum d'appels DeepL
+        Textes dédupliqués, traductions prédéfinies et mémoire consultées d'abord,
+        puis requêtes DeepL multi-textes (par lots, concurrence limitée)
+        Retourne {texte original: texte traduit}
+        """
+        unique_texts = list(dict.fromkeys(text for text in texts if text and isinstance(text, str)))
         if target_language == source_language:
-            return text
+            return {text: text for text in unique_texts}
 
-        # Clé de cache
-        cache_key = f"{source_language}:{target_language}:{hash(text)}"
-        
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        translations = {}
+        pending = []
+        predefined = PRODUCT_TRANSLATIONS.get(target_language, {})
+        for text in unique_texts:
+            if text.strip() in predefined:
+                translations[text] = predefined[text.strip()]
+            else:
+                pending.append(text)
+
+        # Mémoire de traduction (LRU + MongoDB, une seule requête pour les absents du LRU)
+        if pending:
+            cached = await self.cache.get_many(source_language, target_language, pending)
+            translations.update(cached)
+            pending = [text for text in pending if text not in cached]
 
-        # Vérifier d'abord les traductions prédéfinies
-        if target_language in PRODUCT_TRANSLATIONS and text.strip() in PRODUCT_TRANSLATIONS[target_language]:
-            translated_text = PRODUCT_TRANSLATIONS[target_language][text.strip()]
-            self.cache[cache_key] = translated_text
-            self.logger.info(f"Traduction prédéfinie utilisée: {text} -> {translated_text}")
-            return translated_text
+        if not pending:
+            return translations
 
-        # Essayer DeepL si disponible
         if not self.translator:
             self.logger.error("DeepL translator not initialized - API key missing")
-            return text
+            translations.update({text: text for text in pending})
+            return translations
 
-        try:
-            result = await asyncio.to_thread(
-                self.translator.translate_text,
-                text,
-                source_lang=source_language,
-                target_lang=target_language
-            )
-            
-            translated_text = result.text
-            self.cache[cache_key] = translated_text
-            
-            self.logger.info(f"Traduction DeepL: {source_language} -> {target_language}")
-            return translated_text
+        batch_size = TRANSLATION_BATCH_CONFIG["batch_size"]
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        semaphore = asyncio.Semaphore(TRANSLATION_BATCH_CONFIG["max_concurrency"])
+
+        async def translate_batch(batch: List[str]):
+            async with semaphore:
+                try:
+                    results = await asyncio.to_thread(
+                        self.translator.translate_text,
+                        batch,
+                        source_lang=source_language,
+                        target_lang=target_language
+                    )
+                except Exception as e:
+                    for text in batch:
+                        translations[text] = await self._fallback_translation(e, text, target_language, source_language)
+                    return
+
+            for text, result in zip(batch, results):
+                translations[text] = result.text
+                await self.cache.set(source_language, target_language, text, result.text)
+
+        await asyncio.gather(*(translate_batch(batch) for batch in batches))
+        self.logger.info(
+            f"Traduction DeepL: {source_language} -> {target_language} "
+            f"({len(pending)} textes, {len(batches)} requête(s))"
+        )
+        return translations
+
+    async def _fallback_translation(self, error: Exception, text: str, target_language: str, source_language: str) -> str:
+        """
+        Traduction de secours quand DeepL échoue
+        """
+        error_msg = str(error).lower()
+        if "too many requests" in error_msg or "429" in error_msg or "high load" in error_msg:
+            self.logger.warning(f"DeepL rate limited, tentative traduction prédéfinie pour: {text}")
             
-        except Exception as e:
-            error_msg = str(e).lower()
-            if "too many requests" in error_msg or "429" in error_msg or "high load" in error_msg:
-                self.logger.warning(f"DeepL rate limited, tentative traduction prédéfinie pour: {text}")
-                
-                # Fallback vers traductions prédéfinies si DeepL est surchargé
-                if target_language in PRODUCT_TRANSLATIONS:
-                    # Recherche approximative dans les traductions prédéfinies
-                    for french_text, translated_text in PRODUCT_TRANSLATIONS[target_language].items():
-                        if french_text.lower() in text.lower() or text.lower() in french_text.lower():
-                            self.cache[cache_key] = translated_text
-                            self.logger.info(f"Traduction fallback utilisée: {text} -> {translated_text}")
-                            return translated_text
-                
-                self.logger.warning(f"Aucune traduction fallback trouvée pour: {text}")
-            else:
-                self.logger.error(f"Erreur traduction DeepL: {str(e)}")
+            # Fallback vers traductions prédéfinies si DeepL est surchargé
+            if target_language in PRODUCT_TRANSLATIONS:
+                # Recherche approximative dans les traductions prédéfinies
+                for french_text, translated_text in PRODUCT_TRANSLATIONS[target_language].items():
+                    if french_text.lower() in text.lower() or text.lower() in french_text.lower():
+                        # Approximation: gardée pour ce processus seulement, DeepL sera retenté après redémarrage
+                        await self.cache.set(source_language, target_language, text, translated_text, persist=False)
+                        self.logger.info(f"Traduction fallback utilisée: {text} -> {translated_text}")
+                        return translated_text
             
-            return text  # Retourner le texte original en cas d'erreur
+            self.logger.warning(f"Aucune traduction fallback trouvée pour: {text}")
+        else:
+            self.logger.error(f"Erreur traduction DeepL: {str(error)}")
+        
+        return text  # Retourner le texte original en cas d'erreur
 
-    async def translate_object(self, obj: Dict, target_language: str, source_language: str = "FR") -> Dict:
+    def _map_strings(self, obj: Dict, transform) -> Dict:
         """
-        Traduit récursivement un objet/dictionnaire
-        Traduit seulement les valeurs string, préserve la structure
+        Applique transform aux valeurs string d'un objet, en préservant la structure
         """
-        if not isinstance(obj, dict):
-            return obj
-
-        translated_obj = {}
-        
+        mapped = {}
         for key, value in obj.items():
             if isinstance(value, str):
-                # Traduire les valeurs string
-                translated_obj[key] = await self.translate_text(value, target_language, source_language)
+                mapped[key] = transform(value)
             elif isinstance(value, dict):
                 # Récursion pour les objets imbriqués
-                translated_obj[key] = await self.translate_object(value, target_language, source_language)
+                mapped[key] = self._map_strings(value, transform)
             elif isinstance(value, list):
-                # Traiter les listes
-                translated_list = []
-                for item in value:
-                    if isinstance(item, str):
-                        translated_list.append(await self.translate_text(item, target_language, source_language))
-                    elif isinstance(item, dict):
-                        translated_list.append(await self.translate_object(item, target_language, source_language))
-                    else:
-                        translated_list.append(item)
-                translated_obj[key] = translated_list
+                # Traiter les listes (strings et objets)
+                mapped[key] = [
+                    transform(item) if isinstance(item, str)
+                    else self._map_strings(item, transform) if isinstance(item, dict)
+                    else item
+                    for item in value
+                ]
             else:
                 # Préserver les autres types (nombres, booléens, etc.)
-                translated_obj[key] = value
+                mapped[key] = value
+        return mapped
+
+    async def translate_objects(self, objects: List[Dict], target_language: str, source_language: str = "FR") -> List[Dict]:
+        """
+        Traduit une liste d'objets en deux phases:
+        1. collecte des textes de tous les objets
+        2. traduction groupée (translate_many) puis reconstruction des objets
+        """
+        texts = []
+
+        def collect(text: str) -> str:
+            texts.append(text)
+            return text
+
+        for obj in objects:
+            if isinstance(obj, dict):
+                self._map_strings(obj, collect)
 
-        return translated_obj
+        translations = await self.translate_many(texts, target_language, source_language)
+        return [
+            self._map_strings(obj, lambda text: translations.get(text, text)) if isinstance(obj, dict) else obj
+            for obj in objects
+        ]
+
+    async def translate_object(self, obj: Dict, target_language: str, source_language: str = "FR") -> Dict:
+        """
+        Traduit récursivement un objet/dictionnaire
+        Traduit seulement les valeurs string, préserve la structure
+        """
+        if not isinstance(obj, dict):
+            return obj
+
+        return (await self.translate_objects([obj], target_language, source_language))[0]
 
     def get_available_languages(self) -> Dict[str, Dict[str, str]]:
         """
@@ -382,32 +455,35 @@ class TranslationService:
     async def translate_product_list(self, products: List[Dict], target_language: str) -> List[Dict]:
         """
         Traduit une liste de produits
-        Optimisé pour les données e-commerce
+        Optimisé pour les données e-commerce: un seul passage DeepL pour tout le catalogue
         """
-        translated_products = []
-        
-        for product in products:
-            translated_product = await self.translate_object(product, target_language)
-            translated_products.append(translated_product)
-        
-        return translated_products
+        return await self.translate_objects(products, target_language)
 
     def clear_cache(self):
         """
-        Vide le cache de traductions
-        Utile pour les mises à jour ou tests
+        Vide le cache de traductions en mémoire
+        La mémoire persistante (MongoDB) est conservée
         """
         self.cache.clear()
         self.logger.info("Cache de traduction vidé")
 
+        # Catalogues traduits précalculés: à reconstruire
+        try:
+            asyncio.get_running_loop().create_task(invalidate_cache("translations"))
+        except RuntimeError:
+            pass  # Hors boucle asyncio (scripts): rien à diffuser
+
     def get_cache_stats(self) -> Dict[str, int]:
         """
-        Retourne les statistiques du cache
+        Retourne les statistiques du cache (hits mémoire, hits MongoDB, misses)
+        """
+        return self.cache.get_stats()
+
+    async def close(self):
+        """
+        Écrit les traductions encore en attente (arrêt de l'application)
         """
-        return {
-            "cache_size": len(self.cache),
-            "max_size": 1000  # Limite arbitraire
-        }
+        await self.cache.close()
 
 # Instance globale du service
 translation_service = TranslationService()
\ No newline at end of file
@@ -21,13 +21,16 @@ import hashlib
 import secrets
 import jwt
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-import bcrypt
+from typing import Dict, List, Optional, Any, Tuple
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel, Field, EmailStr, validator
 import uuid
 import re
 
+from password_hasher import get_password_hasher, PasswordHasherOverloaded
+from token_cache import get_token_cache
+from cache_invalidation import invalidate_cache
+
 logger = logging.getLogger(__name__)
 
 # Configuration JWT
@@ -148,15 +151,13 @@ class UserAuthSystem:
     
     # ========== UTILITAIRES SÉCURITÉ ==========
     
-    def _hash_password(self, password: str) -> str:
-        """Hash sécurisé du mot de passe"""
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed.decode('utf-8')
+    async def _hash_password(self, password: str) -> str:
+        """Hash sécurisé du mot de passe (pool bcrypt, hors boucle asyncio)"""
+        return await get_password_hasher().hash(password)
     
-    def _verify_password(self, password: str, hashed: str) -> bool:
-        """Vérifier mot de passe"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    async def _verify_password(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Vérifier mot de passe -> (valide, nouvelle empreinte si le coût bcrypt a augmenté)"""
+        return await get_password_hasher().verify_and_update(password, hashed)
     
     def _generate_jwt_token(self, user_email: str, user_id: str, remember_me: bool = False) -> str:
         """Générer JWT token"""
@@ -194,7 +195,7 @@ class UserAuthSystem:
                 return {"success": False, "error": "Email déjà utilisé"}
             
             # Hash du mot de passe
-            password_hash = self._hash_password(registration_data.password)
+            password_hash = await self._hash_password(registration_data.password)
             
             # Créer utilisateur
             user_data = {
@@ -236,6 +237,8 @@ class UserAuthSystem:
                 "token": token
             }
             
+        except PasswordHasherOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error registering user: {e}")
             return {"success": False, "error": "Erreur lors de l'inscription"}
@@ -249,17 +252,21 @@ class UserAuthSystem:
                 return {"success": False, "error": "Email ou mot de passe incorrect"}
             
             # Vérifier mot de passe
-            if not self._verify_password(login_data.password, user["password_hash"]):
+            valid, new_password_hash = await self._verify_password(login_data.password, user["password_hash"])
+            if not valid:
                 return {"success": False, "error": "Email ou mot de passe incorrect"}
             
             # Vérifier si compte actif
             if not user.get("is_active", True):
                 return {"success": False, "error": "Compte désactivé"}
             
-            # Mettre à jour dernière connexion
+            # Mettre à jour dernière connexion (et l'empreinte si recalculée)
+            update_fields = {"last_login": datetime.utcnow()}
+            if new_password_hash:
+                update_fields["password_hash"] = new_password_hash
             await self.users_collection.update_one(
                 {"email": login_data.email},
-                {"$set": {"last_login": datetime.utcnow()}}
+                {"$set": update_fields}
             )
             
             # Générer token
@@ -281,12 +288,19 @@ class UserAuthSystem:
                 "token": token
             }
             
+        except PasswordHasherOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error logging in user: {e}")
             return {"success": False, "error": "Erreur lors de la connexion"}
     
     async def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
-        """Vérifier token et récupérer utilisateur"""
+        """Vérifier token et récupérer utilisateur (mis en cache jusqu'à min(TTL, exp))"""
+        token_cache = get_token_cache("customer")
+        cached_user = token_cache.get(token)
+        if cached_user is not None:
+            return cached_user
+        
         try:
             payload = self._verify_jwt_token(token)
             if not payload:
@@ -296,7 +310,7 @@ class UserAuthSystem:
             if not user or not user.get("is_active", True):
                 return None
             
-            return {
+            principal = {
                 "id": user["id"],
                 "email": user["email"],
                 "first_name": user["first_name"],
@@ -304,6 +318,8 @@ class UserAuthSystem:
                 "customer_type": user["customer_type"],
                 "referral_code": user.get("referral_code")
             }
+            token_cache.set(token, user["email"], principal, payload.get("exp"))
+            return principal
             
         except Exception as e:
             logger.error(f"Error verifying token: {e}")
@@ -349,6 +365,8 @@ class UserAuthSystem:
             )
             
             if result.modified_count > 0:
+                # Les jetons en cache portent l'ancien nom
+                await invalidate_cache(f"user:{user_email}")
                 logger.info(f"✅ Profil mis à jour: {user_email}")
                 return {"success": True, "message": "Profil mis à jour"}
             else:
@@ -11,9 +11,11 @@ from typing import List, Optional
 from pathlib import Path
 
 from fastapi import HTTPException, UploadFile, File, Form
-from motor.motor_asyncio import AsyncIOMotorClient
 import aiofiles
 
+from cache_invalidation import invalidate_cache
+from mongo_provider import get_mongo_provider
+
 # Configuration
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "josmoze_production")
@@ -41,7 +43,7 @@ class AdminUploadManager:
     async def initialize(self):
         """Initialiser la connexion MongoDB"""
         if not self.client:
-            self.client = AsyncIOMotorClient(MONGO_URL)
+            self.client = get_mongo_provider().client
             self.db = self.client[DB_NAME]
             
     async def upload_media_file(
@@ -145,6 +147,7 @@ class AdminUploadManager:
                 }
             }
         )
+        await invalidate_cache(f"product:{product_id}", "products")
         
     async def get_media_library(self, media_type: Optional[str] = None, product_id: Optional[str] = None) -> List[dict]:
         """📚 Récupérer la bibliothèque de médias"""
@@ -181,6 +184,9 @@ class AdminUploadManager:
             {"$set": {"status": "deleted", "deleted_date": datetime.now()}}
         )
         
+        if media.get("product_id"):
+            await invalidate_cache(f"product:{media['product_id']}", "products")
+        
         return {"success": True, "message": "Média supprimé avec succès"}
         
     async def update_product_image(self, product_id: str, new_image_url: str) -> dict:
@@ -194,6 +200,8 @@ class AdminUploadManager:
         
         if result.modified_count == 0:
             raise HTTPException(404, "Produit non trouvé")
+        
+        await invalidate_cache(f"product:{product_id}", "products")
             
         return {"success": True, "message": "Image produit mise à jour"}
 
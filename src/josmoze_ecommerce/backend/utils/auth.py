@@ -8,6 +8,9 @@ import os
 from typing import Optional, Dict
 from pydantic import BaseModel
 
+from password_hasher import get_password_hasher
+from token_cache import get_token_cache
+
 # Security configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "josmose_crm_secret_key_2024")
 ALGORITHM = "HS256"
@@ -161,8 +164,8 @@ def get_password_hash(password: str) -> str:
     """Generate password hash"""
     return pwd_context.hash(password)
 
-def authenticate_user(email_or_username: str, password: str) -> Optional[dict]:
-    """Authenticate user credentials - now supports email login"""
+def _find_crm_user(email_or_username: str) -> Optional[dict]:
+    """Find CRM user by email, or by username for backward compatibility"""
     # Try to find user by email first (new primary method)
     user_data = CRM_USERS.get(email_or_username.lower())
     
@@ -173,6 +176,12 @@ def authenticate_user(email_or_username: str, password: str) -> Optional[dict]:
                 user_data = data
                 break
     
+    return user_data
+
+def authenticate_user(email_or_username: str, password: str) -> Optional[dict]:
+    """Authenticate user credentials - now supports email login"""
+    user_data = _find_crm_user(email_or_username)
+    
     if not user_data or not user_data["is_active"]:
         return None
     
@@ -181,6 +190,24 @@ def authenticate_user(email_or_username: str, password: str) -> Optional[dict]:
     
     return user_data
 
+async def authenticate_user_async(email_or_username: str, password: str) -> Optional[dict]:
+    """Authenticate user credentials without blocking the event loop (bcrypt runs in the shared hashing pool).
+    Raises PasswordHasherOverloaded when the pool queue is full."""
+    user_data = _find_crm_user(email_or_username)
+    
+    if not user_data or not user_data["is_active"]:
+        return None
+    
+    valid, new_hash = await get_password_hasher().verify_and_update(password, user_data["password_hash"])
+    if not valid:
+        return None
+    
+    if new_hash:
+        # CRM users are defined in code: the upgraded hash lasts for the process lifetime
+        user_data["password_hash"] = new_hash
+    
+    return user_data
+
 def create_access_token(data: dict) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -190,7 +217,12 @@ def create_access_token(data: dict) -> str:
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Get current authenticated user"""
+    """Get current authenticated user (verified tokens are cached until min(TTL, exp))"""
+    token_cache = get_token_cache("crm")
+    cached_user = token_cache.get(credentials.credentials)
+    if cached_user is not None:
+        return cached_user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -218,7 +250,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if user_data is None or not user_data["is_active"]:
         raise credentials_exception
     
-    return User(
+    user = User(
         id=user_data["id"],
         username=user_data["username"],
         email=user_data["email"],
@@ -231,11 +263,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         created_at=datetime.utcnow(),
         last_login=datetime.utcnow()
     )
+    token_cache.set(credentials.credentials, user_data["username"], user, payload.get("exp"))
+    return user
 
 def require_role(required_roles: list):
     """Decorator to require specific roles"""
+    allowed_roles = frozenset(required_roles)
+    
     def role_checker(current_user: User = Depends(get_current_user)):
-        if current_user.role not in required_roles:
+        if current_user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Insufficient permissions"
@@ -243,88 +279,109 @@ def require_role(required_roles: list):
         return current_user
     return role_checker
 
+def require_permission(permission: str):
+    """Decorator to require a permission from the role permission table"""
+    def permission_checker(current_user: User = Depends(get_current_user)):
+        if permission not in get_permission_set(current_user.role):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        return current_user
+    return permission_checker
+
 def get_company_info():
     """Get company legal information for payment processing"""
     return COMPANY_INFO
 
+ROLE_PERMISSIONS = {
+    "manager": {
+        "view_dashboard": True,
+        "view_leads": True,
+        "edit_leads": True,
+        "delete_leads": True,
+        "view_orders": True,
+        "edit_orders": True,
+        "view_stock": True,
+        "edit_stock": True,
+        "view_invoices": True,
+        "view_marketing": True,
+        "edit_marketing": True,
+        "view_campaigns": True,
+        "edit_campaigns": True,
+        "manage_users": True,
+        "view_analytics": True,
+        "export_data": True
+    },
+    "agent": {
+        "view_dashboard": True,
+        "view_leads": True,
+        "edit_leads": True,
+        "delete_leads": False,
+        "view_orders": True,
+        "edit_orders": False,
+        "view_stock": True,
+        "edit_stock": False,
+        "view_invoices": True,
+        "view_marketing": False,
+        "edit_marketing": False,
+        "view_campaigns": True,
+        "edit_campaigns": False,
+        "manage_users": False,
+        "view_analytics": True,
+        "export_data": False
+    },
+    "technique": {
+        "view_dashboard": True,
+        "view_leads": True,
+        "edit_leads": False,
+        "delete_leads": False,
+        "view_orders": True,
+        "edit_orders": False,
+        "view_stock": True,
+        "edit_stock": False,
+        "view_invoices": False,
+        "view_marketing": False,
+        "edit_marketing": False,
+        "view_campaigns": False,
+        "edit_campaigns": False,
+        "manage_users": False,
+        "view_analytics": False,
+        "export_data": False
+    },
+    "commercial": {
+        "view_dashboard": True,
+        "view_leads": True,
+        "edit_leads": True,
+        "delete_leads": False,
+        "view_orders": True,
+        "edit_orders": True,
+        "view_stock": True,
+        "edit_stock": False,
+        "view_invoices": True,
+        "view_marketing": True,
+        "edit_marketing": True,
+        "view_campaigns": True,
+        "edit_campaigns": True,
+        "manage_users": False,
+        "view_analytics": True,
+        "export_data": True
+    }
+}
+
+# Granted permissions per role, computed once (set-membership checks)
+ROLE_PERMISSION_SETS = {
+    role: frozenset(name for name, granted in permissions.items() if granted)
+    for role, permissions in ROLE_PERMISSIONS.items()
+}
+
 def get_user_permissions(role: str) -> Dict[str, bool]:
     """Get user permissions based on role"""
-    permissions = {
-        "manager": {
-            "view_dashboard": True,
-            "view_leads": True,
-            "edit_leads": True,
-            "delete_leads": True,
-            "view_orders": True,
-            "edit_orders": True,
-            "view_stock": True,
-            "edit_stock": True,
-            "view_invoices": True,
-            "view_marketing": True,
-            "edit_marketing": True,
-            "view_campaigns": True,
-            "edit_campaigns": True,
-            "manage_users": True,
-            "view_analytics": True,
-            "export_data": True
-        },
-        "agent": {
-            "view_dashboard": True,
-            "view_leads": True,
-            "edit_leads": True,
-            "delete_leads": False,
-            "view_orders": True,
-            "edit_orders": False,
-            "view_stock": True,
-            "edit_stock": False,
-            "view_invoices": True,
-            "view_marketing": False,
-            "edit_marketing": False,
-            "view_campaigns": True,
-            "edit_campaigns": False,
-            "manage_users": False,
-            "view_analytics": True,
-            "export_data": False
-        },
-        "technique": {
-            "view_dashboard": True,
-            "view_leads": True,
-            "edit_leads": False,
-            "delete_leads": False,
-            "view_orders": True,
-            "edit_orders": False,
-            "view_stock": True,
-            "edit_stock": False,
-            "view_invoices": False,
-            "view_marketing": False,
-            "edit_marketing": False,
-            "view_campaigns": False,
-            "edit_campaigns": False,
-            "manage_users": False,
-            "view_analytics": False,
-            "export_data": False
-        },
-        "commercial": {
-            "view_dashboard": True,
-            "view_leads": True,
-            "edit_leads": True,
-            "delete_leads": False,
-            "view_orders": True,
-            "edit_orders": True,
-            "view_stock": True,
-            "edit_stock": False,
-            "view_invoices": True,
-            "view_marketing": True,
-            "edit_marketing": True,
-            "view_campaigns": True,
-            "edit_campaigns": True,
-            "manage_users": False,
-            "view_analytics": True,
-            "export_data": True
-        }
-    }
-    
-    return permissions.get(role, permissions["technique"])
+    return dict(ROLE_PERMISSIONS.get(role, ROLE_PERMISSIONS["technique"]))
+
+def get_permission_set(role: str) -> frozenset:
+    """Granted permission names for a role"""
+    return ROLE_PERMISSION_SETS.get(role, ROLE_PERMISSION_SETS["technique"])
 
 # Initialize default users
 async def init_users_db():
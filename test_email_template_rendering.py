@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark du rendu des emails (séquence prospects + paniers abandonnés)
+Avant: Template() recompilé à chaque message / str.format + concaténation des articles
+Après: registre de templates précompilés (email_templates.py)
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from jinja2 import Template
+
+from email_sequencer_manager import EmailSequencerManager
+from abandoned_cart_service import AbandonedCartService
+
+RECIPIENTS = 10000
+
+
+class OfflineDB:
+    """Base factice: le rendu n'accède pas à MongoDB"""
+
+    def __getattr__(self, name):
+        return None
+
+    def __getitem__(self, name):
+        return None
+
+
+def build_cart(i: int) -> dict:
+    return {
+        "customer_name": f"Client {i}",
+        "total_value": 499.0,
+        "recovery_link": f"https://www.josmoze.com/recovery?token={i}",
+        "recovery_token": str(i),
+        "items": [
+            {"name": "Osmoseur Premium", "quantity": 1, "price": 449.0},
+            {"name": "Kit filtres", "quantity": 2, "price": 25.0}
+        ]
+    }
+
+
+def legacy_format_template(jinja_source: str) -> str:
+    """Reconstituer l'ancien template str.format depuis la source Jinja"""
+    source = re.sub(r"\{% for item in cart\[\"items\"\] %\}.*?\{% endfor %\}", "{cart_items}", jinja_source)
+    return re.sub(r"\{\{ (\w+) \}\}", r"{\1}", source)
+
+
+def test_sequence_rendering_matches_legacy():
+    """Le registre produit le même HTML que Template() à la volée"""
+    manager = EmailSequencerManager(OfflineDB(), suppression_manager=None)
+    context = {"subject": "Sujet", "first_name": "Sarah", "cta_link": "https://x", "unsubscribe_link": "https://u"}
+    for step, config in manager.email_templates.items():
+        expected = Template(config["template"]).render(**context)
+        assert manager.template_registry.render(f"sequence/{step}", **context) == expected
+    print("✅ Rendu séquence identique")
+
+
+def test_template_recompiled_on_change():
+    """Une source modifiée est recompilée, une source identique ne l'est pas"""
+    manager = EmailSequencerManager(OfflineDB(), suppression_manager=None)
+    registry = manager.template_registry
+    assert registry.register("test/partial", "<b>{{ name }}</b>")
+    assert registry.register("test/page", "[{% include 'test/partial' %}]")
+    assert not registry.register("test/partial", "<b>{{ name }}</b>")
+    assert registry.render("test/page", name="a") == "[<b>a</b>]"
+    assert registry.register("test/partial", "<i>{{ name }}</i>")
+    assert registry.render("test/page", name="a") == "[<i>a</i>]"
+    print("✅ Recompilation sur changement (partiels inclus)")
+
+
+def benchmark_sequence():
+    manager = EmailSequencerManager(OfflineDB(), suppression_manager=None)
+    config = manager.email_templates["email1"]
+    contexts = [
+        {"subject": config["subject"], "first_name": f"Prospect {i}",
+         "cta_link": "https://www.josmoze.com/acheter", "unsubscribe_link": f"https://www.josmoze.com/unsubscribe?token={i}"}
+        for i in range(RECIPIENTS)
+    ]
+
+    start = time.perf_counter()
+    for context in contexts:
+        Template(config["template"]).render(**context)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for context in contexts:
+        manager.template_registry.render("sequence/email1", **context)
+    after = time.perf_counter() - start
+    return before, after
+
+
+def benchmark_cart_recovery():
+    service = AbandonedCartService(OfflineDB())
+    legacy_template = legacy_format_template(service.email_templates["reminder"]["template"])
+    carts = [build_cart(i) for i in range(RECIPIENTS)]
+    dates = {"expiry_date": "01/01/2030", "deletion_date": "01/01/2030"}
+
+    start = time.perf_counter()
+    for cart in carts:
+        cart_items_html = ""
+        for item in cart["items"]:
+            cart_items_html += f"""
+                <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #E5E7EB;">
+                    <span>{item.get('name', 'Produit')}</span>
+                    <span>{item.get('quantity', 1)}x {item.get('price', 0)}€</span>
+                </div>
+                """
+        legacy_template.format(
+            customer_name=cart["customer_name"], cart_items=cart_items_html,
+            total_value=cart["total_value"], discounted_total=424.15,
+            recovery_link=cart["recovery_link"], unsubscribe_link="https://u", **dates
+        )
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for cart in carts:
+        service.template_registry.render(
+            "cart_recovery/reminder", cart=cart,
+            customer_name=cart["customer_name"], total_value=cart["total_value"], discounted_total=424.15,
+            recovery_link=cart["recovery_link"], unsubscribe_link="https://u", **dates
+        )
+    after = time.perf_counter() - start
+    return before, after
+
+
+def report(label: str, before: float, after: float):
+    print(f"📊 {label} ({RECIPIENTS} destinataires): "
+          f"avant {before / RECIPIENTS * 1e6:.1f} µs/email, après {after / RECIPIENTS * 1e6:.1f} µs/email "
+          f"(x{before / after:.1f})")
+
+
+if __name__ == "__main__":
+    print("🧪 BENCHMARK RENDU DES EMAILS")
+    print("=" * 50)
+    test_sequence_rendering_matches_legacy()
+    test_template_recompiled_on_change()
+    report("Séquence email1", *benchmark_sequence())
+    report("Panier abandonné (reminder)", *benchmark_cart_recovery())
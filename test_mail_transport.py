@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test du transport SMTP mutualisé (mail_transport.py)
+Serveur SMTP local minimal: réutilisation des connexions, retry sur 4xx,
+5xx relevé tel quel, pas de renvoi après une coupure pendant DATA, et
+comparaison de débit avec une connexion par email.
+"""
+
+import sys
+import time
+import asyncio
+import smtplib
+from pathlib import Path
+from email.mime.text import MIMEText
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from mail_transport import MailTransport, DeliveryUncertainError
+
+
+class LocalSMTPServer:
+    """Serveur SMTP de test (EHLO/MAIL/RCPT/DATA/RSET/QUIT, sans TLS)"""
+
+    def __init__(self, handshake_delay: float = 0.0):
+        self.handshake_delay = handshake_delay  # Simule TCP + STARTTLS + AUTH
+        self.connections = 0
+        self.messages = 0
+        self.reject_rcpt = {}  # email -> liste de codes à renvoyer successivement
+        self.drop_on_mail = 0  # Coupures avant DATA (sur MAIL FROM)
+        self.drop_after_data = 0  # Coupures après réception du message, avant la réponse 250
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.handshake_delay)
+        writer.write(b"220 localhost ESMTP test\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                verb = command[:4].upper()
+                if verb == "MAIL" and self.drop_on_mail:
+                    self.drop_on_mail -= 1
+                    break
+                if verb in ("EHLO", "HELO"):
+                    writer.write(b"250-localhost\r\n250 8BITMIME\r\n")
+                elif verb == "RCPT":
+                    address = command.split(":", 1)[1].strip().strip("<>")
+                    codes = self.reject_rcpt.get(address)
+                    if codes:
+                        code = codes.pop(0)
+                        writer.write(f"{code} rejected\r\n".encode())
+                    else:
+                        writer.write(b"250 OK\r\n")
+                elif verb == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    self.messages += 1
+                    if self.drop_after_data:
+                        self.drop_after_data -= 1
+                        break
+                    writer.write(b"250 OK queued\r\n")
+                elif verb == "QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def build_message(to_email: str) -> MIMEText:
+    msg = MIMEText("Bonjour", "plain", "utf-8")
+    msg["From"] = "contact@josmoze.com"
+    msg["To"] = to_email
+    msg["Subject"] = "Test"
+    return msg
+
+
+async def _send_many(transport: MailTransport, port: int, count: int):
+    await asyncio.gather(*[
+        transport.send_message(build_message(f"client{i}@example.com"), "127.0.0.1", port, use_tls=False)
+        for i in range(count)
+    ])
+
+
+def test_connection_reuse():
+    """Les connexions sont réutilisées et bornées par la taille du pool"""
+    async def run():
+        server = LocalSMTPServer()
+        await server.start()
+        transport = MailTransport(max_connections=4, per_domain_limit=4)
+        await _send_many(transport, server.port, 50)
+        await transport.close()
+        await server.stop()
+        return server
+
+    server = asyncio.run(run())
+    assert server.messages == 50
+    assert server.connections <= 4, server.connections
+    print(f"✅ 50 emails via {server.connections} connexions")
+
+
+def test_transient_retry():
+    """Un 451 est réessayé, un 550 est relevé immédiatement"""
+    async def run():
+        server = LocalSMTPServer()
+        await server.start()
+        server.reject_rcpt["greylist@example.com"] = [451]
+        server.reject_rcpt["unknown@example.com"] = [550, 550, 550, 550]
+        transport = MailTransport(max_connections=2, backoff_base_seconds=0.01)
+
+        result = await transport.send_message(
+            build_message("greylist@example.com"), "127.0.0.1", server.port, use_tls=False
+        )
+        assert result["attempts"] == 2
+
+        try:
+            await transport.send_message(
+                build_message("unknown@example.com"), "127.0.0.1", server.port, use_tls=False
+            )
+            raise AssertionError("550 aurait dû être relevé")
+        except smtplib.SMTPRecipientsRefused as e:
+            # Le séquenceur détecte les hard bounces via "550" dans le message
+            assert "550" in str(e)
+
+        assert server.reject_rcpt["unknown@example.com"] == [550, 550, 550]
+        await transport.close()
+        await server.stop()
+
+    asyncio.run(run())
+    print("✅ Retry 4xx / échec immédiat 5xx")
+
+
+def test_no_resend_after_data():
+    """Coupure avant DATA: réessayée; coupure après DATA: relevée sans renvoi"""
+    async def run():
+        server = LocalSMTPServer()
+        await server.start()
+        transport = MailTransport(max_connections=1, backoff_base_seconds=0.01)
+
+        server.drop_on_mail = 1
+        result = await transport.send_message(
+            build_message("client@example.com"), "127.0.0.1", server.port, use_tls=False
+        )
+        assert result["attempts"] == 2 and server.messages == 1
+
+        server.drop_after_data = 1
+        try:
+            await transport.send_message(
+                build_message("client@example.com"), "127.0.0.1", server.port, use_tls=False
+            )
+            raise AssertionError("La coupure après DATA aurait dû être relevée")
+        except DeliveryUncertainError:
+            pass
+        assert server.messages == 2, server.messages  # Pas de second envoi
+
+        await transport.close()
+        await server.stop()
+
+    asyncio.run(run())
+    print("✅ Coupure avant DATA réessayée, après DATA sans renvoi")
+
+
+def benchmark(count: int = 200, handshake_delay: float = 0.02):
+    """Débit: une connexion par email (ancien code) vs transport mutualisé"""
+    async def run():
+        server = LocalSMTPServer(handshake_delay=handshake_delay)
+        await server.start()
+
+        def send_one_per_connection(i):
+            with smtplib.SMTP("127.0.0.1", server.port) as smtp:
+                smtp.send_message(build_message(f"client{i}@example.com"))
+
+        start = time.perf_counter()
+        for i in range(count):
+            await asyncio.to_thread(send_one_per_connection, i)
+        baseline = time.perf_counter() - start
+
+        transport = MailTransport(max_connections=10, per_domain_limit=10)
+        start = time.perf_counter()
+        await _send_many(transport, server.port, count)
+        pooled = time.perf_counter() - start
+        await transport.close()
+        await server.stop()
+        return baseline, pooled
+
+    baseline, pooled = asyncio.run(run())
+    print(f"📊 {count} emails - 1 connexion/email: {count / baseline:.0f} emails/s, "
+          f"pool: {count / pooled:.0f} emails/s (x{baseline / pooled:.1f})")
+
+
+if __name__ == "__main__":
+    print("🧪 TEST TRANSPORT SMTP MUTUALISÉ")
+    print("=" * 50)
+    test_connection_reuse()
+    test_transient_retry()
+    test_no_resend_after_data()
+    benchmark()
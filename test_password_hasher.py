@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test + benchmark du pool de hachage des mots de passe (password_hasher.py)
+Compare des connexions simultanées avec bcrypt exécuté dans la boucle asyncio
+(ancien code) et via le pool: débit de connexions et latence de la boucle
+(temps pendant lequel les autres requêtes du worker sont bloquées).
+
+Usage: python test_password_hasher.py [connexions_simultanées]
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+import bcrypt
+
+from password_hasher import PasswordHasher, PasswordHasherOverloaded
+
+PASSWORD = "Naima@2024!Commerce"
+
+
+async def check_hash_and_verify():
+    hasher = PasswordHasher(rounds=4, workers=2, max_pending=8)
+    hashed = await hasher.hash(PASSWORD)
+    assert await hasher.verify(PASSWORD, hashed)
+    assert not await hasher.verify("mauvais", hashed)
+    assert not await hasher.verify(PASSWORD, "pas-une-empreinte")
+    # Compatible avec les empreintes existantes (bcrypt/passlib)
+    assert bcrypt.checkpw(PASSWORD.encode(), hashed.encode())
+    hasher.shutdown()
+    print("✅ Hash / vérification")
+
+
+async def check_rehash_on_login():
+    old_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+    hasher = PasswordHasher(rounds=5, workers=2, max_pending=8)
+    assert hasher.needs_rehash(old_hash)
+
+    valid, new_hash = await hasher.verify_and_update(PASSWORD, old_hash)
+    assert valid and new_hash and new_hash.startswith("$2b$05$")
+    assert await hasher.verify(PASSWORD, new_hash)
+
+    valid, again = await hasher.verify_and_update(PASSWORD, new_hash)
+    assert valid and again is None
+    valid, none = await hasher.verify_and_update("mauvais", old_hash)
+    assert not valid and none is None
+    hasher.shutdown()
+    print("✅ Recalcul de l'empreinte quand le coût augmente")
+
+
+async def check_load_shedding():
+    hasher = PasswordHasher(rounds=10, workers=1, max_pending=3)
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=10)).decode()
+    results = await asyncio.gather(*(hasher.verify(PASSWORD, hashed) for _ in range(6)), return_exceptions=True)
+    rejected = [r for r in results if isinstance(r, PasswordHasherOverloaded)]
+    assert len(rejected) == 3 and all(r is True for r in results if r not in rejected), results
+    assert hasher.get_stats()["rejected"] == 3 and hasher.pending == 0
+    hasher.shutdown()
+    print("✅ Rejet au-delà de la file d'attente (503)")
+
+
+def test_hash_and_verify():
+    asyncio.run(check_hash_and_verify())
+
+
+def test_rehash_on_login():
+    asyncio.run(check_rehash_on_login())
+
+
+def test_load_shedding():
+    asyncio.run(check_load_shedding())
+
+
+async def measure(login, logins: int):
+    """Débit des connexions + pire blocage de la boucle vu par une tâche témoin"""
+    stalls = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stalls.append(time.perf_counter() - start - 0.005)
+
+    watcher = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await watcher
+    return logins / elapsed, max(stalls) * 1000
+
+
+async def benchmark(logins: int):
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=12)).decode()
+    hasher = PasswordHasher(rounds=12, max_pending=logins)
+
+    async def inline_login():
+        # Ancien code: bcrypt dans le handler async
+        assert bcrypt.checkpw(PASSWORD.encode(), hashed.encode())
+
+    async def pooled_login():
+        assert await hasher.verify(PASSWORD, hashed)
+
+    before = await measure(inline_login, logins)
+    after = await measure(pooled_login, logins)
+    hasher.shutdown()
+
+    print(f"📊 {logins} connexions simultanées (bcrypt coût 12, {hasher.workers} threads)")
+    print(f"   avant: {before[0]:.1f} connexions/s, boucle bloquée jusqu'à {before[1]:.0f} ms")
+    print(f"   après: {after[0]:.1f} connexions/s, boucle bloquée jusqu'à {after[1]:.0f} ms")
+
+
+if __name__ == "__main__":
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+
+    print("🧪 POOL DE HACHAGE DES MOTS DE PASSE")
+    print("=" * 50)
+    test_hash_and_verify()
+    test_rehash_on_login()
+    test_load_shedding()
+    asyncio.run(benchmark(logins))
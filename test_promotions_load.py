@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test de charge des codes promo (PromotionsSystem.apply_promotion)
+1000 clients utilisent en même temps un code limité à 100 utilisations:
+exactement 100 doivent réussir (pas de dépassement de usage_limit).
+Vérifie aussi la limite par client et le rejeu idempotent d'une commande.
+
+Usage: python test_promotions_load.py [utilisations_simultanées] [limite]
+MongoDB doit écouter sur MONGO_URL (défaut mongodb://localhost:27017);
+la base josmoze_promotions_load_test est supprimée à la fin.
+"""
+
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from promotions_system import PromotionsSystem
+
+TEST_DB_NAME = "josmoze_promotions_load_test"
+
+
+async def create_code(promotions, code: str, usage_limit: int, per_customer: int = 1):
+    await promotions.create_promotion({
+        "code": code,
+        "name": f"Test {code}",
+        "description": "Code de test de charge",
+        "type": "percentage",
+        "value": 10.0,
+        "usage_limit": usage_limit,
+        "usage_limit_per_customer": per_customer
+    }, created_by="test_promotions_load")
+
+
+async def check_global_limit(promotions, db, redemptions: int, limit: int):
+    await create_code(promotions, "LANCEMENT", limit)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        promotions.apply_promotion("LANCEMENT", f"client{i}@test.fr", 100.0, order_id=f"CMD-{i}")
+        for i in range(redemptions)
+    ))
+    elapsed = time.perf_counter() - start
+
+    accepted = sum(result["valid"] for result in results)
+    promo = await db.promotions.find_one({"code": "LANCEMENT"})
+    usages = await db.promotion_usage.count_documents({"promotion_code": "LANCEMENT"})
+    assert accepted == limit, f"{accepted} utilisations acceptées pour une limite de {limit}"
+    assert promo["used_count"] == limit and usages == limit, (promo["used_count"], usages)
+    print(f"✅ {redemptions} utilisations simultanées: {accepted} acceptées pour une limite de {limit} "
+          f"({redemptions / elapsed:.0f} utilisations/s)")
+
+
+async def check_per_customer_limit(promotions, db):
+    await create_code(promotions, "FIDELE2", 1000, per_customer=2)
+    results = await asyncio.gather(*(
+        promotions.apply_promotion("FIDELE2", "meme.client@test.fr", 100.0, order_id=f"CMD-{i}")
+        for i in range(20)
+    ))
+    assert sum(result["valid"] for result in results) == 2
+    promo = await db.promotions.find_one({"code": "FIDELE2"})
+    assert promo["used_count"] == 2, promo["used_count"]
+    print("✅ Limite par client respectée sous concurrence")
+
+
+async def check_order_replay_is_idempotent(promotions, db):
+    await create_code(promotions, "REJEU", 10)
+    results = await asyncio.gather(*(
+        promotions.apply_promotion("REJEU", "rejeu@test.fr", 80.0, order_id="CMD-REJEU")
+        for _ in range(10)
+    ))
+    assert all(result["valid"] for result in results)
+    assert len({result["final_amount"] for result in results}) == 1
+    promo = await db.promotions.find_one({"code": "REJEU"})
+    assert promo["used_count"] == 1, promo["used_count"]
+    print("✅ Commande rejouée: une seule utilisation comptée")
+
+
+async def main(redemptions: int, limit: int):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), maxPoolSize=100)
+    db = client[TEST_DB_NAME]
+    try:
+        promotions = PromotionsSystem(db)
+        await promotions.initialize()
+        await check_global_limit(promotions, db, redemptions, limit)
+        await check_per_customer_limit(promotions, db)
+        await check_order_replay_is_idempotent(promotions, db)
+    finally:
+        await client.drop_database(TEST_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    redemptions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    print("🧪 CODES PROMO SOUS CHARGE")
+    print("=" * 50)
+    asyncio.run(main(redemptions, limit))
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Benchmark du moteur de recommandations (recommendation_engine.py)
+Jeu de données synthétique de 100k commandes: latence d'un calcul de
+recommandations avec l'ancien chemin (lecture des commandes par produit et
+par client similaire) et avec l'index de co-achat en mémoire.
+
+Usage: python test_recommendations_benchmark.py [commandes] [requêtes]
+MongoDB doit écouter sur MONGO_URL (défaut mongodb://localhost:27017);
+la base josmoze_recommendations_benchmark est supprimée à la fin.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import statistics
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import recommendation_engine
+from recommendation_engine import ProductRecommendationEngine, CoPurchaseIndex, record_order_for_recommendations
+
+TEST_DB_NAME = "josmoze_recommendations_benchmark"
+
+CATALOGUE = [
+    {"id": "osmoseur-essentiel", "name": "Osmoseur Essentiel", "price": 449.0, "category": "osmoseur", "target_audience": "B2C"},
+    {"id": "osmoseur-premium", "name": "Osmoseur Premium", "price": 549.0, "category": "osmoseur", "target_audience": "both"},
+    {"id": "osmoseur-prestige", "name": "Osmoseur Prestige", "price": 899.0, "category": "osmoseur", "target_audience": "B2B"},
+    {"id": "purificateur-portable-hydrogene", "name": "Purificateur Hydrogène", "price": 79.0, "category": "purificateur", "target_audience": "B2C"},
+    {"id": "fontaine-eau-animaux", "name": "Fontaine Animaux", "price": 49.0, "category": "animaux", "target_audience": "B2C"},
+    {"id": "sac-transport-osmoseur", "name": "Sac de transport", "price": 29.0, "category": "accessoire", "target_audience": "both"},
+    {"id": "filtres-rechange", "name": "Filtres de rechange", "price": 49.0, "category": "consommable", "target_audience": "both"},
+    {"id": "membrane-osmose", "name": "Membrane d'osmose", "price": 89.0, "category": "consommable", "target_audience": "both"},
+    {"id": "mineralisateur", "name": "Cartouche reminéralisante", "price": 39.0, "category": "consommable", "target_audience": "B2C"},
+    {"id": "robinet-col-cygne", "name": "Robinet col de cygne", "price": 59.0, "category": "accessoire", "target_audience": "both"},
+    {"id": "pompe-surpresseur", "name": "Pompe surpresseur", "price": 129.0, "category": "accessoire", "target_audience": "both"},
+    {"id": "contrat-entretien", "name": "Contrat d'entretien", "price": 149.0, "category": "service", "target_audience": "B2B"},
+]
+for product in CATALOGUE:
+    product["in_stock"] = True
+
+
+class BenchmarkEngine(ProductRecommendationEngine):
+    """Moteur actuel, catalogue synthétique (sans importer server.py)"""
+
+    async def _get_products_data(self):
+        return CATALOGUE
+
+
+class LegacyEngine(BenchmarkEngine):
+    """Ancien chemin de calcul (avant l'index de co-achat), repris tel quel"""
+
+    async def _calculate_recommendations(self, customer_id, current_cart, customer_type, context):
+        products = await self._get_products_data()
+        customer_history = await self._get_customer_history(customer_id) if customer_id else []
+        similar_customers = await self._legacy_similar_customers(customer_id, customer_history) if customer_id else []
+
+        product_scores = {}
+        cart_product_ids = [item.get('product_id', item.get('id')) for item in (current_cart or [])]
+        for product in products:
+            product_id = product['id']
+            if product_id in cart_product_ids:
+                continue
+            collaborative_score = await self._legacy_collaborative_score(product_id, similar_customers)
+            content_score = await self._legacy_content_similarity_score(product_id, cart_product_ids, customer_history)
+            popularity_score = await self._legacy_popularity_score(product_id)
+            business_score = await self._calculate_business_rules_score(product, customer_type, context)
+            final_score = (
+                collaborative_score * self.config["collaborative_weight"] +
+                content_score * self.config["content_weight"] +
+                popularity_score * self.config["popularity_weight"] +
+                business_score * self.config["business_rules_weight"]
+            )
+            if final_score >= self.config["min_confidence"]:
+                product_scores[product_id] = {"product": product, "score": final_score}
+
+        return sorted(product_scores.values(), key=lambda x: x["score"], reverse=True)[:self.config["max_recommendations"]]
+
+    async def _legacy_collaborative_score(self, product_id, similar_customers):
+        score = 0.0
+        total_weight = 0.0
+        for similar_customer in similar_customers:
+            customer_orders = await self.db.orders.find({
+                "customer_email": similar_customer["email"],
+                "status": "completed"
+            }).to_list(None)
+            has_product = any(
+                item.get("product_id") == product_id
+                for order in customer_orders for item in order.get("items", [])
+            )
+            if has_product:
+                similarity = similar_customer.get("similarity", 0.5)
+                score += similarity
+                total_weight += similarity
+        return score / total_weight if total_weight > 0 else 0.0
+
+    async def _legacy_content_similarity_score(self, product_id, cart_product_ids, customer_history):
+        if not cart_product_ids and not customer_history:
+            return 0.0
+        target_product = await self._get_product_by_id(product_id)
+        similarity_scores = []
+        for cart_product_id in cart_product_ids:
+            cart_product = await self._get_product_by_id(cart_product_id)
+            if cart_product:
+                similarity_scores.append(self._calculate_product_similarity(target_product, cart_product))
+        for history_item in customer_history:
+            history_product = await self._get_product_by_id(history_item.get("product_id"))
+            if history_product:
+                similarity = self._calculate_product_similarity(target_product, history_product)
+                similarity_scores.append(similarity * self._calculate_recency_weight(history_item.get("date")))
+        return max(similarity_scores) if similarity_scores else 0.0
+
+    async def _legacy_popularity_score(self, product_id):
+        cutoff_date = datetime.now() - timedelta(days=self.config["recency_days"])
+        orders = await self.db.orders.find({
+            "created_at": {"$gte": cutoff_date},
+            "status": "completed"
+        }).to_list(None)
+        product_sales = 0
+        total_sales = 0
+        for order in orders:
+            for item in order.get("items", []):
+                if item.get("product_id") == product_id:
+                    product_sales += item.get("quantity", 1)
+                total_sales += item.get("quantity", 1)
+        return product_sales / total_sales if total_sales > 0 else 0.0
+
+    async def _legacy_similar_customers(self, customer_id, customer_history):
+        customer_products = set(item["product_id"] for item in customer_history)
+        orders = await self.db.orders.find({
+            "customer_email": {"$ne": customer_id},
+            "status": "completed"
+        }).to_list(None)
+        similarities = {}
+        for order in orders:
+            other_customer = order.get("customer_email")
+            other_products = set(item.get("product_id") for item in order.get("items", []))
+            common = len(customer_products & other_products)
+            if other_customer and common > 0:
+                data = similarities.setdefault(other_customer, {"email": other_customer, "common_products": 0, "total_products": 0})
+                data["common_products"] += common
+                data["total_products"] += len(other_products)
+        similar = []
+        for data in similarities.values():
+            data["similarity"] = data["common_products"] / (len(customer_products) + data["total_products"] - data["common_products"])
+            if data["similarity"] > 0.1:
+                similar.append(data)
+        return sorted(similar, key=lambda x: x["similarity"], reverse=True)[:10]
+
+
+def synthetic_orders(count: int, customers: int, seed: int = 42):
+    """Commandes sur 180 jours: un osmoseur souvent accompagné de consommables"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    main_products = [p["id"] for p in CATALOGUE[:5]]
+    extras = [p["id"] for p in CATALOGUE[5:]]
+    for i in range(count):
+        product_ids = {rng.choice(main_products)} | set(rng.sample(extras, rng.randint(0, 3)))
+        yield {
+            "id": f"order-{i}",
+            "customer_email": f"client{rng.randrange(customers)}@test.fr",
+            "items": [{"product_id": pid, "quantity": rng.randint(1, 2)} for pid in product_ids],
+            "status": "completed" if rng.random() < 0.9 else "pending",
+            "created_at": now - timedelta(days=rng.random() * 180)
+        }
+
+
+async def load_orders(db, count: int, customers: int):
+    batch = []
+    for order in synthetic_orders(count, customers):
+        batch.append(order)
+        if len(batch) == 5000:
+            await db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        await db.orders.insert_many(batch)
+    # Meilleur cas pour l'ancien chemin
+    await db.orders.create_index("customer_email")
+    await db.orders.create_index("created_at")
+
+
+def sample_requests(count: int, customers: int, seed: int = 7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        cart = [{"product_id": rng.choice(CATALOGUE)["id"]}]
+        yield f"client{rng.randrange(customers)}@test.fr", cart
+
+
+async def time_requests(engine, requests):
+    latencies = []
+    for customer_id, cart in requests:
+        start = time.perf_counter()
+        # Sans le cache de résultats du moteur: seul le calcul est mesuré
+        await engine._calculate_recommendations(customer_id, cart, "B2C", None)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms"
+
+
+async def main(orders: int, requests: int):
+    customers = max(1, orders // 5)
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), maxPoolSize=100)
+    db = client[TEST_DB_NAME]
+    try:
+        await db.orders.drop()
+        start = time.perf_counter()
+        await load_orders(db, orders, customers)
+        print(f"📦 {orders} commandes synthétiques ({customers} clients) chargées en {time.perf_counter() - start:.1f} s")
+
+        # Index: construction unique, puis mise à jour incrémentale
+        recommendation_engine.co_purchase_index = None
+        start = time.perf_counter()
+        await recommendation_engine.get_co_purchase_index(db)
+        print(f"🏗️  Index de co-achat construit en {time.perf_counter() - start:.1f} s")
+
+        new_order = {"id": "order-new", "customer_email": "client0@test.fr", "status": "paid",
+                     "items": [{"product_id": "osmoseur-premium", "quantity": 1}], "created_at": datetime.now()}
+        start = time.perf_counter()
+        record_order_for_recommendations(new_order)
+        print(f"➕ Nouvelle commande intégrée en {(time.perf_counter() - start) * 1e6:.0f} µs")
+
+        # L'ancien chemin est très lent: moins de requêtes mesurées
+        legacy_requests = max(1, requests // 20)
+        legacy = await time_requests(LegacyEngine(db), sample_requests(legacy_requests, customers))
+        indexed = await time_requests(BenchmarkEngine(db), sample_requests(requests, customers))
+
+        assert isinstance(recommendation_engine.co_purchase_index, CoPurchaseIndex)
+        print(f"📊 {orders} commandes")
+        print(f"   avant: {summarize(legacy)} ({legacy_requests} requêtes)")
+        print(f"   après: {summarize(indexed)} ({requests} requêtes)")
+        print(f"   gain médian: x{statistics.median(legacy) / statistics.median(indexed):.0f}")
+    finally:
+        await client.drop_database(TEST_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print("🧪 BENCHMARK RECOMMANDATIONS")
+    print("=" * 50)
+    asyncio.run(main(orders, requests))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test de charge du SecurityMiddleware
+1000 clients concurrents (une IP chacun) sur une application minimale,
+latence p50/p95/p99 avec Redis (script Lua, un aller-retour) et sans Redis
+(fallback mémoire).
+
+Usage: python test_security_middleware_load.py [clients] [requêtes_par_client]
+Redis doit écouter sur localhost:6379 pour la mesure "avec Redis".
+"""
+
+import sys
+import time
+import asyncio
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+import httpx
+from fastapi import FastAPI
+
+import security_middleware
+from security_middleware import SecurityMiddleware, async_redis_client
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(SecurityMiddleware)
+
+    @app.get("/api/products")
+    async def products():
+        return {"products": []}
+
+    return app
+
+
+async def run_load(clients: int, requests_per_client: int) -> list:
+    latencies = []
+    transport = httpx.ASGITransport(app=build_app())
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as http:
+        async def client(i: int):
+            headers = {
+                "X-Forwarded-For": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                "User-Agent": "josmoze-load-test/1.0"
+            }
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                response = await http.get("/api/products", headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(i) for i in range(clients)])
+        elapsed = time.perf_counter() - start
+
+    print(f"   {len(latencies)} requêtes en {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s)")
+    return latencies
+
+
+def report(label: str, latencies: list):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"📊 {label}: p50 {quantiles[49] * 1000:.1f} ms, "
+          f"p95 {quantiles[94] * 1000:.1f} ms, p99 {quantiles[98] * 1000:.1f} ms")
+
+
+async def redis_reachable() -> bool:
+    try:
+        return await async_redis_client.ping()
+    except Exception:
+        return False
+
+
+async def main(clients: int, requests_per_client: int):
+    print(f"🧪 TEST DE CHARGE SECURITY MIDDLEWARE - {clients} clients x {requests_per_client} requêtes")
+    print("=" * 60)
+
+    security_middleware.REDIS_AVAILABLE = False
+    report("Sans Redis (mémoire)", await run_load(clients, requests_per_client))
+
+    if await redis_reachable():
+        security_middleware.REDIS_AVAILABLE = True
+        report("Avec Redis (async + Lua)", await run_load(clients, requests_per_client))
+    else:
+        print("⚠️ Redis indisponible sur localhost:6379 - mesure avec Redis ignorée")
+
+    await security_middleware.close_redis()
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    requests_per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(clients, requests_per_client))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test de contention des réservations de stock (InventoryManager)
+Des milliers de réservations simultanées sur un seul produit: le nombre
+d'unités réservées ne doit jamais dépasser le stock (pas de survente).
+Vérifie aussi la réservation de panier tout-ou-rien et la libération des
+réservations expirées.
+
+Usage: python test_stock_reservations.py [réservations_simultanées]
+MongoDB doit écouter sur MONGO_URL (défaut mongodb://localhost:27017);
+la base josmoze_stock_stress_test est supprimée à la fin.
+"""
+
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src" / "josmoze_ecommerce" / "backend" / "services"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from inventory_manager import InventoryManager, StockItem
+
+TEST_DB_NAME = "josmoze_stock_stress_test"
+
+
+async def reset_stock(db, stocks):
+    await db.stock_items.delete_many({})
+    await db.stock_reservations.delete_many({})
+    for product_id, stock in stocks.items():
+        item = StockItem(product_id=product_id, name=product_id, current_stock=stock, available_stock=stock)
+        await db.stock_items.insert_one(item.dict())
+
+
+async def check_no_oversell(manager, db, reservations: int, stock: int = 50):
+    await reset_stock(db, {"osmoseur-premium": stock})
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(manager.reserve_stock("osmoseur-premium", 1) for _ in range(reservations)))
+    elapsed = time.perf_counter() - start
+
+    succeeded = [r for r in results if r["success"]]
+    item = await db.stock_items.find_one({"product_id": "osmoseur-premium"})
+    assert len(succeeded) == stock, f"{len(succeeded)} réservations acceptées pour {stock} unités"
+    assert item["available_stock"] == 0 and item["reserved_stock"] == stock, item
+    assert len(item["holds"]) == stock
+    assert len({r["reservation_id"] for r in succeeded}) == stock
+    print(f"✅ {reservations} réservations simultanées: {len(succeeded)} acceptées pour {stock} unités "
+          f"({reservations / elapsed:.0f} réservations/s)")
+
+
+async def check_cart_all_or_nothing(manager, db):
+    await reset_stock(db, {"osmoseur-essentiel": 10, "filtres-rechange": 1})
+    cart = [
+        {"product_id": "osmoseur-essentiel", "quantity": 2},
+        {"product_id": "filtres-rechange", "quantity": 1},
+        {"product_id": "garantie-2ans", "quantity": 1}  # Service: non réservé
+    ]
+
+    results = await asyncio.gather(*(manager.reserve_items(cart) for _ in range(20)))
+    assert sum(r["success"] for r in results) == 1, results
+
+    # Les paniers refusés n'ont rien gardé (compensation)
+    essentiel = await db.stock_items.find_one({"product_id": "osmoseur-essentiel"})
+    assert essentiel["available_stock"] == 8 and essentiel["reserved_stock"] == 2, essentiel
+
+    # Confirmation: le stock physique diminue, la réservation disparaît
+    reservation_id = next(r["reservation_id"] for r in results if r["success"])
+    assert (await manager.confirm_reservation(reservation_id))["success"]
+    assert not (await manager.confirm_reservation(reservation_id))["success"]  # Idempotent
+    essentiel = await db.stock_items.find_one({"product_id": "osmoseur-essentiel"})
+    assert essentiel["current_stock"] == 8 and essentiel["reserved_stock"] == 0 and essentiel["holds"] == []
+    print("✅ Panier tout-ou-rien + confirmation")
+
+
+async def check_expired_holds_released(manager, db):
+    await reset_stock(db, {"osmoseur-prestige": 3})
+    held = await manager.reserve_stock("osmoseur-prestige", 3, ttl_seconds=1)
+    assert held["success"]
+    assert not (await manager.reserve_stock("osmoseur-prestige", 1))["success"]
+
+    await asyncio.sleep(1.1)
+    assert await manager.release_expired_reservations() == 1
+    assert await manager.release_expired_reservations() == 0
+    item = await db.stock_items.find_one({"product_id": "osmoseur-prestige"})
+    assert item["available_stock"] == 3 and item["reserved_stock"] == 0 and item["holds"] == [], item
+    assert not (await manager.release_reservation(held["reservation_id"]))["success"]
+    print("✅ Réservations expirées libérées")
+
+
+async def check_checkout_backorder(manager, db):
+    await reset_stock(db, {"osmoseur-essentiel": 1})
+    cart = [{"product_id": "osmoseur-essentiel", "quantity": 3}]
+    assert not (await manager.reserve_items(cart))["success"]
+
+    # Paiement: le catalogue est affiché en stock, le manque est réservé en rupture
+    result = await manager.reserve_items(cart, allow_backorder=True)
+    assert result["success"] and result["items"][0]["backordered"], result
+    item = await db.stock_items.find_one({"product_id": "osmoseur-essentiel"})
+    assert item["available_stock"] == -2 and item["reserved_stock"] == 3, item
+
+    assert (await manager.release_reservation(result["reservation_id"]))["success"]
+    item = await db.stock_items.find_one({"product_id": "osmoseur-essentiel"})
+    assert item["available_stock"] == 1 and item["reserved_stock"] == 0 and item["holds"] == [], item
+    print("✅ Rupture réservée au paiement puis libérée")
+
+
+async def main(reservations: int):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), maxPoolSize=100)
+    db = client[TEST_DB_NAME]
+    manager = InventoryManager(db)
+    try:
+        await check_no_oversell(manager, db, reservations)
+        await check_cart_all_or_nothing(manager, db)
+        await check_expired_holds_released(manager, db)
+        await check_checkout_backorder(manager, db)
+    finally:
+        await client.drop_database(TEST_DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    reservations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print("🧪 RÉSERVATIONS DE STOCK CONCURRENTES")
+    print("=" * 50)
+    asyncio.run(main(reservations))